@@ -0,0 +1,165 @@
+"""
+API路由 - 患者/检查层级浏览
+只读取入库时维护的 patients / studies 汇总表
+"""
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import or_, select, func
+
+from app.db.database import get_async_db
+from app.db.models import Patient, Study, Series
+from app.schemas.series import PatientResponse, StudyResponse, SeriesResponse
+
+router = APIRouter()
+
+
+def _modality_filters(column, modalities: Optional[str]) -> list:
+    """modalities=CT,MR 表示同时包含CT和MR"""
+    if not modalities:
+        return []
+    return [column.contains(f"|{m.strip()}|") for m in modalities.split(",") if m.strip()]
+
+
+def _patient_filters(
+    patient_id: Optional[str],
+    patient_name: Optional[str],
+    modalities: Optional[str],
+    study_date_from: Optional[str],
+    study_date_to: Optional[str],
+) -> list:
+    conditions = _modality_filters(Patient.modalities, modalities)
+    if patient_id:
+        conditions.append(Patient.patient_id.contains(patient_id))
+    if patient_name:
+        conditions.append(Patient.patient_name.contains(patient_name))
+    if study_date_from:
+        conditions.append(Patient.last_study_date >= study_date_from)
+    if study_date_to:
+        conditions.append(Patient.first_study_date <= study_date_to)
+    return conditions
+
+
+# ========== 患者 ==========
+
+@router.get("/patients", response_model=List[PatientResponse])
+async def get_patients(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    patient_id: Optional[str] = None,
+    patient_name: Optional[str] = None,
+    modalities: Optional[str] = Query(None, description="逗号分隔，须全部包含，如 CT,MR"),
+    study_date_from: Optional[str] = None,
+    study_date_to: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """患者列表（按最近检查日期倒序）"""
+    conditions = _patient_filters(patient_id, patient_name, modalities, study_date_from, study_date_to)
+    offset = (page - 1) * page_size
+    stmt = (
+        select(Patient).where(*conditions)
+        .order_by(Patient.last_study_date.desc(), Patient.patient_id)
+        .offset(offset).limit(page_size)
+    )
+    result = await db.execute(stmt)
+    return result.scalars().all()
+
+
+@router.get("/patients/count")
+async def get_patients_count(
+    patient_id: Optional[str] = None,
+    patient_name: Optional[str] = None,
+    modalities: Optional[str] = None,
+    study_date_from: Optional[str] = None,
+    study_date_to: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """患者总数"""
+    conditions = _patient_filters(patient_id, patient_name, modalities, study_date_from, study_date_to)
+    stmt = select(func.count()).select_from(Patient).where(*conditions)
+    return {"total": await db.scalar(stmt)}
+
+
+@router.get("/patients/{patient_id}", response_model=PatientResponse)
+async def get_patient(patient_id: str, db: AsyncSession = Depends(get_async_db)):
+    """患者详情"""
+    patient = await db.get(Patient, patient_id)
+    if not patient:
+        raise HTTPException(status_code=404, detail="患者不存在")
+    return patient
+
+
+@router.get("/patients/{patient_id}/studies", response_model=List[StudyResponse])
+async def get_patient_studies(
+    patient_id: str,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """患者的检查列表（按检查日期倒序）
+
+    包含该患者有序列的全部检查（与 study_count 一致），不只是以其为主患者的检查
+    """
+    offset = (page - 1) * page_size
+    if patient_id:
+        patient_series = Series.patient_id == patient_id
+    else:
+        patient_series = or_(Series.patient_id.is_(None), Series.patient_id == "")
+    study_uids = select(func.coalesce(Series.study_instance_uid, "")).where(
+        patient_series, Series.is_active == True
+    )
+    stmt = (
+        select(Study).where(Study.study_instance_uid.in_(study_uids))
+        .order_by(Study.study_date.desc()).offset(offset).limit(page_size)
+    )
+    result = await db.execute(stmt)
+    return result.scalars().all()
+
+
+# ========== 检查 ==========
+
+@router.get("/studies", response_model=List[StudyResponse])
+async def get_studies(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    modalities: Optional[str] = Query(None, description="逗号分隔，须全部包含，如 CT,MR"),
+    study_date_from: Optional[str] = None,
+    study_date_to: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """检查列表（按检查日期倒序）"""
+    conditions = _modality_filters(Study.modalities, modalities)
+    if study_date_from:
+        conditions.append(Study.study_date >= study_date_from)
+    if study_date_to:
+        conditions.append(Study.study_date <= study_date_to)
+
+    offset = (page - 1) * page_size
+    stmt = (
+        select(Study).where(*conditions)
+        .order_by(Study.study_date.desc(), Study.study_instance_uid)
+        .offset(offset).limit(page_size)
+    )
+    result = await db.execute(stmt)
+    return result.scalars().all()
+
+
+@router.get("/studies/{study_uid}", response_model=StudyResponse)
+async def get_study(study_uid: str, db: AsyncSession = Depends(get_async_db)):
+    """检查详情"""
+    study = await db.get(Study, study_uid)
+    if not study:
+        raise HTTPException(status_code=404, detail="检查不存在")
+    return study
+
+
+@router.get("/studies/{study_uid}/series", response_model=List[SeriesResponse])
+async def get_study_series(study_uid: str, db: AsyncSession = Depends(get_async_db)):
+    """检查下的序列（按序列号）"""
+    stmt = (
+        select(Series)
+        .where(Series.study_instance_uid == study_uid, Series.is_active == True)
+        .order_by(Series.series_number)
+    )
+    result = await db.execute(stmt)
+    return result.scalars().all()
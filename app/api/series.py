@@ -1,19 +1,29 @@
 """
 API路由 - 序列管理
 """
+import os
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import or_, select, func
 
-from app.db.database import get_db
-from app.db.models import Series, ScanConfig, FilterRule, Scan
+from app.db.database import get_db, get_async_db, SessionLocal
+from app.db.models import Series, SeriesPath, ScanConfig, FilterRule, Scan
 from app.schemas.series import (
-    SeriesResponse, ScanCreate, ScanResponse,
+    SeriesResponse, ScanCreate, ScanResponse, ScanDetailResponse,
     ScanConfigResponse, FilterRuleCreate, FilterRuleResponse,
-    ExportRequest, ExportResponse
+    ExportRequest, ExportResponse, WatchStatusResponse
 )
+from app.services import catalog_export
+from app.services.catalog_export import EXPORT_FORMATS, series_filters
 from app.services.scan_service import ScanService, ExportService
+from app.services.multi_scan import MultiRootScanner
+from app.services.distributed_scan import DistributedScanService
+from app.services.watch_service import watch_manager
+from app.services.thumbnail_service import ThumbnailError, series_thumbnail
+from app.services.anonymizer import Anonymizer, AnonymizeError
 
 router = APIRouter()
 
@@ -21,7 +31,7 @@ router = APIRouter()
 # ========== 序列查询 ==========
 
 @router.get("/series", response_model=List[SeriesResponse])
-def get_series(
+async def get_series(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
     patient_id: Optional[str] = None,
@@ -30,66 +40,127 @@ def get_series(
     protocol_name: Optional[str] = None,
     study_date_from: Optional[str] = None,
     study_date_to: Optional[str] = None,
-    db: Session = Depends(get_db)
+    geometry_ok: Optional[bool] = Query(None, description="方向一致且无缺层、重复层"),
+    max_slice_spacing: Optional[float] = Query(None, description="层间距上限(mm)"),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取序列列表（支持分页和筛选）"""
-    query = db.query(Series).filter(Series.is_active == True)
-
-    if patient_id:
-        query = query.filter(Series.patient_id.contains(patient_id))
-    if patient_name:
-        query = query.filter(Series.patient_name.contains(patient_name))
-    if modality:
-        query = query.filter(Series.modality == modality)
-    if protocol_name:
-        query = query.filter(Series.protocol_name.contains(protocol_name))
-    if study_date_from:
-        query = query.filter(Series.study_date >= study_date_from)
-    if study_date_to:
-        query = query.filter(Series.study_date <= study_date_to)
+    conditions = series_filters(
+        patient_id, patient_name, modality, protocol_name, study_date_from, study_date_to,
+        geometry_ok, max_slice_spacing,
+    )
 
     # 分页
     offset = (page - 1) * page_size
-    series_list = query.order_by(Series.created_at.desc()).offset(offset).limit(page_size).all()
-
-    return series_list
+    stmt = (
+        select(Series).where(*conditions)
+        .order_by(Series.created_at.desc()).offset(offset).limit(page_size)
+    )
+    result = await db.execute(stmt)
+    return result.scalars().all()
 
 
 @router.get("/series/count")
-def get_series_count(
+async def get_series_count(
     patient_id: Optional[str] = None,
     patient_name: Optional[str] = None,
     modality: Optional[str] = None,
-    db: Session = Depends(get_db)
+    geometry_ok: Optional[bool] = None,
+    max_slice_spacing: Optional[float] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取序列总数"""
-    query = db.query(Series).filter(Series.is_active == True)
+    conditions = series_filters(patient_id, patient_name, modality,
+                                geometry_ok=geometry_ok, max_slice_spacing=max_slice_spacing)
+    stmt = select(func.count(Series.id)).where(*conditions)
+    return {"total": await db.scalar(stmt)}
 
-    if patient_id:
-        query = query.filter(Series.patient_id.contains(patient_id))
-    if patient_name:
-        query = query.filter(Series.patient_name.contains(patient_name))
-    if modality:
-        query = query.filter(Series.modality == modality)
 
-    return {"total": query.count()}
+@router.get("/series/export")
+def export_catalog(
+    format: str = Query("ndjson", description="ndjson/csv/parquet/arrow"),
+    include_paths: bool = Query(False, description="附带每个序列的全部实例路径"),
+    patient_id: Optional[str] = None,
+    patient_name: Optional[str] = None,
+    modality: Optional[str] = None,
+    protocol_name: Optional[str] = None,
+    study_date_from: Optional[str] = None,
+    study_date_to: Optional[str] = None,
+    geometry_ok: Optional[bool] = None,
+    max_slice_spacing: Optional[float] = None,
+):
+    """流式批量导出筛选后的序列目录"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的导出格式: {format}")
+
+    conditions = series_filters(
+        patient_id, patient_name, modality, protocol_name, study_date_from, study_date_to,
+        geometry_ok, max_slice_spacing,
+    )
+    # 响应是流式的，会话在生成器内部管理，随导出结束关闭
+    db = SessionLocal()
+    try:
+        chunks = catalog_export.export_catalog(db, format, conditions, include_paths)
+    except ValueError as e:
+        db.close()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def stream():
+        try:
+            yield from chunks
+        finally:
+            db.close()
+
+    filename = f"series_export.{format}"
+    return StreamingResponse(
+        stream(),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 @router.get("/series/{series_id}", response_model=SeriesResponse)
-def get_series_by_id(series_id: str, db: Session = Depends(get_db)):
+async def get_series_by_id(series_id: str, db: AsyncSession = Depends(get_async_db)):
     """根据ID获取序列详情"""
-    series = db.query(Series).filter(Series.id == series_id).first()
+    series = await db.get(Series, series_id)
     if not series:
         raise HTTPException(status_code=404, detail="序列不存在")
     return series
 
 
+@router.get("/series/{series_id}/thumbnail")
+def get_series_thumbnail(
+    series_id: str,
+    size: int = Query(256, ge=32, le=1024, description="长边像素"),
+    db: Session = Depends(get_db)
+):
+    """序列缩略图（中间层PNG，首次请求生成后缓存）"""
+    series = db.query(Series).filter(Series.id == series_id).first()
+    if not series:
+        raise HTTPException(status_code=404, detail="序列不存在")
+
+    def load_instances():
+        # 只在缓存未命中时读取全部实例
+        rows = db.query(SeriesPath.file_path, SeriesPath.instance_number).filter(
+            SeriesPath.series_id == series_id
+        ).all()
+        return [(series.file_path, series.instance_number)] + [tuple(row) for row in rows]
+
+    try:
+        png = series_thumbnail(series.id, series.file_count or 0, load_instances, size)
+    except ThumbnailError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return Response(content=png, media_type="image/png",
+                    headers={"Cache-Control": "private, max-age=86400"})
+
+
 # ========== 扫描配置管理 ==========
 
 @router.get("/configs", response_model=List[ScanConfigResponse])
-def get_configs(db: Session = Depends(get_db)):
+async def get_configs(db: AsyncSession = Depends(get_async_db)):
     """获取所有扫描配置"""
-    return db.query(ScanConfig).order_by(ScanConfig.created_at.desc()).all()
+    result = await db.execute(select(ScanConfig).order_by(ScanConfig.created_at.desc()))
+    return result.scalars().all()
 
 
 @router.post("/configs", response_model=ScanConfigResponse)
@@ -100,6 +171,7 @@ def create_config(config: ScanCreate, db: Session = Depends(get_db)):
         description=config.description,
         schedule_type=config.schedule_type,
         filter_rules=json.dumps(config.filter_rules) if config.filter_rules else None,
+        watch_quiet_seconds=config.watch_quiet_seconds,
     )
     db.add(db_config)
     db.commit()
@@ -114,13 +186,19 @@ def update_config(config_id: int, config: ScanCreate, db: Session = Depends(get_
     if not db_config:
         raise HTTPException(status_code=404, detail="配置不存在")
 
+    if watch_manager.get(config_id) is not None and not os.path.isdir(config.scan_path):
+        raise HTTPException(status_code=400, detail=f"扫描路径不存在: {config.scan_path}")
+
     db_config.scan_path = config.scan_path
     db_config.description = config.description
     db_config.schedule_type = config.schedule_type
     db_config.filter_rules = json.dumps(config.filter_rules) if config.filter_rules else None
+    db_config.watch_quiet_seconds = config.watch_quiet_seconds
 
     db.commit()
     db.refresh(db_config)
+    # 正在监听时按新的路径/静默期重启监听
+    watch_manager.reload(db_config)
     return db_config
 
 
@@ -131,41 +209,138 @@ def delete_config(config_id: int, db: Session = Depends(get_db)):
     if not db_config:
         raise HTTPException(status_code=404, detail="配置不存在")
 
+    watch_manager.stop(config_id)
     db.delete(db_config)
     db.commit()
     return {"message": "删除成功"}
 
 
+# ========== 目录监听 ==========
+
+@router.post("/configs/{config_id}/watch", response_model=WatchStatusResponse)
+def start_watch(
+    config_id: int,
+    force_polling: bool = Query(False, description="强制使用轮询（inotify不可用的挂载）"),
+    db: Session = Depends(get_db)
+):
+    """开启目录监听，新文件静默后自动入库"""
+    db_config = db.query(ScanConfig).filter(ScanConfig.id == config_id).first()
+    if not db_config:
+        raise HTTPException(status_code=404, detail="配置不存在")
+
+    try:
+        watcher = watch_manager.start(db_config, force_polling=force_polling)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    db_config.watch_enabled = True
+    db.commit()
+    return watcher.status()
+
+
+@router.delete("/configs/{config_id}/watch")
+def stop_watch(config_id: int, db: Session = Depends(get_db)):
+    """停止目录监听"""
+    db_config = db.query(ScanConfig).filter(ScanConfig.id == config_id).first()
+    if not db_config:
+        raise HTTPException(status_code=404, detail="配置不存在")
+
+    watch_manager.stop(config_id)
+    db_config.watch_enabled = False
+    db.commit()
+    return {"message": "已停止监听"}
+
+
+@router.get("/watches", response_model=List[WatchStatusResponse])
+def get_watches():
+    """获取所有监听状态"""
+    return watch_manager.list_status()
+
+
 # ========== 扫描执行 ==========
 
 @router.post("/scan/{config_id}", response_model=ScanResponse)
-def run_scan(config_id: int, db: Session = Depends(get_db)):
+def run_scan(
+    config_id: int,
+    out_of_core: bool = Query(True, description="使用磁盘暂存分组（可断点续扫）；false时在内存中分组，中断后只能从头扫描"),
+    db: Session = Depends(get_db)
+):
     """手动触发扫描"""
     service = ScanService(db)
     try:
-        scan = service.run_scan(config_id)
+        scan = service.run_scan(config_id, out_of_core=out_of_core)
         return scan
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/scan-all", response_model=List[ScanResponse])
+def run_scan_all(
+    out_of_core: bool = Query(True, description="使用磁盘暂存分组（可断点续扫）；false时在内存中分组，中断后只能从头扫描"),
+    mount_concurrency: Optional[int] = Query(None, ge=1, description="每个挂载设备的并发数"),
+    max_concurrency: Optional[int] = Query(None, ge=1, description="总并发数"),
+    db: Session = Depends(get_db)
+):
+    """并发扫描全部启用的配置（按挂载设备分组限流），在后台执行，立即返回running状态的扫描记录"""
+    scanner = MultiRootScanner(mount_concurrency, max_concurrency)
+    scan_ids = scanner.start_all(out_of_core=out_of_core)
+    return db.query(Scan).filter(Scan.id.in_(scan_ids)).order_by(Scan.started_at).all()
+
+
+@router.post("/scan/{config_id}/distributed", response_model=ScanResponse)
+def create_distributed_scan(config_id: int, db: Session = Depends(get_db)):
+    """创建分布式扫描，由 `python -m app.cli worker` 工作进程执行"""
+    try:
+        return DistributedScanService(db).create_scan(config_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/scans/{scan_id}/work-units")
+def get_scan_work_units(scan_id: str, db: Session = Depends(get_db)):
+    """分布式扫描各状态的工作单元数"""
+    return DistributedScanService(db).unit_summary(scan_id)
+
+
+@router.post("/scans/{scan_id}/resume", response_model=ScanResponse)
+def resume_scan(scan_id: str, db: Session = Depends(get_db)):
+    """从断点继续被中断的扫描"""
+    service = ScanService(db)
+    try:
+        return service.resume_scan(scan_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/scans", response_model=List[ScanResponse])
-def get_scans(
+async def get_scans(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取扫描历史"""
     offset = (page - 1) * page_size
-    return db.query(Scan).order_by(Scan.started_at.desc()).offset(offset).limit(page_size).all()
+    stmt = select(Scan).order_by(Scan.started_at.desc()).offset(offset).limit(page_size)
+    result = await db.execute(stmt)
+    return result.scalars().all()
+
+
+@router.get("/scans/{scan_id}", response_model=ScanDetailResponse)
+async def get_scan_by_id(scan_id: str, db: AsyncSession = Depends(get_async_db)):
+    """获取扫描详情（含性能画像）"""
+    scan = await db.get(Scan, scan_id)
+    if not scan:
+        raise HTTPException(status_code=404, detail="扫描记录不存在")
+    return scan
 
 
 # ========== 筛选规则 ==========
 
 @router.get("/filter-rules", response_model=List[FilterRuleResponse])
-def get_filter_rules(db: Session = Depends(get_db)):
+async def get_filter_rules(db: AsyncSession = Depends(get_async_db)):
     """获取所有筛选规则"""
-    return db.query(FilterRule).all()
+    result = await db.execute(select(FilterRule))
+    return result.scalars().all()
 
 
 @router.post("/filter-rules", response_model=FilterRuleResponse)
@@ -207,39 +382,44 @@ def delete_filter_rule(rule_id: int, db: Session = Depends(get_db)):
 
 @router.post("/export", response_model=ExportResponse)
 def export_series(req: ExportRequest, db: Session = Depends(get_db)):
-    """导出选中的序列"""
+    """导出选中的序列（带anonymize时匿名化导出）"""
     service = ExportService(db)
-    result = service.export_series(req.series_ids, req.target_dir)
-    return result
+    if req.anonymize is None:
+        return service.export_series(req.series_ids, req.target_dir)
+
+    try:
+        anonymizer = Anonymizer(req.anonymize.cohort_key, req.anonymize.actions,
+                                req.anonymize.remove_private_tags)
+    except AnonymizeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return service.export_series(req.series_ids, req.target_dir, anonymizer, req.anonymize.workers)
 
 
 # ========== 统计 ==========
 
 @router.get("/stats/modality")
-def get_modality_stats(db: Session = Depends(get_db)):
+async def get_modality_stats(db: AsyncSession = Depends(get_async_db)):
     """按模态统计"""
-    from sqlalchemy import func
-
-    results = db.query(
+    stmt = select(
         Series.modality,
         func.count(Series.id).label('count')
-    ).filter(Series.is_active == True).group_by(Series.modality).all()
+    ).where(Series.is_active == True).group_by(Series.modality)
+    results = (await db.execute(stmt)).all()
 
     return [{"modality": r.modality, "count": r.count} for r in results]
 
 
 @router.get("/stats/date")
-def get_date_stats(db: Session = Depends(get_db)):
+async def get_date_stats(db: AsyncSession = Depends(get_async_db)):
     """按日期统计"""
-    from sqlalchemy import func
-
-    results = db.query(
+    stmt = select(
         Series.study_date,
         func.count(Series.id).label('count')
-    ).filter(
+    ).where(
         Series.is_active == True,
         Series.study_date != None
-    ).group_by(Series.study_date).order_by(Series.study_date.desc()).limit(30).all()
+    ).group_by(Series.study_date).order_by(Series.study_date.desc()).limit(30)
+    results = (await db.execute(stmt)).all()
 
     return [{"date": r.study_date, "count": r.count} for r in results]
 
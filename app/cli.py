@@ -0,0 +1,127 @@
+"""
+命令行工具
+
+    python -m app.cli export --format parquet --output series.parquet --modality CT
+    python -m app.cli distributed-scan 1 --workers 4
+    python -m app.cli worker --scan-id SCNXXXX
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+from app.db.database import SessionLocal, init_db
+from app.db.models import Scan
+from app.services.catalog_export import EXPORT_FORMATS, export_catalog, series_filters
+from app.services.distributed_scan import (
+    LEASE_SECONDS, DistributedScanService, ScanWorker, default_worker_id,
+)
+
+
+def cmd_export(args):
+    """流式导出序列目录到文件或标准输出"""
+    conditions = series_filters(
+        args.patient_id, args.patient_name, args.modality, args.protocol_name,
+        args.study_date_from, args.study_date_to,
+        {"true": True, "false": False}.get(args.geometry_ok), args.max_slice_spacing,
+    )
+    db = SessionLocal()
+    out = open(args.output, "wb") if args.output != "-" else sys.stdout.buffer
+    try:
+        for data in export_catalog(db, args.format, conditions, args.include_paths, args.chunk_size):
+            out.write(data)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        db.close()
+
+
+def cmd_worker(args):
+    """运行扫描工作进程（可在共享挂载和数据库的任意主机上启动多个）"""
+    worker = ScanWorker(worker_id=args.worker_id, scan_id=args.scan_id,
+                        lease_seconds=args.lease_seconds)
+    processed = worker.run(follow=args.follow)
+    print(f"[{worker.worker_id}] 处理了 {processed} 个目录")
+
+
+def cmd_distributed_scan(args):
+    """创建分布式扫描并在本机启动若干工作进程，等待完成"""
+    db = SessionLocal()
+    try:
+        scan = DistributedScanService(db).create_scan(args.config_id)
+        scan_id = scan.id
+    finally:
+        db.close()
+    print(f"已创建分布式扫描 {scan_id}")
+    if args.workers <= 0:
+        return
+
+    host_id = default_worker_id()
+    workers = [
+        subprocess.Popen([
+            sys.executable, "-m", "app.cli", "worker", "--scan-id", scan_id,
+            "--worker-id", f"{host_id}-{i}", "--lease-seconds", str(args.lease_seconds),
+        ])
+        for i in range(args.workers)
+    ]
+    for process in workers:
+        process.wait()
+
+    db = SessionLocal()
+    try:
+        scan = db.query(Scan).filter(Scan.id == scan_id).first()
+        print(json.dumps({
+            "id": scan.id,
+            "status": scan.status,
+            "series_found": scan.series_found,
+            "series_new": scan.series_new,
+            "series_duplicated": scan.series_duplicated,
+            "work_units": DistributedScanService(db).unit_summary(scan_id),
+        }, ensure_ascii=False))
+    finally:
+        db.close()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="DICOM数据管理系统命令行")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="批量导出序列目录")
+    export.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="ndjson")
+    export.add_argument("--output", "-o", default="-", help="输出文件，默认标准输出")
+    export.add_argument("--include-paths", action="store_true", help="附带全部实例路径")
+    export.add_argument("--chunk-size", type=int, default=5000)
+    export.add_argument("--patient-id")
+    export.add_argument("--patient-name")
+    export.add_argument("--modality")
+    export.add_argument("--protocol-name")
+    export.add_argument("--study-date-from")
+    export.add_argument("--study-date-to")
+    export.add_argument("--geometry-ok", choices=["true", "false"], help="按几何完整性筛选")
+    export.add_argument("--max-slice-spacing", type=float, help="层间距上限(mm)")
+    export.set_defaults(func=cmd_export)
+
+    distributed = sub.add_parser("distributed-scan", help="创建分布式扫描并启动本机工作进程")
+    distributed.add_argument("config_id", type=int)
+    distributed.add_argument("--workers", type=int, default=4, help="本机工作进程数，0表示只创建扫描")
+    distributed.add_argument("--lease-seconds", type=int, default=LEASE_SECONDS)
+    distributed.set_defaults(func=cmd_distributed_scan)
+
+    worker = sub.add_parser("worker", help="运行扫描工作进程")
+    worker.add_argument("--scan-id", help="只处理指定扫描，默认处理全部进行中的分布式扫描")
+    worker.add_argument("--worker-id", help="默认 主机名-进程号")
+    worker.add_argument("--lease-seconds", type=int, default=LEASE_SECONDS)
+    worker.add_argument("--follow", action="store_true", help="处理完后继续等待新的扫描")
+    worker.set_defaults(func=cmd_worker)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    init_db()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
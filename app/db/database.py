@@ -1,6 +1,7 @@
 import os
 import sys
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import json
@@ -8,13 +9,44 @@ import json
 # 数据库配置
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./data/dicom.db")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+def _to_async_url(url: str) -> str:
+    """将同步驱动的连接串转换为对应的异步驱动
+
+    只有SQLite可以自动推导（aiosqlite已在依赖中）；其他数据库需安装对应的异步驱动并设置 ASYNC_DATABASE_URL
+    """
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    raise ValueError(
+        f"无法由 DATABASE_URL={url.split(':', 1)[0]}:... 推导异步连接，"
+        "请安装对应的异步驱动（如 asyncpg）并设置 ASYNC_DATABASE_URL"
+    )
+
+
+# 异步连接（查询接口使用），默认与DATABASE_URL指向同一数据库
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL") or _to_async_url(DATABASE_URL)
+
+if DATABASE_URL.startswith("sqlite"):
+    # 多个扫描线程并发写入时等待锁而不是立即报 database is locked
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False, "timeout": 30})
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragma(dbapi_connection, connection_record):
+        """WAL模式：扫描写入时不阻塞查询接口的读取"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+else:
+    engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
 
 def get_db():
-    """获取数据库会话"""
+    """获取数据库会话（同步，用于扫描入库等写操作）"""
     db = SessionLocal()
     try:
         yield db
@@ -22,7 +54,32 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """获取异步数据库会话（用于只读查询接口）"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def init_db():
     """初始化数据库"""
-    from app.db.models import Series, SeriesPath, Scan, ScanConfig
+    from app.db.models import Series, SeriesPath, Scan, ScanConfig, Patient, Study, ScanWorkUnit, ScanWorkResult
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+
+
+def _add_missing_columns():
+    """为已存在的表补齐新增的列（create_all不会修改已有表）"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+            # 新增列上的索引同样需要补建
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Text, DateTime, Boolean, JSON
+from sqlalchemy import Column, String, Integer, Float, Text, DateTime, Boolean, JSON, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from app.db.database import Base
 import json
@@ -42,6 +42,21 @@ class Series(Base):
     file_size_total = Column(Integer)  # 总大小(字节)
     file_modified_date = Column(String(32))
 
+    # 几何与完整性（入库时按全部实例计算，无几何信息的为空）
+    slice_count = Column(Integer)                # 去重后的层数
+    slice_spacing = Column(Float)                # 中位层间距(mm)
+    missing_slices = Column(Integer)             # 按层间距推算的缺层数
+    duplicate_slices = Column(Integer)           # 同一位置的重复层数
+    orientation_consistent = Column(Boolean)     # 各实例方向是否一致
+    missing_instance_numbers = Column(Integer)   # InstanceNumber 范围内缺失的编号数
+    geometry_ok = Column(Boolean, index=True)    # 方向一致且无缺层、重复层
+    # 主路径实例的几何信息（其余实例记录在series_paths），追加实例时重新计算统计
+    instance_number = Column(Integer)
+    position_x = Column(Float)
+    position_y = Column(Float)
+    position_z = Column(Float)
+    orientation = Column(String(128))  # encode_orientation 格式
+
     # 元信息
     created_at = Column(String(32), default=func.now())
     is_active = Column(Boolean, default=True)
@@ -59,6 +74,39 @@ class Series(Base):
         return json.loads(self.dx_params) if self.dx_params else {}
 
 
+class Study(Base):
+    """检查汇总表（入库时维护）"""
+    __tablename__ = "studies"
+
+    study_instance_uid = Column(String(128), primary_key=True)
+    patient_id = Column(String(64), index=True)
+    study_date = Column(String(16), index=True)
+
+    series_count = Column(Integer, default=0)
+    file_count = Column(Integer, default=0)
+    file_size_total = Column(Integer, default=0)
+    modalities = Column(String(128), default="|")  # 形如 |CT|MR|，便于按模态LIKE筛选
+    updated_at = Column(String(32))
+
+
+class Patient(Base):
+    """患者汇总表（入库时维护）"""
+    __tablename__ = "patients"
+
+    patient_id = Column(String(64), primary_key=True)
+    patient_name = Column(String(128), index=True)
+    patient_sex = Column(String(8))
+    patient_birth_date = Column(String(16))
+
+    study_count = Column(Integer, default=0)
+    series_count = Column(Integer, default=0)
+    file_size_total = Column(Integer, default=0)
+    modalities = Column(String(128), default="|")  # 形如 |CT|MR|
+    first_study_date = Column(String(16))
+    last_study_date = Column(String(16), index=True)
+    updated_at = Column(String(32))
+
+
 class SeriesPath(Base):
     """序列的多个路径记录"""
     __tablename__ = "series_paths"
@@ -67,6 +115,12 @@ class SeriesPath(Base):
     series_id = Column(String(32), index=True)
     file_path = Column(String(512))
     added_at = Column(String(32), default=func.now())
+    # 实例几何信息，同一实例的副本为空
+    instance_number = Column(Integer)
+    position_x = Column(Float)
+    position_y = Column(Float)
+    position_z = Column(Float)
+    orientation = Column(String(128))
 
 
 class Scan(Base):
@@ -74,14 +128,74 @@ class Scan(Base):
     __tablename__ = "scans"
 
     id = Column(String(32), primary_key=True)
+    config_id = Column(Integer)
     scan_path = Column(String(512))
-    scan_type = Column(String(16))  # manual/auto
+    scan_type = Column(String(16))  # manual/auto/watch/distributed
     started_at = Column(String(32))
     finished_at = Column(String(32))
     series_found = Column(Integer, default=0)
     series_new = Column(Integer, default=0)
     series_duplicated = Column(Integer, default=0)
-    status = Column(String(16), default="running")  # running/completed/failed
+    status = Column(String(16), default="running")  # running/finalizing/completed/failed/interrupted
+
+    # 性能画像 (JSON): 文件计数、解析失败、阶段耗时、最慢目录
+    profile = Column(Text)
+
+    # 断点 (JSON): 暂存文件、遍历是否完成、最后入库的UID及计数
+    checkpoint = Column(Text)
+
+    # 分布式扫描的收尾租约（UTC），收尾进程崩溃后过期由其他进程接手
+    lease_owner = Column(String(128))
+    lease_expires_at = Column(String(32))
+
+    def get_profile(self):
+        return json.loads(self.profile) if self.profile else {}
+
+    def get_checkpoint(self):
+        return json.loads(self.checkpoint) if self.checkpoint else {}
+
+
+class ScanWorkUnit(Base):
+    """分布式扫描的工作单元（一个目录，仅含该目录下的文件，子目录作为新单元加入）"""
+    __tablename__ = "scan_work_units"
+    __table_args__ = (UniqueConstraint("scan_id", "dir_path"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    scan_id = Column(String(32), index=True)
+    dir_path = Column(String(1024))
+    status = Column(String(16), default="pending", index=True)  # pending/leased/done/failed
+    lease_owner = Column(String(128))
+    lease_expires_at = Column(String(32))
+    attempts = Column(Integer, default=0)
+    error = Column(Text)
+
+    # 处理统计，完成时汇总到Scan.profile
+    files_walked = Column(Integer, default=0)
+    files_parsed = Column(Integer, default=0)
+    bytes_read = Column(Integer, default=0)
+    non_dicom_skipped = Column(Integer, default=0)
+    files_indexed = Column(Integer, default=0)
+    seconds = Column(Float, default=0)
+    parse_failures = Column(Text)  # JSON，同 ScanProfile.parse_failures
+
+
+class ScanWorkResult(Base):
+    """工作单元解析结果，扫描收尾时按序列合并入库后删除"""
+    __tablename__ = "scan_work_results"
+    __table_args__ = (Index("ix_scan_work_results_scan_series", "scan_id", "series_uid"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    scan_id = Column(String(32))
+    unit_id = Column(Integer)
+    series_uid = Column(String(128))
+    file_path = Column(String(1024))
+    file_size = Column(Integer)
+    # 实例几何信息，收尾时计算序列完整性
+    instance_number = Column(Integer)
+    position_x = Column(Float)
+    position_y = Column(Float)
+    position_z = Column(Float)
+    orientation = Column(String(128))  # encode_orientation 格式
 
 
 class ScanConfig(Base):
@@ -99,6 +213,10 @@ class ScanConfig(Base):
     # 筛选规则 (JSON)
     filter_rules = Column(Text)  # JSON
 
+    # 目录监听: 序列静默多少秒后入库
+    watch_enabled = Column(Boolean, default=False)
+    watch_quiet_seconds = Column(Integer, default=30)
+
 
 class FilterRule(Base):
     """筛选规则配置"""
@@ -5,8 +5,11 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import os
 
-from app.db.database import init_db
-from app.api import series
+from app.db.database import init_db, SessionLocal
+from app.api import series, hierarchy
+from app.services.scan_service import ScanService
+from app.services.hierarchy_service import HierarchyService
+from app.services.watch_service import watch_manager
 
 # 创建应用
 app = FastAPI(
@@ -26,6 +29,7 @@ app.add_middleware(
 
 # 注册路由
 app.include_router(series.router, prefix="/api", tags=["序列管理"])
+app.include_router(hierarchy.router, prefix="/api", tags=["患者/检查浏览"])
 
 
 @app.on_event("startup")
@@ -36,6 +40,29 @@ def startup_event():
     init_db()
     print("数据库初始化完成")
 
+    # 上次进程退出时未完成的扫描标记为interrupted，可通过续扫接口继续
+    db = SessionLocal()
+    try:
+        orphaned = ScanService.mark_orphaned_scans(db)
+        if orphaned:
+            print(f"发现 {orphaned} 个中断的扫描")
+
+        # 升级前已有的序列回填到患者/检查汇总表
+        backfilled = HierarchyService(db).rebuild_if_empty()
+        if backfilled:
+            print(f"已回填 {backfilled} 个检查的汇总")
+    finally:
+        db.close()
+
+    # 恢复已开启的目录监听
+    watch_manager.restore()
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """停止目录监听，入库已识别的序列"""
+    watch_manager.stop_all()
+
 
 @app.get("/")
 def root():
@@ -1,6 +1,14 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
 from typing import Optional, List, Dict, Any
 from datetime import datetime
+import json
+
+
+def _parse_json_text(value):
+    """数据库中以JSON文本存储的字段，响应时解析为字典"""
+    if isinstance(value, str):
+        return json.loads(value) if value else None
+    return value
 
 
 class SeriesBase(BaseModel):
@@ -47,10 +55,62 @@ class SeriesResponse(SeriesBase):
     file_size_total: int
     file_modified_date: Optional[str] = None
 
+    slice_count: Optional[int] = None
+    slice_spacing: Optional[float] = None
+    missing_slices: Optional[int] = None
+    duplicate_slices: Optional[int] = None
+    orientation_consistent: Optional[bool] = None
+    missing_instance_numbers: Optional[int] = None
+    geometry_ok: Optional[bool] = None
+
     created_at: str
     is_active: bool
     scan_id: Optional[str] = None
 
+    _parse_params = field_validator("ct_params", "mr_params", "dx_params", mode="before")(_parse_json_text)
+
+    class Config:
+        from_attributes = True
+
+
+def _parse_modalities(value):
+    """|CT|MR| 形式的模态集合解析为列表"""
+    if isinstance(value, str):
+        return [m for m in value.split("|") if m]
+    return value or []
+
+
+class StudyResponse(BaseModel):
+    """检查汇总"""
+    study_instance_uid: str
+    patient_id: Optional[str] = None
+    study_date: Optional[str] = None
+    series_count: int = 0
+    file_count: int = 0
+    file_size_total: int = 0
+    modalities: List[str] = []
+
+    _parse_modalities = field_validator("modalities", mode="before")(_parse_modalities)
+
+    class Config:
+        from_attributes = True
+
+
+class PatientResponse(BaseModel):
+    """患者汇总"""
+    patient_id: str
+    patient_name: Optional[str] = None
+    patient_sex: Optional[str] = None
+    patient_birth_date: Optional[str] = None
+    study_count: int = 0
+    series_count: int = 0
+    file_size_total: int = 0
+    modalities: List[str] = []
+    first_study_date: Optional[str] = None
+    last_study_date: Optional[str] = None
+
+    _parse_modalities = field_validator("modalities", mode="before")(_parse_modalities)
+
     class Config:
         from_attributes = True
 
@@ -73,6 +133,7 @@ class ScanCreate(BaseModel):
     description: Optional[str] = None
     schedule_type: str = "manual"  # manual/weekly
     filter_rules: Optional[Dict[str, Any]] = None
+    watch_quiet_seconds: int = 30
 
 
 class ScanResponse(BaseModel):
@@ -91,6 +152,13 @@ class ScanResponse(BaseModel):
         from_attributes = True
 
 
+class ScanDetailResponse(ScanResponse):
+    """扫描详情（含性能画像）"""
+    profile: Optional[Dict[str, Any]] = None
+
+    _parse_profile = field_validator("profile", mode="before")(_parse_json_text)
+
+
 class ScanConfigResponse(BaseModel):
     """扫描配置响应"""
     id: int
@@ -100,11 +168,30 @@ class ScanConfigResponse(BaseModel):
     schedule_type: str
     last_scan_at: Optional[str] = None
     filter_rules: Optional[Dict[str, Any]] = None
+    watch_enabled: Optional[bool] = False
+    watch_quiet_seconds: Optional[int] = None
+
+    _parse_filter_rules = field_validator("filter_rules", mode="before")(_parse_json_text)
 
     class Config:
         from_attributes = True
 
 
+class WatchStatusResponse(BaseModel):
+    """监听状态"""
+    config_id: int
+    scan_path: str
+    scan_id: Optional[str] = None
+    mode: str  # inotify/polling
+    quiet_seconds: int
+    pending_files: int
+    pending_series: int
+    series_new: int
+    series_updated: int
+    files_ingested: int
+    last_ingest_at: Optional[str] = None
+
+
 class FilterRuleCreate(BaseModel):
     """筛选规则创建"""
     modality: str
@@ -124,10 +211,22 @@ class FilterRuleResponse(BaseModel):
         from_attributes = True
 
 
+class AnonymizeOptions(BaseModel):
+    """匿名化导出选项"""
+    # 队列密钥，同一密钥导出的假名UID/ID一致；为空时使用ANONYMIZE_KEY环境变量
+    cohort_key: Optional[str] = None
+    # 按Tag关键字覆盖默认规则: remove / empty / hash / keep / replace:值
+    actions: Dict[str, str] = {}
+    remove_private_tags: bool = True
+    # 并行进程数，默认EXPORT_WORKERS；实际不超过CPU核数
+    workers: Optional[int] = Field(None, ge=1, le=64)
+
+
 class ExportRequest(BaseModel):
     """导出请求"""
     series_ids: List[str]
     target_dir: str
+    anonymize: Optional[AnonymizeOptions] = None
 
 
 class ExportResponse(BaseModel):
@@ -136,3 +235,4 @@ class ExportResponse(BaseModel):
     exported_count: int
     target_dir: str
     message: str
+    failed_files: int = 0
@@ -0,0 +1,356 @@
+"""
+匿名化导出
+逐个文件只解析像素数据之前的头部，按规则改写Tag后写出新头部，
+像素数据原样拷贝（其后还有元素时整体重写）；UID和标识按队列密钥做HMAC，同一密钥下多次导出结果一致。
+文件按批分发到多个工作进程并行处理
+"""
+import hashlib
+import hmac
+import io
+import os
+import secrets
+import shutil
+import struct
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pydicom
+from pydicom.datadict import dictionary_VR, keyword_dict, keyword_for_tag
+from pydicom.dataset import Dataset
+from pydicom.uid import ExplicitVRBigEndian, ExplicitVRLittleEndian, ImplicitVRLittleEndian
+
+from app.services import archives
+
+# 队列密钥：同一密钥导出的假名UID/ID一致，可跨批次关联
+ANONYMIZE_KEY = os.environ.get("ANONYMIZE_KEY", "")
+# 并行工作进程数，1表示在当前进程内处理
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", str(os.cpu_count() or 1)))
+# 每个任务的文件数，兼顾进程间通信开销与负载均衡
+FILES_PER_TASK = 64
+
+# DICOM标准注册的UID（SOP类、传输语法等），不需要假名化
+REGISTERED_UID_PREFIX = "1.2.840.10008."
+DEFLATED_TRANSFER_SYNTAX = "1.2.840.10008.1.2.1.99"
+
+# 默认规则：remove 删除 / empty 置空 / hash 替换为HMAC摘要 / keep 保留 / replace:值 替换为固定值
+# UI类型的元素（除标准注册UID外）统一映射为假名UID，PN类型（人名）没有规则时置空，都不需要单独列出；
+# 其余按 PS3.15 基本去标识化配置中常见的标识
+DEFAULT_ACTIONS: Dict[str, str] = {
+    "PatientName": "hash",
+    "PatientID": "hash",
+    "AccessionNumber": "hash",
+    "PatientBirthDate": "empty",
+    "ReferringPhysicianName": "empty",
+    "ContentCreatorName": "empty",
+    "StudyID": "empty",
+    "PatientBirthTime": "remove",
+    "IssuerOfPatientID": "remove",
+    "RequestedProcedureID": "remove",
+    "ScheduledPerformingPhysicianName": "remove",
+    "PersonIdentificationCodeSequence": "remove",
+    "OperatorIdentificationSequence": "remove",
+    "PerformingPhysicianIdentificationSequence": "remove",
+    "PhysiciansOfRecordIdentificationSequence": "remove",
+    "PhysiciansReadingStudyIdentificationSequence": "remove",
+    "ReferringPhysicianIdentificationSequence": "remove",
+    "RequestingPhysicianIdentificationSequence": "remove",
+    "ScheduledPerformingPhysicianIdentificationSequence": "remove",
+    "ConsultingPhysicianIdentificationSequence": "remove",
+    "AuthorIdentificationSequence": "remove",
+    "IntendedRecipientsOfResultsIdentificationSequence": "remove",
+    # 图标可能带有烧录的患者信息（嵌套在各级序列中也会删除）
+    "IconImageSequence": "remove",
+    "OtherPatientIDs": "remove",
+    "OtherPatientIDsSequence": "remove",
+    "OtherPatientNames": "remove",
+    "PatientBirthName": "remove",
+    "PatientMotherBirthName": "remove",
+    "PatientAddress": "remove",
+    "PatientTelephoneNumbers": "remove",
+    "PatientComments": "remove",
+    "MedicalRecordLocator": "remove",
+    "InstitutionName": "remove",
+    "InstitutionAddress": "remove",
+    "InstitutionalDepartmentName": "remove",
+    "StationName": "remove",
+    "DeviceSerialNumber": "remove",
+    "ReferringPhysicianAddress": "remove",
+    "ReferringPhysicianTelephoneNumbers": "remove",
+    "PhysiciansOfRecord": "remove",
+    "PerformingPhysicianName": "remove",
+    "NameOfPhysiciansReadingStudy": "remove",
+    "RequestingPhysician": "remove",
+    "OperatorsName": "remove",
+}
+ACTIONS = ("remove", "empty", "hash", "keep")
+# 没有规则的人名元素
+DEFAULT_PN_ACTION = "empty"
+
+# 显式VR中使用4字节长度的VR
+_LONG_LENGTH_VRS = {b"OB", b"OD", b"OF", b"OL", b"OV", b"OW", b"SQ", b"SV", b"UC", b"UN", b"UR", b"UT", b"UV"}
+_SEQUENCE_DELIMITER = (0xFFFE, 0xE0DD)
+
+
+class AnonymizeError(ValueError):
+    """匿名化规则无效"""
+
+
+class Anonymizer:
+    """按规则改写数据集；只含普通属性，可传给工作进程"""
+
+    def __init__(self, key: Optional[str] = None, actions: Optional[Dict[str, str]] = None,
+                 remove_private_tags: bool = True):
+        # 没有配置密钥时随机生成，只保证本次导出内部一致
+        self.persistent_key = bool(key or ANONYMIZE_KEY)
+        self.key = (key or ANONYMIZE_KEY or secrets.token_hex(32)).encode()
+        self.actions = dict(DEFAULT_ACTIONS)
+        self.actions.update(actions or {})
+        self.remove_private_tags = remove_private_tags
+        for keyword, action in self.actions.items():
+            if keyword not in keyword_dict:
+                raise AnonymizeError(f"未知的DICOM关键字: {keyword}")
+            if action not in ACTIONS and not action.startswith("replace:"):
+                raise AnonymizeError(f"未知的匿名化规则 {keyword}: {action}")
+
+    @property
+    def key_id(self) -> Optional[str]:
+        """密钥指纹，用于核对多次导出是否属于同一队列（随机密钥不输出）"""
+        if not self.persistent_key:
+            return None
+        return hashlib.sha256(self.key).hexdigest()[:12]
+
+    def _digest(self, value: str) -> bytes:
+        return hmac.new(self.key, value.encode("utf-8"), hashlib.sha256).digest()
+
+    def hash(self, value: str) -> str:
+        """16位十六进制摘要（SH类型长度上限也能放下）"""
+        return self._digest(value).hex()[:16].upper()
+
+    def uid(self, value: str) -> str:
+        """假名UID：2.25 + 128位整数"""
+        if not value or value.startswith(REGISTERED_UID_PREFIX):
+            return value
+        return "2.25." + str(int.from_bytes(self._digest("uid:" + value)[:16], "big"))
+
+    def value(self, keyword: str, value: Any) -> Any:
+        """按规则转换单个值（meta.json等数据库字段使用），删除时返回None"""
+        action = self.actions.get(keyword, "keep")
+        if value in (None, "") or action == "keep":
+            return value
+        if action in ("remove", "empty"):
+            return None
+        if action == "hash":
+            return self.hash(str(value))
+        return action[len("replace:"):]
+
+    # ========== 数据集 ==========
+
+    def apply(self, ds: Dataset):
+        """原地改写数据集（含嵌套序列）及文件头中的实例UID"""
+        self._apply_dataset(ds)
+        meta = getattr(ds, "file_meta", None)
+        if meta is not None and "MediaStorageSOPInstanceUID" in meta:
+            meta.MediaStorageSOPInstanceUID = self.uid(str(meta.MediaStorageSOPInstanceUID))
+
+    def _apply_dataset(self, ds: Dataset):
+        # 只转换需要处理的元素，其余保持原始字节，写出时直接拷贝
+        for elem in list(ds.elements()):
+            tag = elem.tag
+            if tag.element == 0 or (self.remove_private_tags and tag.is_private):
+                # 组长度在改写后不再准确，直接删除
+                del ds[tag]
+                continue
+            keyword = keyword_for_tag(tag)
+            action = self.actions.get(keyword)
+            vr = elem.VR or (dictionary_VR(tag) if keyword else "UN")
+            if action is None and vr == "PN":
+                action = DEFAULT_PN_ACTION
+            if action is None:
+                if vr == "SQ":
+                    for item in ds[tag].value:
+                        self._apply_dataset(item)
+                elif vr == "UI":
+                    elem = ds[tag]
+                    if elem.value:
+                        elem.value = ([self.uid(v) for v in elem.value] if elem.VM > 1
+                                      else self.uid(str(elem.value)))
+            elif action == "remove":
+                del ds[tag]
+            elif action == "empty":
+                ds[tag].value = [] if vr == "SQ" else ""
+            elif action == "hash":
+                elem = ds[tag]
+                if elem.value not in (None, ""):
+                    elem.value = self.hash(str(elem.value))
+            elif action != "keep":
+                ds[tag].value = action[len("replace:"):]
+
+    def output_name(self, ds: Dataset, src_path: str) -> str:
+        """输出文件名取假名SOPInstanceUID，原文件名可能含患者信息"""
+        sop_uid = str(ds.get("SOPInstanceUID", "") or "")
+        return f"{sop_uid or self.hash(src_path)}.dcm"
+
+    def write(self, stream, src_path: str, dst_dir: str) -> str:
+        """从可随机读取的流写出匿名化文件，返回输出路径
+
+        只解析到像素数据之前，写出改写后的头部，像素数据原样拷贝；
+        无文件头、Deflate压缩或像素数据之后还有元素（如私有Tag 7FE1）的文件无法拼接，整体读入后重写
+        """
+        ds = pydicom.dcmread(stream, stop_before_pixels=True, force=True)
+        transfer_syntax = str(ds.file_meta.get("TransferSyntaxUID", "")) if ds.file_meta else ""
+        splice = bool(transfer_syntax) and transfer_syntax != DEFLATED_TRANSFER_SYNTAX
+        if splice:
+            pixel_offset = stream.tell()
+            splice = not _has_trailing_elements(stream, pixel_offset, *ds.original_encoding)
+        if not splice:
+            stream.seek(0)
+            ds = pydicom.dcmread(stream, force=True)
+            if not transfer_syntax:
+                _add_file_meta(ds)
+
+        self.apply(ds)
+        dst_path = os.path.join(dst_dir, self.output_name(ds, src_path))
+        # 临时文件名唯一：同一SOP UID的文件可能由多个任务同时写出
+        with tempfile.NamedTemporaryFile(dir=dst_dir, suffix=".tmp", delete=False) as dst:
+            tmp_path = dst.name
+            try:
+                pydicom.dcmwrite(dst, ds, enforce_file_format=True)
+                if splice:
+                    stream.seek(pixel_offset)
+                    shutil.copyfileobj(stream, dst, 1024 * 1024)
+            except BaseException:
+                dst.close()
+                os.unlink(tmp_path)
+                raise
+        try:
+            os.replace(tmp_path, dst_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return dst_path
+
+
+def _has_trailing_elements(stream, offset: int, implicit_vr: bool, little_endian: bool) -> bool:
+    """像素数据元素之后是否还有其他元素；只读元素头和封装片段头，不读像素数据"""
+    endian = "<" if little_endian else ">"
+    stream.seek(offset)
+    header = stream.read(8)
+    if len(header) < 8:
+        return False
+    if implicit_vr:
+        length = struct.unpack(endian + "L", header[4:8])[0]
+    elif header[4:6] in _LONG_LENGTH_VRS:
+        length = struct.unpack(endian + "L", stream.read(4))[0]
+    else:
+        length = struct.unpack(endian + "H", header[6:8])[0]
+
+    if length == 0xFFFFFFFF:
+        # 封装的像素数据：逐个跳过片段，直到序列结束符
+        while True:
+            item = stream.read(8)
+            if len(item) < 8:
+                return False
+            group, element, item_length = struct.unpack(endian + "HHL", item)
+            if (group, element) == _SEQUENCE_DELIMITER:
+                break
+            stream.seek(item_length, io.SEEK_CUR)
+    else:
+        stream.seek(length, io.SEEK_CUR)
+    return bool(stream.read(1))
+
+
+def _add_file_meta(ds: Dataset):
+    """无文件头的数据集按原编码补齐文件头，输出为标准的Part 10文件"""
+    implicit_vr, little_endian = ds.original_encoding
+    if implicit_vr:
+        transfer_syntax = ImplicitVRLittleEndian
+    else:
+        transfer_syntax = ExplicitVRLittleEndian if little_endian else ExplicitVRBigEndian
+    ds.ensure_file_meta()
+    ds.file_meta.TransferSyntaxUID = transfer_syntax
+    ds.file_meta.MediaStorageSOPClassUID = ds.get("SOPClassUID", "")
+    ds.file_meta.MediaStorageSOPInstanceUID = ds.get("SOPInstanceUID", "")
+
+
+# ========== 并行执行 ==========
+
+# 任务：普通文件 [(源路径, 目标目录)] 或单个压缩包 (归档路径, {成员名: 目标目录})
+FileTask = List[Tuple[str, str]]
+ArchiveTask = Tuple[str, Dict[str, str]]
+
+
+def _anonymize_files(anonymizer: Anonymizer, task: FileTask) -> Tuple[Dict[str, int], List[str]]:
+    """处理一批普通文件，返回 ({目标目录: 成功数}, 失败描述)"""
+    done: Dict[str, int] = {}
+    failed: List[str] = []
+    for src_path, dst_dir in task:
+        try:
+            with open(src_path, "rb") as stream:
+                anonymizer.write(stream, src_path, dst_dir)
+            done[dst_dir] = done.get(dst_dir, 0) + 1
+        except Exception as e:
+            failed.append(f"{src_path}: {e}")
+    return done, failed
+
+
+def _anonymize_archive(anonymizer: Anonymizer, task: ArchiveTask) -> Tuple[Dict[str, int], List[str]]:
+    """顺序读一遍压缩包，处理其中选中的成员"""
+    archive_path, wanted = task
+    wanted = dict(wanted)
+    done: Dict[str, int] = {}
+    failed: List[str] = []
+    try:
+        for name, _, stream in archives.iter_members(archive_path):
+            dst_dir = wanted.pop(name, None)
+            if dst_dir is None:
+                continue
+            src_path = archives.member_path(archive_path, name)
+            try:
+                # 成员流不一定能随机读取，读入内存后处理
+                anonymizer.write(io.BytesIO(stream.read()), src_path, dst_dir)
+                done[dst_dir] = done.get(dst_dir, 0) + 1
+            except Exception as e:
+                failed.append(f"{src_path}: {e}")
+            if not wanted:
+                break
+    except Exception as e:
+        failed.append(f"{archive_path}: {e}")
+    failed.extend(f"{archives.member_path(archive_path, name)}: 压缩包中不存在" for name in sorted(wanted))
+    return done, failed
+
+
+def anonymize_parallel(anonymizer: Anonymizer, files: Iterable[Tuple[str, str]],
+                       archive_tasks: Iterable[ArchiveTask],
+                       workers: Optional[int] = None) -> Tuple[Dict[str, int], List[str]]:
+    """并行匿名化，返回 ({目标目录: 成功数}, 失败描述)
+
+    files: [(源路径, 目标目录)]，按 FILES_PER_TASK 分批；每个压缩包一个任务
+    """
+    files = list(files)
+    tasks = [(_anonymize_files, files[i:i + FILES_PER_TASK]) for i in range(0, len(files), FILES_PER_TASK)]
+    tasks += [(_anonymize_archive, task) for task in archive_tasks]
+
+    done: Dict[str, int] = {}
+    failed: List[str] = []
+
+    def collect(result):
+        for dst_dir, count in result[0].items():
+            done[dst_dir] = done.get(dst_dir, 0) + count
+        failed.extend(result[1])
+
+    # 请求指定的进程数不超过CPU核数
+    workers = min(workers, os.cpu_count() or 1) if workers else EXPORT_WORKERS
+    workers = min(workers, len(tasks))
+    if workers <= 1:
+        for func, task in tasks:
+            collect(func(anonymizer, task))
+        return done, failed
+
+    # spawn：服务进程内有其他线程，fork可能继承被占用的锁
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+        futures = [pool.submit(func, anonymizer, task) for func, task in tasks]
+        for future in futures:
+            collect(future.result())
+    return done, failed
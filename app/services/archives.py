@@ -0,0 +1,139 @@
+"""
+压缩包内的DICOM
+zip / tar(.gz/.bz2/.xz) 内的成员不解压到磁盘，成员路径记为 "归档路径!/成员名"
+"""
+import os
+import shutil
+import tarfile
+import zipfile
+from contextlib import contextmanager
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# 是否扫描压缩包内的文件
+SCAN_ARCHIVES = os.environ.get("SCAN_ARCHIVES", "1") != "0"
+
+MEMBER_SEPARATOR = "!/"
+
+ZIP_SUFFIXES = (".zip",)
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+def is_archive(path: str) -> bool:
+    return path.lower().endswith(ZIP_SUFFIXES + TAR_SUFFIXES)
+
+
+def list_archives(dirpath: str, filenames: Iterable[str]) -> List[str]:
+    """目录中的压缩包"""
+    if not SCAN_ARCHIVES:
+        return []
+    return [os.path.join(dirpath, name) for name in sorted(filenames) if is_archive(name)]
+
+
+def member_path(archive_path: str, member_name: str) -> str:
+    return f"{archive_path}{MEMBER_SEPARATOR}{member_name}"
+
+
+def split_member_path(path: str) -> Optional[Tuple[str, str]]:
+    """拆分成员路径为 (归档路径, 成员名)，普通路径返回None"""
+    start = 0
+    while True:
+        index = path.find(MEMBER_SEPARATOR, start)
+        if index < 0:
+            return None
+        if is_archive(path[:index]):
+            return path[:index], path[index + len(MEMBER_SEPARATOR):]
+        start = index + 1
+
+
+def is_member_path(path: str) -> bool:
+    return split_member_path(path) is not None
+
+
+def iter_members(archive_path: str) -> Iterator[Tuple[str, int, IO[bytes]]]:
+    """按归档内顺序产出 (成员名, 解压后大小, 只读流)；流只在本次迭代内有效，只能顺序读取"""
+    if archive_path.lower().endswith(ZIP_SUFFIXES):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as stream:
+                    yield info.filename, info.file_size, stream
+    else:
+        # tar.gz 等只能顺序解压，逐个成员向前读取，不回退
+        with tarfile.open(archive_path, "r:*") as archive:
+            for info in archive:
+                if not info.isfile():
+                    continue
+                stream = archive.extractfile(info)
+                if stream is None:
+                    continue
+                with stream:
+                    yield info.name, info.size, stream
+
+
+@contextmanager
+def open_member(path: str) -> Iterator[IO[bytes]]:
+    """打开单个成员（tar.gz需要从头解压到该成员）"""
+    archive_path, name = split_member_path(path)
+    if archive_path.lower().endswith(ZIP_SUFFIXES):
+        with zipfile.ZipFile(archive_path) as archive, archive.open(name) as stream:
+            yield stream
+    else:
+        with tarfile.open(archive_path, "r:*") as archive:
+            stream = archive.extractfile(name)
+            if stream is None:
+                raise FileNotFoundError(path)
+            with stream:
+                yield stream
+
+
+def member_exists(path: str) -> bool:
+    parts = split_member_path(path)
+    return parts is not None and os.path.isfile(parts[0])
+
+
+def group_by_archive(paths: Iterable[str]) -> Tuple[List[str], Dict[str, List[str]]]:
+    """把路径分为 (普通文件, {归档路径: [成员名]})"""
+    plain: List[str] = []
+    members: Dict[str, List[str]] = {}
+    for path in paths:
+        parts = split_member_path(path)
+        if parts is None:
+            plain.append(path)
+        else:
+            members.setdefault(parts[0], []).append(parts[1])
+    return plain, members
+
+
+def safe_member_name(name: str) -> str:
+    """成员名转为相对路径：去掉开头的/、盘符和 . / .. 段，解出时不会写到目标目录之外"""
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    if parts and parts[0].endswith(":"):
+        parts = parts[1:]
+    return os.path.join(*parts) if parts else ""
+
+
+def extract_members(archive_path: str, names: Iterable[str], target_dir: str) -> Tuple[int, List[str]]:
+    """只解出指定成员到目标目录（保留成员的相对路径），返回 (成功数, 失败的成员路径)
+
+    对归档只顺序读一遍，tar.gz也不会为每个成员重新解压；不同子目录下的同名成员不会互相覆盖
+    """
+    wanted = set(names)
+    failed = []
+    extracted = 0
+    for name, _, stream in iter_members(archive_path):
+        if name not in wanted:
+            continue
+        wanted.discard(name)
+        relative = safe_member_name(name)
+        if not relative:
+            failed.append(name)
+            continue
+        dst_path = os.path.join(target_dir, relative)
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        with open(dst_path, "wb") as dst:
+            shutil.copyfileobj(stream, dst)
+        extracted += 1
+        if not wanted:
+            break
+    return extracted, [member_path(archive_path, name) for name in sorted(wanted.union(failed))]
@@ -0,0 +1,216 @@
+"""
+目录批量导出
+以服务端游标分块读取Series表，逐块序列化为NDJSON / CSV / Parquet / Arrow，
+内存占用只与块大小有关
+"""
+import csv
+import io
+import json
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.db.models import Series, SeriesPath
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# 导出的列
+EXPORT_COLUMNS = [
+    "id", "patient_id", "patient_name", "patient_sex", "patient_birth_date",
+    "study_instance_uid", "study_date",
+    "series_instance_uid", "series_number", "series_description", "modality", "protocol_name",
+    "manufacturer", "manufacturer_model",
+    "ct_params", "mr_params", "dx_params",
+    "file_path", "file_count", "file_size_total", "file_modified_date",
+    "slice_count", "slice_spacing", "missing_slices", "duplicate_slices",
+    "orientation_consistent", "missing_instance_numbers", "geometry_ok",
+    "created_at", "scan_id",
+]
+# 各模态参数（JSON文本）：NDJSON中解析为对象，CSV/Parquet/Arrow中保留JSON文本
+JSON_COLUMNS = {"ct_params", "mr_params", "dx_params"}
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def series_filters(
+    patient_id: Optional[str] = None,
+    patient_name: Optional[str] = None,
+    modality: Optional[str] = None,
+    protocol_name: Optional[str] = None,
+    study_date_from: Optional[str] = None,
+    study_date_to: Optional[str] = None,
+    geometry_ok: Optional[bool] = None,
+    max_slice_spacing: Optional[float] = None,
+) -> list:
+    """构造序列筛选条件（查询接口与导出共用）"""
+    conditions = [Series.is_active == True]
+
+    if patient_id:
+        conditions.append(Series.patient_id.contains(patient_id))
+    if patient_name:
+        conditions.append(Series.patient_name.contains(patient_name))
+    if modality:
+        conditions.append(Series.modality == modality)
+    if protocol_name:
+        conditions.append(Series.protocol_name.contains(protocol_name))
+    if study_date_from:
+        conditions.append(Series.study_date >= study_date_from)
+    if study_date_to:
+        conditions.append(Series.study_date <= study_date_to)
+    if geometry_ok is not None:
+        conditions.append(Series.geometry_ok == geometry_ok)
+    if max_slice_spacing is not None:
+        conditions.append(Series.slice_spacing <= max_slice_spacing)
+
+    return conditions
+
+
+def iter_series_chunks(db: Session, conditions: list, include_paths: bool = False,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """以服务端游标分块读取序列行（不构造ORM对象）"""
+    columns = [Series.__table__.c[name] for name in EXPORT_COLUMNS]
+    stmt = select(*columns).where(*conditions).order_by(Series.id)
+    result = db.execute(stmt.execution_options(stream_results=True, yield_per=chunk_size))
+
+    for partition in result.partitions(chunk_size):
+        rows = [dict(row._mapping) for row in partition]
+        if include_paths:
+            _attach_paths(db, rows)
+        yield rows
+
+
+def _attach_paths(db: Session, rows: List[Dict[str, Any]]):
+    """为一块序列附加全部实例路径（主路径 + SeriesPath），每块一次查询"""
+    extra: Dict[str, List[str]] = {}
+    ids = [row["id"] for row in rows]
+    stmt = select(SeriesPath.series_id, SeriesPath.file_path).where(
+        SeriesPath.series_id.in_(ids)
+    ).order_by(SeriesPath.id)
+    for series_id, file_path in db.execute(stmt):
+        extra.setdefault(series_id, []).append(file_path)
+    for row in rows:
+        row["instance_paths"] = [row["file_path"]] + extra.get(row["id"], [])
+
+
+def write_ndjson(chunks: Iterator[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    for rows in chunks:
+        lines = []
+        for row in rows:
+            for name in JSON_COLUMNS:
+                if row[name]:
+                    row[name] = json.loads(row[name])
+            lines.append(json.dumps(row, ensure_ascii=False))
+        lines.append("")
+        yield "\n".join(lines).encode("utf-8")
+
+
+def write_csv(chunks: Iterator[List[Dict[str, Any]]], include_paths: bool = False) -> Iterator[bytes]:
+    fieldnames = EXPORT_COLUMNS + (["instance_paths"] if include_paths else [])
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    writer.writeheader()
+    for rows in chunks:
+        for row in rows:
+            if include_paths:
+                row["instance_paths"] = json.dumps(row["instance_paths"], ensure_ascii=False)
+            writer.writerow(row)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """只追加的输出流，写入内容按块取走，位置按累计字节计算"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _arrow_schema(include_paths: bool):
+    import pyarrow as pa
+
+    int_columns = {"series_number", "file_count", "file_size_total",
+                   "slice_count", "missing_slices", "duplicate_slices", "missing_instance_numbers"}
+    float_columns = {"slice_spacing"}
+    bool_columns = {"orientation_consistent", "geometry_ok"}
+
+    def column_type(name):
+        if name in int_columns:
+            return pa.int64()
+        if name in float_columns:
+            return pa.float64()
+        if name in bool_columns:
+            return pa.bool_()
+        return pa.string()
+
+    fields = [pa.field(name, column_type(name)) for name in EXPORT_COLUMNS]
+    if include_paths:
+        fields.append(pa.field("instance_paths", pa.list_(pa.string())))
+    return pa.schema(fields)
+
+
+def write_arrow(chunks: Iterator[List[Dict[str, Any]]], include_paths: bool = False,
+                fmt: str = "parquet") -> Iterator[bytes]:
+    """Parquet（每块一个row group）或 Arrow IPC 流"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(include_paths)
+    sink = _ChunkSink()
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+
+    for rows in chunks:
+        writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+        data = sink.take()
+        if data:
+            yield data
+    writer.close()
+    yield sink.take()
+
+
+def export_catalog(db: Session, fmt: str, conditions: list, include_paths: bool = False,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """按格式流式导出，产出字节块"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    if fmt in ("parquet", "arrow"):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError(f"{fmt} 格式需要安装 pyarrow")
+
+    chunks = iter_series_chunks(db, conditions, include_paths, chunk_size)
+    if fmt == "ndjson":
+        return write_ndjson(chunks)
+    if fmt == "csv":
+        return write_csv(chunks, include_paths)
+    return write_arrow(chunks, include_paths, fmt)
@@ -0,0 +1,534 @@
+"""
+分布式扫描
+扫描根目录拆分为目录级工作单元存入 scan_work_units 表，多个工作进程（可在不同主机上，
+共享同一挂载和数据库）通过条件更新租用单元、解析后回报结果；
+租约过期的单元由其他进程重新领取，超过重试次数记为失败。
+全部单元处理完后由一个进程租用收尾，按序列UID顺序合并入库；收尾进程崩溃后租约过期，
+其他进程从断点继续。租约时间统一使用UTC，不受各主机时区影响
+"""
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import and_, func, insert, or_, select
+from sqlalchemy.orm import Session
+
+from app.db.database import SessionLocal
+from app.db.models import Scan, ScanConfig, ScanWorkResult, ScanWorkUnit
+from app.services.scan_profile import ScanProfile
+from app.services.scan_service import CATALOG_WRITE_LOCK, ScanService, generate_scan_id
+from app.services.scanner import DicomScanner
+from app.services.series_geometry import InstanceGeometry, geometry_columns, geometry_from_columns
+
+# 租约时长（秒），处理中定期续约
+LEASE_SECONDS = int(os.environ.get("SCAN_LEASE_SECONDS", "300"))
+# 单元最多尝试次数（含租约过期）
+MAX_ATTEMPTS = int(os.environ.get("SCAN_UNIT_MAX_ATTEMPTS", "3"))
+# 没有可领取单元时的等待间隔
+POLL_SECONDS = 2.0
+
+OPEN_STATUSES = ("pending", "leased")
+
+
+class LeaseLost(Exception):
+    """租约已过期并被其他进程领取"""
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def _utc_now() -> str:
+    """租约比较用的时间（UTC，多台主机时区不同也能比较）"""
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _lease_deadline(seconds: float) -> str:
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+
+
+class LeaseHeartbeat:
+    """处理期间在后台线程中定期续约
+
+    目录列举、DICOMDIR、压缩包读取等单个阶段就可能超过租约时长，不能只在记录循环中续约。
+    续约使用独立的数据库会话；续约失败（租约已被他人接手）时设置 lost
+    """
+
+    def __init__(self, renew: Callable[[Session], bool], interval: float):
+        self.renew = renew
+        self.interval = interval
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-heartbeat", daemon=True)
+
+    def __enter__(self) -> "LeaseHeartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        db = SessionLocal()
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    renewed = self.renew(db)
+                    db.commit()
+                except Exception as e:
+                    # 数据库暂时不可用：下次再试，租约到期前恢复即可
+                    db.rollback()
+                    print(f"续约失败: {e}")
+                    continue
+                if not renewed:
+                    self.lost.set()
+                    return
+        finally:
+            db.close()
+
+
+class DistributedScanService:
+    """分布式扫描的创建、进度与收尾"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def create_scan(self, scan_config_id: int) -> Scan:
+        """创建扫描记录和根目录单元，由工作进程执行"""
+        config = self.db.query(ScanConfig).filter(ScanConfig.id == scan_config_id).first()
+        if not config:
+            raise ValueError(f"扫描配置不存在: {scan_config_id}")
+        if not os.path.isdir(config.scan_path):
+            raise ValueError(f"扫描路径不存在: {config.scan_path}")
+
+        scan = Scan(
+            id=generate_scan_id(),
+            config_id=config.id,
+            scan_path=config.scan_path,
+            scan_type="distributed",
+            started_at=_now(),
+            status="running",
+        )
+        self.db.add(scan)
+        self.db.add(ScanWorkUnit(scan_id=scan.id, dir_path=config.scan_path, status="pending"))
+        self.db.commit()
+        return scan
+
+    def unit_summary(self, scan_id: str) -> Dict[str, int]:
+        """各状态的单元数"""
+        rows = self.db.query(ScanWorkUnit.status, func.count(ScanWorkUnit.id)).filter(
+            ScanWorkUnit.scan_id == scan_id
+        ).group_by(ScanWorkUnit.status)
+        return {status: count for status, count in rows}
+
+    def retry_failed_units(self, scan_id: str) -> int:
+        """失败的单元重新排队，返回数量"""
+        count = self.db.query(ScanWorkUnit).filter(
+            ScanWorkUnit.scan_id == scan_id, ScanWorkUnit.status == "failed"
+        ).update({
+            ScanWorkUnit.status: "pending",
+            ScanWorkUnit.attempts: 0,
+            ScanWorkUnit.lease_owner: None,
+            ScanWorkUnit.error: None,
+        }, synchronize_session=False)
+        self.db.commit()
+        return count
+
+    def has_open_units(self, scan_id: str) -> bool:
+        return self.db.query(ScanWorkUnit.id).filter(
+            ScanWorkUnit.scan_id == scan_id, ScanWorkUnit.status.in_(OPEN_STATUSES)
+        ).first() is not None
+
+    def finalize(self, scan_id: str, owner: Optional[str] = None,
+                 lease_seconds: float = LEASE_SECONDS) -> Optional[Scan]:
+        """全部单元结束后合并结果入库；只有租到收尾的进程执行，其余返回None
+
+        收尾租约过期（收尾进程崩溃）后可被其他进程重新租用，从断点（最后入库的UID）继续。
+        有失败单元时不入库，扫描记为failed并保留结果，续扫重试失败单元后重新收尾；
+        只有全部成功时才删除中间结果
+        """
+        owner = owner or default_worker_id()
+        claimed = self.db.query(Scan).filter(
+            Scan.id == scan_id,
+            or_(Scan.status == "running",
+                and_(Scan.status == "finalizing",
+                     or_(Scan.lease_expires_at.is_(None), Scan.lease_expires_at < _utc_now()))),
+        ).update({
+            Scan.status: "finalizing",
+            Scan.lease_owner: owner,
+            Scan.lease_expires_at: _lease_deadline(lease_seconds),
+        }, synchronize_session=False)
+        self.db.commit()
+        if not claimed:
+            return None
+        if self.has_open_units(scan_id):
+            # 抢占前其他进程又加入了单元，交还给工作进程
+            self._release_finalize(scan_id, owner, "running")
+            return None
+
+        scan = self.db.query(Scan).filter(Scan.id == scan_id).first()
+        profile = self._collect_profile(scan_id)
+        failed = self.unit_summary(scan_id).get("failed", 0)
+        if failed:
+            profile.error = f"{failed} 个目录处理失败，结果已保留，续扫可重试失败目录"
+            return self._finish(scan, profile, "failed")
+
+        def renew(db: Session) -> bool:
+            return self._renew_finalize(db, scan_id, owner, lease_seconds)
+
+        try:
+            with LeaseHeartbeat(renew, lease_seconds / 3) as heartbeat, profile.stage("persist"):
+                self._merge_results(scan, owner, lease_seconds, heartbeat)
+        except LeaseLost:
+            self.db.rollback()
+            print(f"收尾租约已失效，放弃收尾: {scan_id}")
+            return None
+        except Exception as e:
+            self.db.rollback()
+            profile.error = f"{type(e).__name__}: {e}"
+            print(f"分布式扫描收尾失败: {e}")
+            return self._finish(scan, profile, "failed")
+
+        self.db.query(ScanWorkResult).filter(ScanWorkResult.scan_id == scan_id).delete(
+            synchronize_session=False
+        )
+        if scan.config_id is not None:
+            config = self.db.query(ScanConfig).filter(ScanConfig.id == scan.config_id).first()
+            if config is not None:
+                config.last_scan_at = _now()
+        scan.checkpoint = None
+        return self._finish(scan, profile, "completed")
+
+    def _merge_results(self, scan: Scan, owner: str, lease_seconds: float, heartbeat: LeaseHeartbeat):
+        """按UID顺序分批入库，每批与断点一起提交；提交前确认仍持有收尾租约"""
+        service = ScanService(self.db)
+        checkpoint = scan.get_checkpoint()
+        for batch in self._iter_result_batches(scan.id, service.COMMIT_BATCH_SIZE,
+                                               after_uid=checkpoint.get("last_series_uid", "")):
+            if heartbeat.lost.is_set():
+                raise LeaseLost(scan.id)
+            samples = service._read_samples(batch)
+            with CATALOG_WRITE_LOCK:
+                new, duplicated = service._persist_batch(batch, scan.id, samples)
+                checkpoint["last_series_uid"] = batch[-1][0]
+                checkpoint["series_found"] = checkpoint.get("series_found", 0) + len(batch)
+                checkpoint["series_new"] = checkpoint.get("series_new", 0) + new
+                checkpoint["series_duplicated"] = checkpoint.get("series_duplicated", 0) + duplicated
+                saved = self.db.query(Scan).filter(
+                    Scan.id == scan.id, Scan.status == "finalizing", Scan.lease_owner == owner
+                ).update({
+                    Scan.checkpoint: json.dumps(checkpoint, ensure_ascii=False),
+                    Scan.lease_expires_at: _lease_deadline(lease_seconds),
+                }, synchronize_session=False)
+                if not saved:
+                    raise LeaseLost(scan.id)
+                self.db.commit()
+
+        scan.series_found = checkpoint.get("series_found", 0)
+        scan.series_new = checkpoint.get("series_new", 0)
+        scan.series_duplicated = checkpoint.get("series_duplicated", 0)
+
+    def _finish(self, scan: Scan, profile: ScanProfile, status: str) -> Scan:
+        """写回结束状态并释放收尾租约"""
+        scan.status = status
+        scan.finished_at = _now()
+        scan.lease_owner = None
+        scan.lease_expires_at = None
+        scan.profile = json.dumps(profile.to_dict(), ensure_ascii=False)
+        self.db.commit()
+        return scan
+
+    def _release_finalize(self, scan_id: str, owner: str, status: str):
+        self.db.query(Scan).filter(Scan.id == scan_id, Scan.lease_owner == owner).update({
+            Scan.status: status,
+            Scan.lease_owner: None,
+            Scan.lease_expires_at: None,
+        }, synchronize_session=False)
+        self.db.commit()
+
+    @staticmethod
+    def _renew_finalize(db: Session, scan_id: str, owner: str, lease_seconds: float) -> bool:
+        return bool(db.query(Scan).filter(
+            Scan.id == scan_id, Scan.status == "finalizing", Scan.lease_owner == owner
+        ).update({Scan.lease_expires_at: _lease_deadline(lease_seconds)}, synchronize_session=False))
+
+    def _iter_result_batches(self, scan_id: str, batch_size: int, after_uid: str = ""):
+        """按序列UID顺序分批产出 [(uid, 文件列表, 文件大小列表, 几何信息列表)]，每批独立查询以便中途提交"""
+        last_uid = after_uid
+        while True:
+            uids = [uid for (uid,) in self.db.execute(
+                select(ScanWorkResult.series_uid).where(
+                    ScanWorkResult.scan_id == scan_id, ScanWorkResult.series_uid > last_uid
+                ).distinct().order_by(ScanWorkResult.series_uid).limit(batch_size)
+            )]
+            if not uids:
+                return
+
+            files: Dict[str, List[str]] = {}
+            sizes: Dict[str, List[int]] = {}
+            geometries: Dict[str, List[Optional[InstanceGeometry]]] = {}
+            orientations: Dict[str, tuple] = {}  # 同一方向字符串只解码一次
+            rows = self.db.execute(
+                select(
+                    ScanWorkResult.series_uid, ScanWorkResult.file_path, ScanWorkResult.file_size,
+                    ScanWorkResult.instance_number, ScanWorkResult.position_x,
+                    ScanWorkResult.position_y, ScanWorkResult.position_z, ScanWorkResult.orientation,
+                ).where(
+                    ScanWorkResult.scan_id == scan_id, ScanWorkResult.series_uid.in_(uids)
+                ).order_by(ScanWorkResult.series_uid, ScanWorkResult.file_path)
+            )
+            for uid, file_path, file_size, number, x, y, z, orientation in rows:
+                files.setdefault(uid, []).append(file_path)
+                sizes.setdefault(uid, []).append(file_size or 0)
+                geometries.setdefault(uid, []).append(
+                    geometry_from_columns(number, x, y, z, orientation, orientations)
+                )
+
+            yield [(uid, files[uid], sizes[uid], geometries[uid]) for uid in uids]
+            last_uid = uids[-1]
+
+    def _collect_profile(self, scan_id: str) -> ScanProfile:
+        """汇总各单元的统计"""
+        profile = ScanProfile()
+        totals = self.db.query(
+            func.coalesce(func.sum(ScanWorkUnit.files_walked), 0),
+            func.coalesce(func.sum(ScanWorkUnit.files_parsed), 0),
+            func.coalesce(func.sum(ScanWorkUnit.bytes_read), 0),
+            func.coalesce(func.sum(ScanWorkUnit.non_dicom_skipped), 0),
+            func.coalesce(func.sum(ScanWorkUnit.files_indexed), 0),
+            func.coalesce(func.sum(ScanWorkUnit.seconds), 0.0),
+        ).filter(ScanWorkUnit.scan_id == scan_id).one()
+        (profile.files_walked, profile.files_parsed, profile.bytes_read,
+         profile.non_dicom_skipped, profile.files_indexed, worker_seconds) = totals
+        # 各进程累计的处理耗时（并行执行，大于实际经过时间）
+        profile.stage_seconds["worker"] = float(worker_seconds)
+
+        for (failures,) in self.db.query(ScanWorkUnit.parse_failures).filter(
+                ScanWorkUnit.scan_id == scan_id, ScanWorkUnit.parse_failures.isnot(None)):
+            profile.merge_failures(json.loads(failures))
+
+        slowest = self.db.query(ScanWorkUnit).filter(
+            ScanWorkUnit.scan_id == scan_id
+        ).order_by(ScanWorkUnit.seconds.desc()).limit(profile.MAX_SLOW_DIRS)
+        for unit in slowest:
+            profile.record_directory(unit.dir_path, unit.seconds or 0.0, unit.files_walked or 0)
+        return profile
+
+
+class ScanWorker:
+    """扫描工作进程：循环领取单元 -> 解析 -> 回报，直到没有未完成的单元"""
+
+    def __init__(self, worker_id: Optional[str] = None, scan_id: Optional[str] = None,
+                 lease_seconds: int = LEASE_SECONDS):
+        self.worker_id = worker_id or default_worker_id()
+        self.scan_id = scan_id
+        self.lease_seconds = lease_seconds
+        self.scanner = DicomScanner()
+
+    def run(self, follow: bool = False) -> int:
+        """处理单元直至全部完成（follow=True 时持续等待新扫描），返回处理的单元数"""
+        processed = 0
+        db = SessionLocal()
+        try:
+            while True:
+                unit = self.lease_unit(db)
+                if unit is not None:
+                    if self.process_unit(db, unit):
+                        processed += 1
+                    continue
+
+                service = DistributedScanService(db)
+                open_scans = 0
+                # 收尾中的扫描也检查：收尾进程崩溃、租约过期后由本进程接手
+                for scan_id in self._scan_ids(db, ("running", "finalizing")):
+                    if service.has_open_units(scan_id):
+                        open_scans += 1
+                        continue
+                    scan = service.finalize(scan_id, self.worker_id, self.lease_seconds)
+                    if scan is not None:
+                        print(f"[{self.worker_id}] 扫描 {scan_id} 已结束: {scan.status}")
+
+                if not open_scans and not follow:
+                    return processed
+                time.sleep(POLL_SECONDS)
+        finally:
+            db.close()
+
+    def _scan_ids(self, db: Session, statuses=("running",)) -> List[str]:
+        query = db.query(Scan.id).filter(Scan.scan_type == "distributed", Scan.status.in_(statuses))
+        if self.scan_id:
+            query = query.filter(Scan.id == self.scan_id)
+        return [scan_id for (scan_id,) in query]
+
+    def _leasable(self, now: str):
+        return or_(
+            ScanWorkUnit.status == "pending",
+            and_(ScanWorkUnit.status == "leased", ScanWorkUnit.lease_expires_at < now),
+        )
+
+    def lease_unit(self, db: Session) -> Optional[ScanWorkUnit]:
+        """领取一个待处理或租约过期的单元（条件更新，多个进程并发领取互不冲突）"""
+        scan_ids = self._scan_ids(db)
+        if not scan_ids:
+            return None
+        now = _utc_now()
+
+        # 租约过期且已达重试上限的单元（工作进程反复崩溃）不再重试
+        db.query(ScanWorkUnit).filter(
+            ScanWorkUnit.scan_id.in_(scan_ids),
+            ScanWorkUnit.status == "leased",
+            ScanWorkUnit.lease_expires_at < now,
+            ScanWorkUnit.attempts >= MAX_ATTEMPTS,
+        ).update({
+            ScanWorkUnit.status: "failed",
+            ScanWorkUnit.error: "租约多次过期",
+        }, synchronize_session=False)
+        db.commit()
+
+        candidates = [unit_id for (unit_id,) in db.query(ScanWorkUnit.id).filter(
+            ScanWorkUnit.scan_id.in_(scan_ids), self._leasable(now)
+        ).order_by(ScanWorkUnit.id).limit(20)]
+
+        for unit_id in candidates:
+            claimed = db.query(ScanWorkUnit).filter(
+                ScanWorkUnit.id == unit_id, self._leasable(now)
+            ).update({
+                ScanWorkUnit.status: "leased",
+                ScanWorkUnit.lease_owner: self.worker_id,
+                ScanWorkUnit.lease_expires_at: _lease_deadline(self.lease_seconds),
+                ScanWorkUnit.attempts: ScanWorkUnit.attempts + 1,
+            }, synchronize_session=False)
+            db.commit()
+            if claimed:
+                return db.query(ScanWorkUnit).filter(ScanWorkUnit.id == unit_id).first()
+        return None
+
+    def _renew_lease(self, db: Session, unit_id: int) -> bool:
+        """延长单元租约（不提交），租约已不属于本进程时返回False"""
+        return bool(db.query(ScanWorkUnit).filter(
+            ScanWorkUnit.id == unit_id,
+            ScanWorkUnit.status == "leased",
+            ScanWorkUnit.lease_owner == self.worker_id,
+        ).update({ScanWorkUnit.lease_expires_at: _lease_deadline(self.lease_seconds)},
+                 synchronize_session=False))
+
+    def process_unit(self, db: Session, unit: ScanWorkUnit) -> bool:
+        """解析单元目录下的文件，子目录作为新单元加入；返回是否成功提交"""
+        profile = ScanProfile()
+        start = time.perf_counter()
+        unit_id = unit.id
+
+        def renew(heartbeat_db: Session) -> bool:
+            return self._renew_lease(heartbeat_db, unit_id)
+
+        try:
+            with LeaseHeartbeat(renew, self.lease_seconds / 3) as heartbeat:
+                filenames, subdirs = self._list_directory(unit.dir_path)
+                dicomdir = self.scanner.find_dicomdir(unit.dir_path, filenames)
+                media = self.scanner.read_dicomdir(dicomdir, profile) if dicomdir else None
+                if media is not None:
+                    # 子树已由DICOMDIR覆盖，不再拆分子目录
+                    records = (entry for _, dir_entries in media for entry in dir_entries)
+                else:
+                    # 子目录在解析本目录文件之前加入，本目录失败时子树照常扫描
+                    self._enqueue_subdirs(db, unit, subdirs)
+                    records = self.scanner.iter_dir_entries(unit.dir_path, filenames, profile)
+
+                entries = []
+                for series_uid, file_path, file_size, geometry in records:
+                    entries.append({"scan_id": unit.scan_id, "unit_id": unit_id, "series_uid": series_uid,
+                                    "file_path": file_path, "file_size": file_size,
+                                    **geometry_columns(geometry)})
+                    if heartbeat.lost.is_set():
+                        raise LeaseLost(unit.dir_path)
+
+            return self._complete(db, unit, entries, profile, time.perf_counter() - start)
+
+        except LeaseLost:
+            db.rollback()
+            print(f"[{self.worker_id}] 租约已失效，放弃单元: {unit.dir_path}")
+            return False
+        except Exception as e:
+            db.rollback()
+            self._fail(db, unit, e)
+            return False
+
+    @staticmethod
+    def _list_directory(dir_path: str):
+        """列出目录下的文件名与子目录（不跟随符号链接）"""
+        filenames, subdirs = [], []
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    filenames.append(entry.name)
+        return filenames, sorted(subdirs)
+
+    def _enqueue_subdirs(self, db: Session, unit: ScanWorkUnit, subdirs: List[str]):
+        """子目录加入为新单元（已存在的跳过，单元重试时不会重复加入）；租约已被他人接手时放弃"""
+        if not self._renew_lease(db, unit.id):
+            db.rollback()
+            raise LeaseLost(unit.dir_path)
+        existing = set()
+        for i in range(0, len(subdirs), 500):
+            existing.update(path for (path,) in db.query(ScanWorkUnit.dir_path).filter(
+                ScanWorkUnit.scan_id == unit.scan_id, ScanWorkUnit.dir_path.in_(subdirs[i:i + 500])
+            ))
+        new_dirs = [path for path in subdirs if path not in existing]
+        if new_dirs:
+            db.execute(insert(ScanWorkUnit), [
+                {"scan_id": unit.scan_id, "dir_path": path, "status": "pending", "attempts": 0}
+                for path in new_dirs
+            ])
+        db.commit()
+
+    def _complete(self, db: Session, unit: ScanWorkUnit, entries: List[dict],
+                  profile: ScanProfile, seconds: float) -> bool:
+        """结果与完成状态在同一事务提交；租约已被他人接手时放弃"""
+        completed = db.query(ScanWorkUnit).filter(
+            ScanWorkUnit.id == unit.id,
+            ScanWorkUnit.status == "leased",
+            ScanWorkUnit.lease_owner == self.worker_id,
+        ).update({
+            ScanWorkUnit.status: "done",
+            ScanWorkUnit.files_walked: profile.files_walked,
+            ScanWorkUnit.files_parsed: profile.files_parsed,
+            ScanWorkUnit.bytes_read: profile.bytes_read,
+            ScanWorkUnit.non_dicom_skipped: profile.non_dicom_skipped,
+            ScanWorkUnit.files_indexed: profile.files_indexed,
+            ScanWorkUnit.seconds: seconds,
+            ScanWorkUnit.parse_failures: (json.dumps(profile.parse_failures, ensure_ascii=False)
+                                          if profile.parse_failures else None),
+        }, synchronize_session=False)
+        if not completed:
+            db.rollback()
+            print(f"[{self.worker_id}] 租约已失效，放弃单元: {unit.dir_path}")
+            return False
+
+        if entries:
+            db.execute(insert(ScanWorkResult), entries)
+        db.commit()
+        return True
+
+    def _fail(self, db: Session, unit: ScanWorkUnit, exc: Exception):
+        """处理出错：未达重试上限则重新排队"""
+        print(f"[{self.worker_id}] 处理单元失败 {unit.dir_path}: {exc}")
+        attempts = db.query(ScanWorkUnit.attempts).filter(ScanWorkUnit.id == unit.id).scalar() or 0
+        db.query(ScanWorkUnit).filter(
+            ScanWorkUnit.id == unit.id, ScanWorkUnit.lease_owner == self.worker_id
+        ).update({
+            ScanWorkUnit.status: "failed" if attempts >= MAX_ATTEMPTS else "pending",
+            ScanWorkUnit.lease_owner: None,
+            ScanWorkUnit.error: f"{type(exc).__name__}: {exc}"[:1000],
+        }, synchronize_session=False)
+        db.commit()
@@ -0,0 +1,208 @@
+"""
+患者/检查汇总服务
+入库新序列时增量更新 patients / studies 汇总表，浏览接口只读汇总表
+"""
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from app.db.models import Series, Study, Patient
+
+
+def add_modality(modalities: Optional[str], modality: Optional[str]) -> str:
+    """向 |CT|MR| 形式的模态集合中加入一个模态"""
+    modalities = modalities or "|"
+    if modality and f"|{modality}|" not in modalities:
+        modalities = f"{modalities}{modality}|"
+    return modalities
+
+
+def split_modalities(modalities: Optional[str]) -> list:
+    return [m for m in (modalities or "").split("|") if m]
+
+
+def _min(current: Optional[str], value: Optional[str]) -> Optional[str]:
+    """与SQL MIN一致：忽略空值"""
+    if value is None:
+        return current
+    return value if current is None or value < current else current
+
+
+def _max(current: Optional[str], value: Optional[str]) -> Optional[str]:
+    if value is None:
+        return current
+    return value if current is None or value > current else current
+
+
+def _coalesce_equals(column, value: str):
+    """汇总表用空字符串表示缺失，对应序列表中的空值或空字符串"""
+    if value:
+        return column == value
+    return or_(column.is_(None), column == "")
+
+
+class HierarchyService:
+    """患者/检查汇总维护
+
+    增量更新与 rebuild 使用同一规则：
+    - 检查的 patient_id / study_date 取其各序列中的最小值
+    - 患者的统计按序列自身的 patient_id 汇总：检查数为该患者序列涉及的不同检查数，
+      同一检查中不同PatientID的序列分别计入各自的患者
+    - 患者基本信息取各序列中的最小值
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def add_series(self, series: Series):
+        """新序列入库后更新所属检查与患者的汇总（与序列在同一事务）"""
+        now = datetime.now().isoformat()
+        study_uid = series.study_instance_uid or ""
+        patient_id = series.patient_id or ""
+        file_count = series.file_count or 0
+        file_size = series.file_size_total or 0
+
+        study = self.db.get(Study, study_uid)
+        if study is None:
+            study = Study(
+                study_instance_uid=study_uid,
+                patient_id=patient_id,
+                series_count=0,
+                file_count=0,
+                file_size_total=0,
+                modalities="|",
+            )
+            self.db.add(study)
+        study.patient_id = _min(study.patient_id, patient_id)
+        study.study_date = _min(study.study_date, series.study_date)
+        study.series_count += 1
+        study.file_count += file_count
+        study.file_size_total += file_size
+        study.modalities = add_modality(study.modalities, series.modality)
+        study.updated_at = now
+
+        patient = self.db.get(Patient, patient_id)
+        if patient is None:
+            patient = Patient(
+                patient_id=patient_id,
+                study_count=0,
+                series_count=0,
+                file_size_total=0,
+                modalities="|",
+            )
+            self.db.add(patient)
+        patient.patient_name = _min(patient.patient_name, series.patient_name)
+        patient.patient_sex = _min(patient.patient_sex, series.patient_sex)
+        patient.patient_birth_date = _min(patient.patient_birth_date, series.patient_birth_date)
+        if not self._patient_has_study(patient_id, study_uid, series.id):
+            patient.study_count += 1
+        patient.series_count += 1
+        patient.file_size_total += file_size
+        patient.modalities = add_modality(patient.modalities, series.modality)
+        patient.first_study_date = _min(patient.first_study_date, series.study_date)
+        patient.last_study_date = _max(patient.last_study_date, series.study_date)
+        patient.updated_at = now
+
+        # 会话不自动flush，立即写入使同一批次后续序列能查到新建的检查/患者
+        self.db.flush()
+
+    def _patient_has_study(self, patient_id: str, study_uid: str, exclude_series_id: str) -> bool:
+        """该患者在此检查中是否已有其他序列"""
+        query = self.db.query(Series.id).filter(
+            _coalesce_equals(Series.patient_id, patient_id),
+            _coalesce_equals(Series.study_instance_uid, study_uid),
+            Series.is_active == True,
+            Series.id != exclude_series_id,
+        )
+        return query.first() is not None
+
+    def add_files(self, series: Series, file_count: int, file_size: int):
+        """已有序列追加实例后更新所属检查与患者的文件数和大小"""
+        now = datetime.now().isoformat()
+        study = self.db.get(Study, series.study_instance_uid or "")
+        if study is not None:
+            study.file_count += file_count
+            study.file_size_total += file_size
+            study.updated_at = now
+        patient = self.db.get(Patient, series.patient_id or "")
+        if patient is not None:
+            patient.file_size_total += file_size
+            patient.updated_at = now
+
+    def rebuild(self) -> int:
+        """从series表重建汇总表，返回检查数"""
+        self.db.query(Study).delete()
+        self.db.query(Patient).delete()
+
+        now = datetime.now().isoformat()
+        active = Series.is_active == True
+        study_uid_col = func.coalesce(Series.study_instance_uid, "")
+        patient_id_col = func.coalesce(Series.patient_id, "")
+
+        study_modalities = {}
+        patient_modalities = {}
+        for study_uid, patient_id, modality in self.db.query(
+                study_uid_col, patient_id_col, Series.modality
+        ).filter(active).distinct():
+            study_modalities[study_uid] = add_modality(study_modalities.get(study_uid), modality)
+            patient_modalities[patient_id] = add_modality(patient_modalities.get(patient_id), modality)
+
+        count = 0
+        for row in self.db.query(
+            study_uid_col.label("study_uid"),
+            func.min(patient_id_col).label("patient_id"),
+            func.min(Series.study_date).label("study_date"),
+            func.count(Series.id).label("series_count"),
+            func.coalesce(func.sum(Series.file_count), 0).label("file_count"),
+            func.coalesce(func.sum(Series.file_size_total), 0).label("file_size_total"),
+        ).filter(active).group_by(study_uid_col):
+            self.db.add(Study(
+                study_instance_uid=row.study_uid,
+                patient_id=row.patient_id,
+                study_date=row.study_date,
+                series_count=row.series_count,
+                file_count=row.file_count,
+                file_size_total=row.file_size_total,
+                modalities=study_modalities.get(row.study_uid, "|"),
+                updated_at=now,
+            ))
+            count += 1
+
+        # 患者统计与基本信息按序列自身的PatientID一次分组查出
+        for row in self.db.query(
+            patient_id_col.label("patient_id"),
+            func.min(Series.patient_name).label("patient_name"),
+            func.min(Series.patient_sex).label("patient_sex"),
+            func.min(Series.patient_birth_date).label("patient_birth_date"),
+            func.count(func.distinct(study_uid_col)).label("study_count"),
+            func.count(Series.id).label("series_count"),
+            func.coalesce(func.sum(Series.file_size_total), 0).label("file_size_total"),
+            func.min(Series.study_date).label("first_study_date"),
+            func.max(Series.study_date).label("last_study_date"),
+        ).filter(active).group_by(patient_id_col):
+            self.db.add(Patient(
+                patient_id=row.patient_id,
+                patient_name=row.patient_name,
+                patient_sex=row.patient_sex,
+                patient_birth_date=row.patient_birth_date,
+                study_count=row.study_count,
+                series_count=row.series_count,
+                file_size_total=row.file_size_total,
+                modalities=patient_modalities.get(row.patient_id, "|"),
+                first_study_date=row.first_study_date,
+                last_study_date=row.last_study_date,
+                updated_at=now,
+            ))
+
+        self.db.commit()
+        return count
+
+    def rebuild_if_empty(self) -> int:
+        """汇总表为空而序列表有数据时（升级后首次启动）回填"""
+        if self.db.query(Study).first() is not None:
+            return 0
+        if self.db.query(Series).first() is None:
+            return 0
+        return self.rebuild()
@@ -0,0 +1,47 @@
+"""
+挂载点信息
+根据 /proc/mounts 判断路径所在的挂载点及文件系统类型
+"""
+import os
+import re
+from typing import Dict, List, Tuple
+
+# 网络文件系统类型（不支持inotify事件，需要轮询）
+NETWORK_FS_TYPES = {
+    "nfs", "nfs4", "cifs", "smbfs", "smb3", "9p", "afs", "ceph",
+    "glusterfs", "fuse.glusterfs", "fuse.sshfs", "fuse.s3fs", "davfs",
+}
+
+
+def _read_mounts() -> List[Tuple[str, str, str]]:
+    """读取 (设备, 挂载点, 文件系统类型) 列表"""
+    mounts = []
+    try:
+        with open("/proc/mounts", "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3:
+                    # 挂载点中的空格等字符以八进制转义
+                    mount_point = re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), parts[1])
+                    mounts.append((parts[0], mount_point, parts[2]))
+    except OSError:
+        pass
+    return mounts
+
+
+def find_mount(path: str) -> Dict[str, str]:
+    """返回路径所在挂载点 {"device", "mount_point", "fstype"}"""
+    real_path = os.path.realpath(path)
+    best = {"device": "", "mount_point": "/", "fstype": ""}
+    best_len = -1
+    for device, mount_point, fstype in _read_mounts():
+        prefix = mount_point.rstrip("/") + "/"
+        if (real_path == mount_point or real_path.startswith(prefix)) and len(mount_point) > best_len:
+            best = {"device": device, "mount_point": mount_point, "fstype": fstype}
+            best_len = len(mount_point)
+    return best
+
+
+def is_network_mount(path: str) -> bool:
+    """路径是否位于网络文件系统上"""
+    return find_mount(path)["fstype"] in NETWORK_FS_TYPES
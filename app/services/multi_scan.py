@@ -0,0 +1,117 @@
+"""
+多根目录并发扫描
+按挂载设备分组，每个设备独立的工作线程池（并发上限），慢设备不会拖住其他设备；
+各线程使用独立的数据库会话，入库阶段由 CATALOG_WRITE_LOCK 串行
+"""
+import os
+import queue
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from app.db.database import SessionLocal
+from app.db.models import ScanConfig
+from app.services.mounts import NETWORK_FS_TYPES, find_mount
+from app.services.scan_service import ScanService
+
+# 每个挂载设备同时扫描的根目录数
+MOUNT_CONCURRENCY = int(os.environ.get("SCAN_MOUNT_CONCURRENCY", "2"))
+# 全部设备合计的并发扫描上限
+MAX_CONCURRENT_SCANS = int(os.environ.get("SCAN_MAX_CONCURRENCY", "8"))
+
+
+def mount_key(path: str) -> str:
+    """根目录所在的设备标识（同一NAS的多个导出/共享归为一组）"""
+    mount = find_mount(path)
+    device = mount["device"]
+    if mount["fstype"] in NETWORK_FS_TYPES:
+        # 网络挂载按主机分组：NFS为 host:/export，CIFS为 //host/share
+        if device.startswith("//"):
+            return device[2:].split("/", 1)[0]
+        if ":/" in device:
+            return device.split(":/", 1)[0]
+    return device or mount["mount_point"]
+
+
+def group_by_mount(configs: List[ScanConfig]) -> Dict[str, List[ScanConfig]]:
+    groups: Dict[str, List[ScanConfig]] = {}
+    for config in configs:
+        groups.setdefault(mount_key(config.scan_path), []).append(config)
+    return groups
+
+
+class MultiRootScanner:
+    """并发扫描多个扫描配置"""
+
+    def __init__(self, mount_concurrency: Optional[int] = None,
+                 max_concurrency: Optional[int] = None):
+        self.mount_concurrency = max(1, mount_concurrency or MOUNT_CONCURRENCY)
+        self.max_concurrency = max(1, max_concurrency or MAX_CONCURRENT_SCANS)
+
+    def scan_all(self, config_ids: Optional[List[int]] = None,
+                 out_of_core: bool = False) -> List[str]:
+        """扫描全部启用的配置（或指定配置），阻塞至全部完成，返回扫描ID列表"""
+        scan_ids, threads = self._start(config_ids, out_of_core)
+        for thread in threads:
+            thread.join()
+        return scan_ids
+
+    def start_all(self, config_ids: Optional[List[int]] = None,
+                  out_of_core: bool = False) -> List[str]:
+        """创建扫描记录后在后台线程中执行，立即返回扫描ID列表"""
+        scan_ids, _ = self._start(config_ids, out_of_core)
+        return scan_ids
+
+    def _start(self, config_ids: Optional[List[int]],
+               out_of_core: bool) -> Tuple[List[str], List[threading.Thread]]:
+        """为每个配置创建扫描记录（排队的扫描也是running，进程重启后可续扫），按设备启动工作线程"""
+        db = SessionLocal()
+        try:
+            query = db.query(ScanConfig).filter(ScanConfig.is_active == True)
+            if config_ids:
+                query = query.filter(ScanConfig.id.in_(config_ids))
+            service = ScanService(db)
+            groups = {
+                key: [service.create_scan(config.id).id for config in configs]
+                for key, configs in group_by_mount(query.order_by(ScanConfig.id).all()).items()
+            }
+        finally:
+            db.close()
+
+        for key, ids in groups.items():
+            print(f"设备 {key}: {len(ids)} 个扫描根目录")
+
+        # 全局上限：各设备的线程在开始扫描前再取一次全局许可
+        global_slots = threading.BoundedSemaphore(self.max_concurrency)
+
+        def worker(pending: "queue.Queue[str]"):
+            while True:
+                try:
+                    scan_id = pending.get_nowait()
+                except queue.Empty:
+                    return
+                with global_slots:
+                    self._scan_one(scan_id, out_of_core)
+
+        threads = []
+        for key, ids in groups.items():
+            pending: "queue.Queue[str]" = queue.Queue()
+            for scan_id in ids:
+                pending.put(scan_id)
+            for i in range(min(self.mount_concurrency, len(ids))):
+                thread = threading.Thread(target=worker, args=(pending,),
+                                          name=f"scan-{key}-{i}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        return [scan_id for ids in groups.values() for scan_id in ids], threads
+
+    @staticmethod
+    def _scan_one(scan_id: str, out_of_core: bool):
+        """在线程内用独立会话执行单个扫描"""
+        db = SessionLocal()
+        try:
+            ScanService(db).execute_scan(scan_id, out_of_core=out_of_core)
+        except Exception as e:
+            print(f"扫描 {scan_id} 失败: {e}")
+        finally:
+            db.close()
@@ -0,0 +1,97 @@
+"""
+扫描性能画像
+记录一次扫描各阶段的耗时、文件计数、解析失败和最慢目录，扫描结束后以JSON存入Scan记录
+"""
+import heapq
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Tuple
+
+
+class ScanProfile:
+    """单次扫描的性能统计"""
+
+    # 每种异常类型保留的示例路径数
+    MAX_FAILURE_SAMPLES = 5
+    # 保留的最慢目录数
+    MAX_SLOW_DIRS = 10
+
+    def __init__(self):
+        self.files_walked = 0       # 遍历到的文件数
+        self.files_parsed = 0       # 成功解析的DICOM文件数
+        self.bytes_read = 0         # 成功解析文件的总字节数
+        self.non_dicom_skipped = 0  # 非DICOM跳过数
+        self.files_indexed = 0      # 按DICOMDIR枚举、未逐个打开的文件数
+        self.parse_failures: Dict[str, Dict[str, Any]] = {}
+        self.stage_seconds: Dict[str, float] = {}
+        self._dir_stats: Dict[str, List[float]] = {}  # 目录 -> [耗时, 文件数]
+        self.error: str = ""
+
+    @contextmanager
+    def stage(self, name: str):
+        """统计一个阶段的耗时（同名阶段累加）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - start)
+
+    def add_stage_time(self, name: str, seconds: float):
+        """累加阶段耗时（用于生成器内逐项计时，不能用 stage 包住整个生成器）"""
+        self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+
+    def record_failure(self, file_path: str, exc: BaseException):
+        """记录一次解析失败"""
+        key = type(exc).__name__
+        entry = self.parse_failures.setdefault(key, {"count": 0, "samples": []})
+        entry["count"] += 1
+        if len(entry["samples"]) < self.MAX_FAILURE_SAMPLES:
+            entry["samples"].append({"path": file_path, "message": str(exc)[:200]})
+
+    def merge(self, other: "ScanProfile"):
+        """合并另一份统计的计数与解析失败（不含阶段耗时和目录耗时）"""
+        self.files_walked += other.files_walked
+        self.files_parsed += other.files_parsed
+        self.bytes_read += other.bytes_read
+        self.non_dicom_skipped += other.non_dicom_skipped
+        self.files_indexed += other.files_indexed
+        self.merge_failures(other.parse_failures)
+
+    def merge_failures(self, failures: Dict[str, Dict[str, Any]]):
+        """合并另一份 parse_failures 统计（分布式扫描汇总各工作单元）"""
+        for key, other in failures.items():
+            entry = self.parse_failures.setdefault(key, {"count": 0, "samples": []})
+            entry["count"] += other.get("count", 0)
+            room = self.MAX_FAILURE_SAMPLES - len(entry["samples"])
+            if room > 0:
+                entry["samples"].extend(other.get("samples", [])[:room])
+
+    def record_directory(self, dir_path: str, seconds: float, file_count: int = 0):
+        """累加目录耗时（遍历和解析阶段分别计入）"""
+        stats = self._dir_stats.setdefault(dir_path, [0.0, 0])
+        stats[0] += seconds
+        stats[1] += file_count
+
+    @property
+    def parse_failure_count(self) -> int:
+        return sum(entry["count"] for entry in self.parse_failures.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        slowest: List[Tuple[str, List[float]]] = heapq.nlargest(
+            self.MAX_SLOW_DIRS, self._dir_stats.items(), key=lambda item: item[1][0]
+        )
+        return {
+            "files_walked": self.files_walked,
+            "files_parsed": self.files_parsed,
+            "bytes_read": self.bytes_read,
+            "non_dicom_skipped": self.non_dicom_skipped,
+            "files_indexed": self.files_indexed,
+            "parse_failure_count": self.parse_failure_count,
+            "parse_failures": self.parse_failures,
+            "stage_seconds": {k: round(v, 3) for k, v in self.stage_seconds.items()},
+            "slowest_directories": [
+                {"path": path, "seconds": round(stats[0], 3), "files": int(stats[1])}
+                for path, stats in slowest
+            ],
+            "error": self.error or None,
+        }
@@ -7,12 +7,26 @@ import json
 import uuid
 import hashlib
 import shutil
+import threading
 from datetime import datetime
-from typing import List, Dict, Optional, Any
+from itertools import islice
+from typing import List, Dict, Optional, Any, Iterable, Tuple
+from sqlalchemy import insert, or_
 from sqlalchemy.orm import Session
 
 from app.db.models import Series, SeriesPath, Scan, ScanConfig, FilterRule
-from app.services.scanner import DicomScanner
+from app.services import archives
+from app.services.anonymizer import Anonymizer, anonymize_parallel
+from app.services.scanner import DicomInfo, DicomScanner
+from app.services.scan_profile import ScanProfile
+from app.services.hierarchy_service import HierarchyService
+from app.services.series_geometry import (
+    InstanceGeometry, analyze_geometry, geometry_columns, geometry_from_columns, instance_key,
+)
+from app.services.series_staging import SeriesStaging, staging_path_for
+
+# 入库单元：(series_uid, 文件列表, 与文件一一对应的大小和几何信息)
+SeriesBatchItem = Tuple[str, List[str], List[int], List[Optional[InstanceGeometry]]]
 
 
 def generate_series_id(series_uid: str, patient_id: str = "") -> str:
@@ -23,17 +37,34 @@ def generate_series_id(series_uid: str, patient_id: str = "") -> str:
     return f"SER{hash_part}"
 
 
+def _file_size(file_path: str) -> int:
+    """文件大小；压缩包成员等无法直接获取时为0"""
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
+
 def generate_scan_id() -> str:
     """生成扫描ID"""
     return f"SCN{uuid.uuid4().hex[:12].upper()}"
 
 
+# 进程内序列入库锁：多个扫描线程并发时，"查重 -> 写入 -> 提交" 必须串行，
+# 否则不同根目录下的同一序列会被重复插入；解析阶段不受影响
+CATALOG_WRITE_LOCK = threading.RLock()
+
+
 class ScanService:
     """扫描服务"""
 
+    # 外存模式下每写入多少个序列提交一次并记录断点
+    COMMIT_BATCH_SIZE = 500
+
     def __init__(self, db: Session):
         self.db = db
         self.scanner = DicomScanner()
+        self.hierarchy = HierarchyService(db)
 
     def get_filter_rules(self, modality: str) -> Optional[Dict[str, Any]]:
         """获取指定模态的筛选规则"""
@@ -67,84 +98,330 @@ class ScanService:
 
         return True
 
-    def scan_path(self, scan_path: str, scan_id: str) -> Dict[str, Any]:
+    def scan_path(self, scan_path: str, scan_id: str,
+                  profile: Optional[ScanProfile] = None,
+                  out_of_core: bool = False) -> Dict[str, Any]:
         """扫描指定路径"""
         print(f"开始扫描路径: {scan_path}")
+        if profile is None:
+            profile = ScanProfile()
+
+        if out_of_core:
+            return self._scan_path_out_of_core(scan_path, scan_id, profile)
+
+        # 1. 遍历并按Series分组（有DICOMDIR的子树直接按索引枚举）；
+        #    遍历与解析的耗时由扫描器分别计入walk / parse阶段
+        total_files = 0
+        series_map: Dict[str, List[str]] = {}
+        series_sizes: Dict[str, List[int]] = {}
+        series_geometries: Dict[str, List[Optional[InstanceGeometry]]] = {}
+        for _, entries in self.scanner.iter_series_dirs(scan_path, profile):
+            for series_uid, file_path, file_size, geometry in entries:
+                series_map.setdefault(series_uid, []).append(file_path)
+                series_sizes.setdefault(series_uid, []).append(file_size)
+                series_geometries.setdefault(series_uid, []).append(geometry)
+                total_files += 1
+        print(f"发现 {total_files} 个DICOM文件, {len(series_map)} 个序列")
+
+        # 2. 处理每个序列
+        with profile.stage("persist"):
+            series_new, series_duplicated = self._persist_series_stream(
+                ((uid, files, series_sizes[uid], series_geometries[uid])
+                 for uid, files in series_map.items()),
+                scan_id,
+            )
 
-        # 1. 扫描目录下所有DICOM文件
-        dicom_files = self.scanner.scan_directory(scan_path, recursive=True)
-        print(f"发现 {len(dicom_files)} 个DICOM文件")
+        return {
+            "total_files": total_files,
+            "total_series": len(series_map),
+            "new_series": series_new,
+            "duplicated_series": series_duplicated,
+            "profile": profile.to_dict(),
+        }
 
-        # 2. 按Series分组
-        series_map = self.scanner.group_by_series(dicom_files)
-        print(f"发现 {len(series_map)} 个序列")
+    def _scan_path_out_of_core(self, scan_path: str, scan_id: str,
+                               profile: ScanProfile) -> Dict[str, Any]:
+        """外存分组模式：遍历结果写入磁盘暂存表，按UID顺序流式入库
 
-        # 3. 处理每个序列
-        series_new = 0
-        series_duplicated = 0
+        目录遍历进度记录在暂存表中，入库进度（最后提交的UID）与序列同事务写入Scan.checkpoint，
+        中断后可通过 resume_scan 从断点继续
+        """
+        scan = self.db.query(Scan).filter(Scan.id == scan_id).first()
+        checkpoint = scan.get_checkpoint() if scan else {}
+        if checkpoint:
+            print(f"从断点继续: {checkpoint}")
 
-        for series_uid, file_list in series_map.items():
-            # 读取第一个文件获取元信息
-            sample_info = self.scanner.read_dicom(file_list[0])
-            if not sample_info:
-                continue
+        staging = SeriesStaging(checkpoint.get("staging_path") or staging_path_for(scan_id))
+        checkpoint["staging_path"] = staging.path
+        self._save_checkpoint(scan, checkpoint)
 
-            # 检查是否存在
-            existing = self.db.query(Series).filter(
-                Series.series_instance_uid == series_uid
-            ).first()
-
-            if existing:
-                # 已存在，记录新路径
-                for fp in file_list:
-                    path_record = SeriesPath(
-                        series_id=existing.id,
-                        file_path=fp,
-                    )
-                    self.db.add(path_record)
-                series_duplicated += 1
-            else:
-                # 新建记录
-                series_id = generate_series_id(series_uid, sample_info.patient_id)
-
-                series = Series(
-                    id=series_id,
-                    patient_id=sample_info.patient_id,
-                    patient_name=sample_info.patient_name,
-                    patient_sex=sample_info.patient_sex,
-                    patient_birth_date=sample_info.patient_birth_date,
-                    study_instance_uid=sample_info.study_instance_uid,
-                    study_date=sample_info.study_date,
-                    series_instance_uid=sample_info.series_instance_uid,
-                    series_number=sample_info.series_number,
-                    series_description=sample_info.series_description,
-                    modality=sample_info.modality,
-                    protocol_name=sample_info.protocol_name,
-                    manufacturer=sample_info.manufacturer,
-                    manufacturer_model=sample_info.manufacturer_model,
-                    ct_params=json.dumps(sample_info.ct_params) if sample_info.ct_params else None,
-                    mr_params=json.dumps(sample_info.mr_params) if sample_info.mr_params else None,
-                    dx_params=json.dumps(sample_info.dx_params) if sample_info.dx_params else None,
-                    file_path=file_list[0],  # 主路径
-                    file_count=len(file_list),
-                    file_size_total=sum(os.path.getsize(f) for f in file_list if os.path.exists(f)),
-                    file_modified_date=sample_info.file_modified,
-                    scan_id=scan_id,
-                )
-                self.db.add(series)
-                series_new += 1
+        try:
+            # 1. 遍历并解析（walk / parse阶段），(UID, 路径, 大小, 几何信息) 写入暂存表（stage阶段）；
+            #    已完成目录直接跳过
+            if not checkpoint.get("walk_done"):
+                dirs = self.scanner.iter_series_dirs(scan_path, profile, skip_dir=staging.is_dir_done)
+                for dirpath, entries in dirs:
+                    with profile.stage("stage"):
+                        for series_uid, file_path, file_size, geometry in entries:
+                            staging.add(series_uid, file_path, file_size, geometry)
+                        staging.mark_dir_done(dirpath)
+                with profile.stage("stage"):
+                    staging.flush()
+                checkpoint["walk_done"] = True
+                self._save_checkpoint(scan, checkpoint)
+
+            total_files = staging.total_files()
+            total_series = staging.series_count()
+            print(f"发现 {total_files} 个DICOM文件, {total_series} 个序列")
+
+            # 2. 按UID顺序流式入库，每批提交时同时记录断点
+            series_new = checkpoint.get("series_new", 0)
+            series_duplicated = checkpoint.get("series_duplicated", 0)
+            with profile.stage("persist"):
+                series_iter = staging.iter_series(after_uid=checkpoint.get("last_series_uid"))
+                while True:
+                    batch = list(islice(series_iter, self.COMMIT_BATCH_SIZE))
+                    if not batch:
+                        break
+                    samples = self._read_samples(batch)
+                    with CATALOG_WRITE_LOCK:
+                        new, duplicated = self._persist_batch(batch, scan_id, samples)
+                        series_new += new
+                        series_duplicated += duplicated
+
+                        checkpoint["last_series_uid"] = batch[-1][0]
+                        checkpoint["series_new"] = series_new
+                        checkpoint["series_duplicated"] = series_duplicated
+                        self._save_checkpoint(scan, checkpoint)
+        except BaseException:
+            # 保留暂存文件以便续扫
+            staging.close(remove=False)
+            raise
+
+        staging.close()
+        return {
+            "total_files": total_files,
+            "total_series": total_series,
+            "new_series": series_new,
+            "duplicated_series": series_duplicated,
+            "profile": profile.to_dict(),
+        }
 
+    def _save_checkpoint(self, scan: Optional[Scan], checkpoint: Dict[str, Any]):
+        """写入断点并提交（与当前批次的序列在同一事务）"""
+        if scan is not None:
+            scan.checkpoint = json.dumps(checkpoint, ensure_ascii=False)
         self.db.commit()
 
+    def _persist_series_stream(self, items: Iterable[SeriesBatchItem], scan_id: str):
+        """将 (series_uid, 文件列表, 文件大小列表, 几何信息列表) 按批写入数据库，返回 (新增数, 重复数)"""
+        series_new = 0
+        series_duplicated = 0
+
+        items = iter(items)
+        while True:
+            batch = list(islice(items, self.COMMIT_BATCH_SIZE))
+            if not batch:
+                break
+            samples = self._read_samples(batch)
+            with CATALOG_WRITE_LOCK:
+                new, duplicated = self._persist_batch(batch, scan_id, samples)
+                self.db.commit()
+            series_new += new
+            series_duplicated += duplicated
+        return series_new, series_duplicated
+
+    def _read_samples(self, batch: List[SeriesBatchItem]) -> Dict[str, Optional[DicomInfo]]:
+        """在写锁外读取批次中新序列代表文件的元信息
+
+        NAS上的读取可能很慢，不能占用写锁阻塞其他根目录的入库；读完后结束只读事务，
+        避免之后写入时快照已过期
+        """
+        uids = [item[0] for item in batch]
+        existing = set()
+        for i in range(0, len(uids), self.COMMIT_BATCH_SIZE):
+            existing.update(uid for (uid,) in self.db.query(Series.series_instance_uid).filter(
+                Series.series_instance_uid.in_(uids[i:i + self.COMMIT_BATCH_SIZE])
+            ))
+        self.db.commit()
         return {
-            "total_files": len(dicom_files),
-            "total_series": len(series_map),
-            "new_series": series_new,
-            "duplicated_series": series_duplicated,
+            series_uid: self.scanner.read_dicom(file_list[0])
+            for series_uid, file_list, _, _ in batch if series_uid not in existing
         }
 
-    def run_scan(self, scan_config_id: int) -> Scan:
-        """执行扫描"""
+    def _persist_batch(self, batch: List[SeriesBatchItem], scan_id: str,
+                       samples: Dict[str, Optional[DicomInfo]]) -> Tuple[int, int]:
+        """写入一批序列（调用方持有写锁并负责提交），返回 (新增数, 重复数)"""
+        series_new = 0
+        series_duplicated = 0
+        for series_uid, file_list, file_sizes, geometries in batch:
+            is_new = self._persist_series(series_uid, file_list, scan_id, file_sizes, geometries,
+                                          samples.get(series_uid))
+            if is_new:
+                series_new += 1
+            elif is_new is not None:
+                series_duplicated += 1
+        return series_new, series_duplicated
+
+    def ingest_files(self, series_uid: str, file_list: List[str], scan_id: str,
+                     file_sizes: Optional[List[int]] = None,
+                     geometries: Optional[List[Optional[InstanceGeometry]]] = None) -> Optional[bool]:
+        """增量入库单个序列的新文件（监听模式），已记录的路径跳过
+
+        file_sizes / geometries 与 file_list 一一对应；返回True新增序列 / False追加到已有序列 / None无法解析
+        """
+        samples = self._read_samples([(series_uid, file_list, file_sizes, geometries)])
+        with CATALOG_WRITE_LOCK:
+            is_new = self._persist_series(series_uid, file_list, scan_id, file_sizes, geometries,
+                                          samples.get(series_uid))
+            self.db.commit()
+        return is_new
+
+    def _persist_series(self, series_uid: str, file_list: List[str], scan_id: str,
+                        file_sizes: Optional[List[int]] = None,
+                        geometries: Optional[List[Optional[InstanceGeometry]]] = None,
+                        sample_info: Optional[DicomInfo] = None) -> Optional[bool]:
+        """写入单个序列，返回True新增 / False追加到已有序列 / None跳过
+
+        sample_info 为锁外预先读取的代表文件元信息，未提供时在此读取
+        """
+        file_sizes = file_sizes or [_file_size(fp) for fp in file_list]
+        geometries = geometries or [None] * len(file_list)
+
+        # 检查是否存在
+        existing = self.db.query(Series).filter(
+            Series.series_instance_uid == series_uid
+        ).first()
+
+        if existing:
+            self._append_instances(existing, file_list, file_sizes, geometries)
+            return False
+
+        # 读取第一个文件获取元信息
+        sample_info = sample_info or self.scanner.read_dicom(file_list[0])
+        if not sample_info:
+            return None
+
+        # 新建记录；同一次扫描中的副本（如同一根目录下的备份）与之后追加时一样只记录路径
+        series_id = generate_series_id(series_uid, sample_info.patient_id)
+        recorded, file_count, file_size_total = self._split_copies(file_sizes, geometries, set())
+
+        series = Series(
+            id=series_id,
+            patient_id=sample_info.patient_id,
+            patient_name=sample_info.patient_name,
+            patient_sex=sample_info.patient_sex,
+            patient_birth_date=sample_info.patient_birth_date,
+            study_instance_uid=sample_info.study_instance_uid,
+            study_date=sample_info.study_date,
+            series_instance_uid=sample_info.series_instance_uid,
+            series_number=sample_info.series_number,
+            series_description=sample_info.series_description,
+            modality=sample_info.modality,
+            protocol_name=sample_info.protocol_name,
+            manufacturer=sample_info.manufacturer,
+            manufacturer_model=sample_info.manufacturer_model,
+            ct_params=json.dumps(sample_info.ct_params) if sample_info.ct_params else None,
+            mr_params=json.dumps(sample_info.mr_params) if sample_info.mr_params else None,
+            dx_params=json.dumps(sample_info.dx_params) if sample_info.dx_params else None,
+            file_path=file_list[0],  # 主路径
+            file_count=file_count,
+            file_size_total=file_size_total,
+            file_modified_date=sample_info.file_modified,
+            scan_id=scan_id,
+            **analyze_geometry(recorded),
+            **geometry_columns(recorded[0]),
+        )
+        self.db.add(series)
+        self.hierarchy.add_series(series)
+        # 主路径之外的实例逐个记录，导出时才能拿到完整序列
+        self._add_paths(series_id, file_list[1:], recorded[1:])
+        return True
+
+    def _append_instances(self, series: Series, file_list: List[str], file_sizes: List[int],
+                          geometries: List[Optional[InstanceGeometry]]):
+        """向已有序列追加实例：已记录的路径跳过，更新文件数、大小、汇总表和几何统计
+
+        与已有实例编号、位置都相同的文件视为副本（如另一根目录下的同一序列），只记录路径
+        """
+        rows = self.db.query(
+            SeriesPath.file_path, SeriesPath.instance_number, SeriesPath.position_x,
+            SeriesPath.position_y, SeriesPath.position_z, SeriesPath.orientation,
+        ).filter(SeriesPath.series_id == series.id).all()
+        known = {series.file_path}
+        known.update(row[0] for row in rows)
+
+        orientations: Dict[str, Any] = {}
+        stored = [geometry_from_columns(series.instance_number, series.position_x, series.position_y,
+                                        series.position_z, series.orientation, orientations)]
+        stored += [geometry_from_columns(*row[1:], orientations) for row in rows]
+        instance_keys = {instance_key(g) for g in stored} - {None}
+
+        new_paths, new_sizes, new_geometries = [], [], []
+        for file_path, file_size, geometry in zip(file_list, file_sizes, geometries):
+            if file_path in known:
+                continue
+            known.add(file_path)
+            new_paths.append(file_path)
+            new_sizes.append(file_size)
+            new_geometries.append(geometry)
+        new_geometries, added_files, added_size = self._split_copies(new_sizes, new_geometries, instance_keys)
+
+        self._add_paths(series.id, new_paths, new_geometries)
+        if not added_files:
+            return
+
+        series.file_count = (series.file_count or 0) + added_files
+        series.file_size_total = (series.file_size_total or 0) + added_size
+        self.hierarchy.add_files(series, added_files, added_size)
+
+        # 升级前入库的序列没有逐实例的几何信息，无法按全部实例重算
+        legacy = all(g is None for g in stored) and (
+            series.slice_count is not None or series.missing_instance_numbers is not None
+        )
+        if not legacy:
+            for name, value in analyze_geometry(stored + new_geometries).items():
+                setattr(series, name, value)
+
+    @staticmethod
+    def _split_copies(file_sizes: List[int], geometries: List[Optional[InstanceGeometry]],
+                      instance_keys: set) -> Tuple[List[Optional[InstanceGeometry]], int, int]:
+        """区分副本：实例编号与位置都与已有实例（instance_keys，原地更新）相同的文件
+
+        返回 (逐文件记录的几何信息，副本为None, 非副本文件数, 非副本总大小)
+        """
+        recorded = []
+        file_count, file_size_total = 0, 0
+        for file_size, geometry in zip(file_sizes, geometries):
+            key = instance_key(geometry)
+            if key is not None and key in instance_keys:
+                recorded.append(None)
+                continue
+            if key is not None:
+                instance_keys.add(key)
+            recorded.append(geometry)
+            file_count += 1
+            file_size_total += file_size or 0
+        return recorded, file_count, file_size_total
+
+    def _add_paths(self, series_id: str, file_list: List[str],
+                   geometries: Optional[List[Optional[InstanceGeometry]]] = None):
+        """批量写入序列路径及实例几何信息"""
+        if file_list:
+            geometries = geometries or [None] * len(file_list)
+            self.db.execute(
+                insert(SeriesPath),
+                [{"series_id": series_id, "file_path": fp, **geometry_columns(geometry)}
+                 for fp, geometry in zip(file_list, geometries)],
+            )
+
+    def run_scan(self, scan_config_id: int, out_of_core: bool = False) -> Scan:
+        """执行扫描（out_of_core=True 时使用磁盘暂存分组，内存占用有界且可断点续扫）"""
+        scan = self.create_scan(scan_config_id)
+        return self._execute_scan(scan, self._scan_config(scan), out_of_core)
+
+    def create_scan(self, scan_config_id: int) -> Scan:
+        """创建扫描记录（running），由 run_scan 或 execute_scan 执行"""
         config = self.db.query(ScanConfig).filter(ScanConfig.id == scan_config_id).first()
         if not config:
             raise ValueError(f"扫描配置不存在: {scan_config_id}")
@@ -152,6 +429,7 @@ class ScanService:
         scan_id = generate_scan_id()
         scan = Scan(
             id=scan_id,
+            config_id=config.id,
             scan_path=config.scan_path,
             scan_type=config.schedule_type,
             started_at=datetime.now().isoformat(),
@@ -159,27 +437,96 @@ class ScanService:
         )
         self.db.add(scan)
         self.db.commit()
+        return scan
+
+    def execute_scan(self, scan_id: str, out_of_core: bool = False) -> Scan:
+        """执行已创建的扫描（排队等待后开始时更新开始时间）"""
+        scan = self.db.query(Scan).filter(Scan.id == scan_id).first()
+        if not scan:
+            raise ValueError(f"扫描记录不存在: {scan_id}")
+        scan.started_at = datetime.now().isoformat()
+        self.db.commit()
+        return self._execute_scan(scan, self._scan_config(scan), out_of_core)
+
+    def _scan_config(self, scan: Scan) -> Optional[ScanConfig]:
+        if scan.config_id is None:
+            return None
+        return self.db.query(ScanConfig).filter(ScanConfig.id == scan.config_id).first()
+
+    def resume_scan(self, scan_id: str) -> Scan:
+        """从断点继续被中断的扫描"""
+        scan = self.db.query(Scan).filter(Scan.id == scan_id).first()
+        if not scan:
+            raise ValueError(f"扫描记录不存在: {scan_id}")
+        if scan.status not in ("interrupted", "failed"):
+            raise ValueError(f"扫描状态为 {scan.status}，无法续扫")
+        if scan.scan_type == "watch":
+            raise ValueError("监听记录无法续扫，请重新启动监听")
+
+        if scan.scan_type == "distributed":
+            # 分布式扫描的进度在工作单元表中：失败单元重新排队，由工作进程继续并收尾
+            from app.services.distributed_scan import DistributedScanService
+            DistributedScanService(self.db).retry_failed_units(scan.id)
+            scan.status = "running"
+            scan.finished_at = None
+            self.db.commit()
+            return scan
+
+        scan.status = "running"
+        scan.finished_at = None
+        self.db.commit()
+
+        # 续扫统一走外存模式：内存模式（out_of_core=False）不记录遍历进度，只能从头扫描
+        if not scan.checkpoint:
+            print(f"扫描 {scan.id} 没有断点，从头扫描")
+        return self._execute_scan(scan, self._scan_config(scan), out_of_core=True)
 
+    def _execute_scan(self, scan: Scan, config: Optional[ScanConfig], out_of_core: bool) -> Scan:
+        """执行扫描并写回结果"""
+        profile = ScanProfile()
         try:
-            result = self.scan_path(config.scan_path, scan_id)
+            result = self.scan_path(scan.scan_path, scan.id, profile=profile,
+                                    out_of_core=out_of_core)
 
             scan.series_found = result["total_series"]
             scan.series_new = result["new_series"]
             scan.series_duplicated = result["duplicated_series"]
             scan.finished_at = datetime.now().isoformat()
             scan.status = "completed"
+            scan.checkpoint = None
 
             # 更新配置的最后扫描时间
-            config.last_scan_at = datetime.now().isoformat()
+            if config is not None:
+                config.last_scan_at = datetime.now().isoformat()
 
         except Exception as e:
+            self.db.rollback()
             scan.status = "failed"
             scan.finished_at = datetime.now().isoformat()
+            profile.error = f"{type(e).__name__}: {e}"
             print(f"扫描失败: {e}")
 
+        scan.profile = json.dumps(profile.to_dict(), ensure_ascii=False)
         self.db.commit()
         return scan
 
+    @staticmethod
+    def mark_orphaned_scans(db: Session) -> int:
+        """将进程退出时遗留的running扫描标记为interrupted，返回数量"""
+        # 分布式扫描由独立的工作进程执行，不受本进程重启影响；升级前的记录没有scan_type
+        orphaned = db.query(Scan).filter(
+            Scan.status == "running",
+            or_(Scan.scan_type.is_(None), Scan.scan_type != "distributed"),
+        )
+        # 监听记录随进程结束而结束，与正常停止一样记为completed（启动时恢复的监听会新建记录）
+        orphaned.filter(Scan.scan_type == "watch").update(
+            {Scan.status: "completed", Scan.finished_at: datetime.now().isoformat()},
+            synchronize_session=False,
+        )
+        count = orphaned.update({Scan.status: "interrupted"}, synchronize_session=False)
+        db.commit()
+        return count
+
 
 class ExportService:
     """导出服务"""
@@ -187,9 +534,19 @@ class ExportService:
     def __init__(self, db: Session):
         self.db = db
 
-    def export_series(self, series_ids: List[str], target_dir: str) -> Dict[str, Any]:
-        """导出序列到指定目录"""
+    def _series_paths(self, series: Series) -> List[str]:
+        paths = self.db.query(SeriesPath).filter(
+            SeriesPath.series_id == series.id
+        ).all()
+        return [series.file_path] + [p.file_path for p in paths]
+
+    def export_series(self, series_ids: List[str], target_dir: str,
+                      anonymizer: Optional[Anonymizer] = None,
+                      workers: Optional[int] = None) -> Dict[str, Any]:
+        """导出序列到指定目录（传入anonymizer时匿名化导出）"""
         os.makedirs(target_dir, exist_ok=True)
+        if anonymizer is not None:
+            return self._export_anonymized(series_ids, target_dir, anonymizer, workers)
 
         exported_count = 0
         failed_ids = []
@@ -201,19 +558,16 @@ class ExportService:
                 continue
 
             # 获取所有路径
-            paths = self.db.query(SeriesPath).filter(
-                SeriesPath.series_id == series_id
-            ).all()
-
-            all_paths = [series.file_path] + [p.file_path for p in paths]
+            all_paths = self._series_paths(series)
 
             # 创建目标文件夹
             target_folder = os.path.join(target_dir, series_id)
             os.makedirs(target_folder, exist_ok=True)
 
-            # 拷贝文件（保持原文件名）
+            # 拷贝文件（保持原文件名）；压缩包内的成员按归档分组，每个归档只读一遍
+            plain_paths, archive_members = archives.group_by_archive(all_paths)
             success_files = 0
-            for src_path in all_paths:
+            for src_path in plain_paths:
                 if os.path.exists(src_path):
                     filename = os.path.basename(src_path)
                     dst_path = os.path.join(target_folder, filename)
@@ -222,6 +576,16 @@ class ExportService:
                         success_files += 1
                     except Exception as e:
                         print(f"拷贝失败 {src_path}: {e}")
+            for archive_path, members in archive_members.items():
+                if not os.path.exists(archive_path):
+                    continue
+                try:
+                    extracted, missing = archives.extract_members(archive_path, members, target_folder)
+                    success_files += extracted
+                    for member in missing:
+                        print(f"压缩包中不存在 {member}")
+                except Exception as e:
+                    print(f"解压失败 {archive_path}: {e}")
 
             # 导出元信息
             meta = {
@@ -241,10 +605,7 @@ class ExportService:
                 "file_count": series.file_count,
                 "original_paths": all_paths,
             }
-
-            meta_path = os.path.join(target_folder, "meta.json")
-            with open(meta_path, 'w', encoding='utf-8') as f:
-                json.dump(meta, f, ensure_ascii=False, indent=2)
+            self._write_meta(target_folder, meta)
 
             if success_files > 0:
                 exported_count += 1
@@ -255,4 +616,82 @@ class ExportService:
             "failed_count": len(failed_ids),
             "failed_ids": failed_ids,
             "target_dir": target_dir,
+            "message": f"导出 {exported_count} 个序列" + (f"，{len(failed_ids)} 个不存在" if failed_ids else ""),
         }
+
+    def _export_anonymized(self, series_ids: List[str], target_dir: str,
+                           anonymizer: Anonymizer, workers: Optional[int]) -> Dict[str, Any]:
+        """匿名化导出：目录名、文件名和meta.json都不含原始标识，文件由多个进程并行改写"""
+        failed_ids = []
+        folders: List[str] = []
+        files: List[Tuple[str, str]] = []
+        archive_tasks: Dict[str, Dict[str, str]] = {}
+
+        for series_id in series_ids:
+            series = self.db.query(Series).filter(Series.id == series_id).first()
+            if not series:
+                failed_ids.append(series_id)
+                continue
+
+            # 目录按假名UID命名，同一队列密钥下与其他批次一致
+            series_uid = anonymizer.uid(series.series_instance_uid)
+            target_folder = os.path.join(target_dir, generate_series_id(series_uid))
+            os.makedirs(target_folder, exist_ok=True)
+            folders.append(target_folder)
+
+            plain_paths, archive_members = archives.group_by_archive(self._series_paths(series))
+            files.extend((path, target_folder) for path in plain_paths if os.path.exists(path))
+            for archive_path, members in archive_members.items():
+                if os.path.exists(archive_path):
+                    archive_tasks.setdefault(archive_path, {}).update(
+                        (member, target_folder) for member in members
+                    )
+
+            # 数据库字段按同样的规则转换；不导出姓名和原始路径
+            meta = {
+                "id": generate_series_id(series_uid),
+                "patient_id": anonymizer.value("PatientID", series.patient_id),
+                "patient_sex": anonymizer.value("PatientSex", series.patient_sex),
+                "study_instance_uid": anonymizer.uid(series.study_instance_uid),
+                "series_instance_uid": series_uid,
+                "study_date": anonymizer.value("StudyDate", series.study_date),
+                "modality": series.modality,
+                "protocol_name": anonymizer.value("ProtocolName", series.protocol_name),
+                "series_description": anonymizer.value("SeriesDescription", series.series_description),
+                "manufacturer": anonymizer.value("Manufacturer", series.manufacturer),
+                "manufacturer_model": anonymizer.value("ManufacturerModelName", series.manufacturer_model),
+                "ct_params": json.loads(series.ct_params) if series.ct_params else None,
+                "mr_params": json.loads(series.mr_params) if series.mr_params else None,
+                "dx_params": json.loads(series.dx_params) if series.dx_params else None,
+                "file_count": series.file_count,
+                "anonymization_key_id": anonymizer.key_id,
+            }
+            self._write_meta(target_folder, meta)
+
+        done, failed_files = anonymize_parallel(anonymizer, files, archive_tasks.items(), workers)
+        for failure in failed_files:
+            print(f"匿名化失败 {failure}")
+        exported_count = sum(1 for folder in folders if done.get(folder))
+
+        message = f"匿名化导出 {exported_count} 个序列"
+        if failed_ids:
+            message += f"，{len(failed_ids)} 个不存在"
+        if failed_files:
+            message += f"，{len(failed_files)} 个文件失败"
+        if not anonymizer.persistent_key:
+            message += "（未配置队列密钥，假名只在本次导出内一致）"
+        return {
+            "success": not failed_ids and not failed_files,
+            "exported_count": exported_count,
+            "failed_count": len(failed_ids),
+            "failed_ids": failed_ids,
+            "failed_files": len(failed_files),
+            "target_dir": target_dir,
+            "message": message,
+        }
+
+    @staticmethod
+    def _write_meta(target_folder: str, meta: Dict[str, Any]):
+        meta_path = os.path.join(target_folder, "meta.json")
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
@@ -1,15 +1,30 @@
+import io
 import pydicom
 from pydicom import dcmread
 from pydicom.errors import InvalidDicomError
+from pydicom.filereader import read_partial
+from pydicom.tag import Tag
 import hashlib
 import os
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Iterable, Iterator, Tuple, Callable
 from dataclasses import dataclass
 import logging
+import time
 from datetime import datetime
 
+from app.services import archives
+from app.services.scan_profile import ScanProfile
+from app.services.series_geometry import InstanceGeometry, geometry_from_dataset
+
 logger = logging.getLogger(__name__)
 
+# 扫描产出的单文件条目：(series_uid, 路径, 文件大小, 几何信息)
+SeriesEntry = Tuple[str, str, int, Optional[InstanceGeometry]]
+
+
+class MissingSeriesUIDError(ValueError):
+    """文件可以解析但没有SeriesInstanceUID，无法归入序列"""
+
 
 @dataclass
 class DicomInfo:
@@ -46,6 +61,54 @@ class DicomInfo:
     file_modified: Optional[str] = None
 
 
+class DicomRecord:
+    """扫描热路径上的单文件记录
+
+    只保留分组所需字段，使用__slots__避免每个实例的__dict__；
+    UID/患者ID经StringInterner驻留，同一序列/检查的实例共享同一字符串对象。
+    完整的DicomInfo只为每个序列的代表文件读取。
+    """
+    __slots__ = ("file_path", "series_instance_uid", "study_instance_uid", "patient_id", "file_size",
+                 "geometry")
+
+    def __init__(self, file_path: str, series_instance_uid: str, study_instance_uid: str,
+                 patient_id: str, file_size: int, geometry: Optional[InstanceGeometry] = None):
+        self.file_path = file_path
+        self.series_instance_uid = series_instance_uid
+        self.study_instance_uid = study_instance_uid
+        self.patient_id = patient_id
+        self.file_size = file_size
+        self.geometry = geometry
+
+
+# 流式扫描时驻留表的上限：文件按目录顺序到达，只需覆盖最近目录中的UID/方向
+INTERNER_MAX_SIZE = 4096
+
+
+class StringInterner:
+    """扫描期间的字符串驻留表，随扫描结束释放
+
+    max_size 限制条目数，超过时清空重建，避免流式扫描中驻留表随序列数增长
+    """
+    __slots__ = ("_table", "max_size")
+
+    def __init__(self, max_size: Optional[int] = None):
+        self._table: Dict[str, str] = {}
+        self.max_size = max_size
+
+    def __call__(self, value: str) -> str:
+        interned = self._table.get(value)
+        if interned is not None:
+            return interned
+        if self.max_size and len(self._table) >= self.max_size:
+            self._table.clear()
+        self._table[value] = value
+        return value
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+
 class DicomScanner:
     """DICOM扫描器"""
 
@@ -88,14 +151,23 @@ class DicomScanner:
             return False
 
     @staticmethod
-    def read_dicom(file_path: str) -> Optional[DicomInfo]:
-        """读取DICOM文件信息"""
+    def read_dicom(file_path: str, profile: Optional[ScanProfile] = None) -> Optional[DicomInfo]:
+        """读取DICOM文件信息，失败时计入profile"""
         try:
-            ds = pydicom.dcmread(file_path, stop_before_pixels=True, force=True)
+            member = archives.split_member_path(file_path)
+            if member:
+                # 压缩包成员整体读入内存再解析，避免在压缩流上回退
+                with archives.open_member(file_path) as stream:
+                    data = stream.read()
+                ds = pydicom.dcmread(io.BytesIO(data), stop_before_pixels=True, force=True)
+                file_stat = os.stat(member[0])
+                file_size = len(data)
+            else:
+                ds = pydicom.dcmread(file_path, stop_before_pixels=True, force=True)
+                file_stat = os.stat(file_path)
+                file_size = file_stat.st_size
 
             # 获取文件信息
-            file_stat = os.stat(file_path)
-            file_size = file_stat.st_size
             file_mtime = datetime.fromtimestamp(file_stat.st_mtime).isoformat()
 
             info = DicomInfo(
@@ -140,43 +212,412 @@ class DicomScanner:
                     'kvp': getattr(ds, 'KVP', None),
                 }
 
+            if profile:
+                profile.files_parsed += 1
+                profile.bytes_read += file_size
             return info
 
-        except InvalidDicomError:
+        except InvalidDicomError as e:
+            if profile:
+                profile.record_failure(file_path, e)
             return None
         except Exception as e:
             logger.warning(f"读取DICOM失败 {file_path}: {e}")
+            if profile:
+                profile.record_failure(file_path, e)
             return None
 
     @staticmethod
-    def scan_directory(root_path: str, recursive: bool = True) -> List[str]:
-        """扫描目录下所有DICOM文件"""
-        dicom_files = []
+    def iter_dicom_dirs(root_path: str, profile: Optional[ScanProfile] = None,
+                        skip_dir: Optional[Callable[[str], bool]] = None) -> Iterator[Tuple[str, List[str]]]:
+        """按固定顺序递归遍历，逐目录产出 (目录, DICOM文件列表)
 
-        if recursive:
-            for dirpath, dirnames, filenames in os.walk(root_path):
+        skip_dir 返回True的目录不再检查其文件（子目录照常遍历），用于断点续扫
+        """
+        for dirpath, dirnames, filenames in os.walk(root_path):
+            # 排序保证每次遍历顺序一致
+            dirnames.sort()
+            if skip_dir and skip_dir(dirpath):
+                continue
+
+            yield dirpath, DicomScanner.list_dicom_files(dirpath, filenames, profile)
+
+    @staticmethod
+    def list_dicom_files(dirpath: str, filenames: List[str],
+                          profile: Optional[ScanProfile] = None) -> List[str]:
+        """筛出目录中的DICOM文件（只读文件头）"""
+        dir_start = time.perf_counter()
+        dir_files = []
+        for filename in sorted(filenames):
+            file_path = os.path.join(dirpath, filename)
+            if archives.SCAN_ARCHIVES and archives.is_archive(filename):
+                continue  # 由 iter_archive_entries 处理
+            if filename.upper() == "DICOMDIR":
+                # 媒体索引（失效时逐个解析其余文件），本身不属于任何序列
+                if profile:
+                    profile.non_dicom_skipped += 1
+                continue
+            if DicomScanner.is_dicom_file(file_path):
+                dir_files.append(file_path)
+            elif profile:
+                profile.non_dicom_skipped += 1
+        if profile:
+            elapsed = time.perf_counter() - dir_start
+            profile.files_walked += len(filenames)
+            profile.add_stage_time("walk", elapsed)
+            profile.record_directory(dirpath, elapsed, len(filenames))
+        return dir_files
+
+    @staticmethod
+    def iter_series_dirs(root_path: str, profile: Optional[ScanProfile] = None,
+                         skip_dir: Optional[Callable[[str], bool]] = None
+                         ) -> Iterator[Tuple[str, List[SeriesEntry]]]:
+        """按固定顺序递归遍历，逐目录产出 (目录, [SeriesEntry])
+
+        目录中有有效的DICOMDIR时按其索引枚举整个子树，不再逐个打开文件；
+        DICOMDIR失效时照常遍历。skip_dir 同 iter_dicom_dirs
+        """
+        walker = os.walk(root_path)
+        while True:
+            # 列目录计入walk阶段；文件头检查见 list_dicom_files，逐文件解析见 iter_series_entries
+            walk_start = time.perf_counter()
+            item = next(walker, None)
+            if profile:
+                profile.add_stage_time("walk", time.perf_counter() - walk_start)
+            if item is None:
+                return
+            dirpath, dirnames, filenames = item
+            dirnames.sort()
+            if skip_dir and skip_dir(dirpath):
+                continue
+
+            dicomdir = DicomScanner.find_dicomdir(dirpath, filenames)
+            if dicomdir:
+                # 按索引枚举（含代表文件核对）整体计入walk阶段
+                walk_start = time.perf_counter()
+                media = DicomScanner.read_dicomdir(dicomdir, profile)
+                if profile:
+                    profile.add_stage_time("walk", time.perf_counter() - walk_start)
+                if media is not None:
+                    dirnames[:] = []  # 子树已由DICOMDIR覆盖
+                    yield from media
+                    continue
+
+            yield dirpath, list(DicomScanner.iter_dir_entries(dirpath, filenames, profile))
+
+    @staticmethod
+    def iter_dir_entries(dirpath: str, filenames: List[str],
+                         profile: Optional[ScanProfile] = None) -> Iterator[SeriesEntry]:
+        """解析单个目录（不含子目录）下的DICOM文件和压缩包成员，产出 SeriesEntry"""
+        dir_files = DicomScanner.list_dicom_files(dirpath, filenames, profile)
+        yield from DicomScanner.iter_series_entries(dir_files, profile)
+        for archive_path in archives.list_archives(dirpath, filenames):
+            yield from DicomScanner.iter_archive_entries(archive_path, profile)
+
+    @staticmethod
+    def find_dicomdir(dirpath: str, filenames: Iterable[str]) -> Optional[str]:
+        """目录中的DICOMDIR文件路径（光盘上大小写不一）"""
+        for filename in filenames:
+            if filename.upper() == "DICOMDIR":
+                return os.path.join(dirpath, filename)
+        return None
+
+    @staticmethod
+    def _dicomdir_references(ds) -> List[Tuple[str, List[str], Optional[InstanceGeometry]]]:
+        """按目录记录的偏移链接遍历DICOMDIR，返回 [(series_uid, 引用文件路径分量, 几何信息)]
+
+        IMAGE记录中的InstanceNumber（必有）和位置/方向（可选）直接作为实例几何信息
+        """
+        records = {record.seq_item_tell: record for record in ds.DirectoryRecordSequence}
+        references = []
+        visited = set()
+
+        def walk(offset: int, series_uid: str):
+            while offset and offset not in visited:
+                visited.add(offset)
+                record = records[offset]
+                if record.DirectoryRecordType == "SERIES":
+                    series_uid = str(record.get("SeriesInstanceUID", ""))
+                if "ReferencedFileID" in record:
+                    file_id = record.ReferencedFileID
+                    file_id = [file_id] if isinstance(file_id, str) else list(file_id)
+                    references.append((series_uid, file_id, geometry_from_dataset(record)))
+                lower = record.get("OffsetOfReferencedLowerLevelDirectoryEntity", 0)
+                if lower:
+                    walk(lower, series_uid)
+                offset = record.get("OffsetOfTheNextDirectoryRecord", 0)
+
+        walk(ds.OffsetOfTheFirstDirectoryRecordOfTheRootDirectoryEntity, "")
+        return references
+
+    @staticmethod
+    def read_dicomdir(dicomdir_path: str, profile: Optional[ScanProfile] = None
+                      ) -> Optional[List[Tuple[str, List[SeriesEntry]]]]:
+        """按DICOMDIR枚举其所在目录子树，返回 [(目录, [SeriesEntry])]
+
+        DICOMDIR引用的文件不打开，每个序列只解析一个代表文件核对UID；
+        未被引用的DICOM文件（后来加入的）逐个解析。
+        索引无法读取、引用的文件不存在或UID不符时返回None，由调用方照常遍历
+        """
+        media_root = os.path.dirname(dicomdir_path)
+        # 校验期间单独统计，回退时不重复计数
+        local = ScanProfile()
+        start = time.perf_counter()
+        try:
+            references = DicomScanner._dicomdir_references(dcmread(dicomdir_path))
+
+            # 子树中实际存在的文件；按小写匹配，兼容光盘挂载时的文件名大小写映射
+            dir_order: List[str] = []
+            on_disk: Dict[str, str] = {}
+            for dirpath, dirnames, filenames in os.walk(media_root):
+                dirnames.sort()
+                dir_order.append(dirpath)
+                local.files_walked += len(filenames)
                 for filename in filenames:
                     file_path = os.path.join(dirpath, filename)
-                    if DicomScanner.is_dicom_file(file_path):
-                        dicom_files.append(file_path)
+                    on_disk[os.path.normpath(file_path).lower()] = file_path
+
+            referenced: Dict[str, Tuple[str, Optional[InstanceGeometry]]] = {}
+            representatives: Dict[str, str] = {}
+            for series_uid, file_id, geometry in references:
+                file_path = on_disk.get(os.path.normpath(os.path.join(media_root, *file_id)).lower())
+                if not series_uid or file_path is None:
+                    logger.info(f"DICOMDIR已过期，改为逐个解析: {dicomdir_path}")
+                    return None
+                referenced[file_path] = (series_uid, geometry)
+                representatives.setdefault(series_uid, file_path)
+
+            interner = StringInterner()
+            for series_uid, file_path in representatives.items():
+                record = DicomScanner.read_record(file_path, local, interner)
+                if record is None or record.series_instance_uid != series_uid:
+                    logger.info(f"DICOMDIR与文件不一致，改为逐个解析: {dicomdir_path}")
+                    return None
+                # 代表文件已解析，以文件中的几何信息为准
+                referenced[file_path] = (series_uid, record.geometry or referenced[file_path][1])
+
+            entries: Dict[str, List[SeriesEntry]] = {dirpath: [] for dirpath in dir_order}
+            unreferenced = []
+            for file_path in sorted(on_disk.values()):
+                if file_path == dicomdir_path:
+                    continue
+                if file_path not in referenced:
+                    unreferenced.append(file_path)
+                    continue
+                series_uid, geometry = referenced[file_path]
+                entries[os.path.dirname(file_path)].append(
+                    (interner(series_uid), file_path, os.path.getsize(file_path), geometry)
+                )
+                local.files_indexed += 1
+
+            extra = []
+            for file_path in unreferenced:
+                if DicomScanner.is_dicom_file(file_path):
+                    extra.append(file_path)
+                else:
+                    local.non_dicom_skipped += 1
+            for entry in DicomScanner.iter_series_entries(extra, local):
+                entries[os.path.dirname(entry[1])].append(entry)
+
+        except Exception as e:
+            logger.warning(f"读取DICOMDIR失败 {dicomdir_path}: {e}")
+            return None
+
+        if profile:
+            profile.merge(local)
+            profile.record_directory(media_root, time.perf_counter() - start, local.files_walked)
+        return [(dirpath, sorted(dir_entries, key=lambda entry: entry[1]))
+                for dirpath, dir_entries in entries.items()]
+
+    @staticmethod
+    def iter_dicom_files(root_path: str, recursive: bool = True,
+                         profile: Optional[ScanProfile] = None) -> Iterator[str]:
+        """逐目录产出DICOM文件路径（流式，不保留全量列表）"""
+        if recursive:
+            for _, dir_files in DicomScanner.iter_dicom_dirs(root_path, profile):
+                yield from dir_files
         else:
             for filename in os.listdir(root_path):
                 file_path = os.path.join(root_path, filename)
-                if os.path.isfile(file_path) and DicomScanner.is_dicom_file(file_path):
-                    dicom_files.append(file_path)
+                if not os.path.isfile(file_path):
+                    continue
+                if profile:
+                    profile.files_walked += 1
+                if DicomScanner.is_dicom_file(file_path):
+                    yield file_path
+                elif profile:
+                    profile.non_dicom_skipped += 1
+
+    # 热路径只解析分组所需的Tag
+    RECORD_TAGS = ["PatientID", "StudyInstanceUID", "SeriesInstanceUID",
+                   "InstanceNumber", "ImagePositionPatient", "ImageOrientationPatient"]
+
+    @staticmethod
+    def read_record(file_path: str, profile: Optional[ScanProfile] = None,
+                    interner: Optional[StringInterner] = None) -> Optional[DicomRecord]:
+        """读取分组所需的最少信息，失败时计入profile"""
+        try:
+            ds = pydicom.dcmread(file_path, stop_before_pixels=True, force=True,
+                                 specific_tags=DicomScanner.RECORD_TAGS)
+            file_size = os.stat(file_path).st_size
+            record = DicomScanner._record_from_dataset(ds, file_path, file_size, interner)
+            if not record.series_instance_uid:
+                raise MissingSeriesUIDError("缺少SeriesInstanceUID")
+
+            if profile:
+                profile.files_parsed += 1
+                profile.bytes_read += file_size
+            return record
+
+        except Exception as e:
+            if not isinstance(e, InvalidDicomError):
+                logger.warning(f"读取DICOM失败 {file_path}: {e}")
+            if profile:
+                profile.record_failure(file_path, e)
+            return None
+
+    @staticmethod
+    def _record_from_dataset(ds, file_path: str, file_size: int,
+                             interner: Optional[StringInterner] = None) -> DicomRecord:
+        intern = interner if interner is not None else StringInterner()
+        return DicomRecord(
+            file_path=file_path,
+            series_instance_uid=intern(str(ds.get("SeriesInstanceUID", ""))),
+            study_instance_uid=intern(str(ds.get("StudyInstanceUID", ""))),
+            patient_id=intern(str(ds.get("PatientID", ""))),
+            file_size=file_size,
+            geometry=geometry_from_dataset(ds, intern),
+        )
+
+    # 热路径所需Tag中编号最大的，流式读取成员头时读过它即可停止
+    _RECORD_TAG_LIST = list(map(Tag, RECORD_TAGS))
+    _LAST_RECORD_TAG = max(_RECORD_TAG_LIST)
+    # 成员头的首次读取字节数，不够时加倍
+    HEADER_READ_SIZE = 16 * 1024
+
+    @staticmethod
+    def read_record_stream(stream, file_path: str, file_size: int,
+                           profile: Optional[ScanProfile] = None,
+                           interner: Optional[StringInterner] = None) -> Optional[DicomRecord]:
+        """从只能顺序读取的流（压缩包成员）解析分组信息，只读到 RECORD_TAGS 中最后一个为止"""
+        data = stream.read(min(file_size, DicomScanner.HEADER_READ_SIZE))
+        if len(data) < 132 or data[128:132] != b"DICM":
+            if profile:
+                profile.non_dicom_skipped += 1
+            return None
+
+        try:
+            while True:
+                passed = []
+
+                def stop_when(tag, vr, length):
+                    if tag > DicomScanner._LAST_RECORD_TAG:
+                        passed.append(tag)
+                        return True
+                    return False
+
+                ds = read_partial(io.BytesIO(data), stop_when=stop_when,
+                                  specific_tags=DicomScanner._RECORD_TAG_LIST)
+                # 缓冲区截断时末尾元素可能不完整，必须读到后面的Tag才可信
+                if passed or len(data) >= file_size:
+                    break
+                more = stream.read(len(data))
+                if not more:
+                    break
+                data += more
+
+            record = DicomScanner._record_from_dataset(ds, file_path, file_size, interner)
+            if not record.series_instance_uid:
+                raise MissingSeriesUIDError("缺少SeriesInstanceUID")
+            if profile:
+                profile.files_parsed += 1
+                profile.bytes_read += len(data)
+            return record
+
+        except Exception as e:
+            logger.warning(f"读取DICOM失败 {file_path}: {e}")
+            if profile:
+                profile.record_failure(file_path, e)
+            return None
+
+    @staticmethod
+    def iter_archive_entries(archive_path: str,
+                             profile: Optional[ScanProfile] = None) -> Iterator[SeriesEntry]:
+        """顺序读取压缩包，逐个成员只读文件头，产出 (series_uid, 成员路径, 解压后大小, 几何信息)"""
+        interner = StringInterner(INTERNER_MAX_SIZE)
+        start = time.perf_counter()
+        count = 0
+        try:
+            members = archives.iter_members(archive_path)
+            while True:
+                # 解压与解析成员头计入parse阶段（不含调用方处理产出条目的时间）
+                parse_start = time.perf_counter()
+                member = next(members, None)
+                record = None
+                if member is not None:
+                    name, size, stream = member
+                    count += 1
+                    file_path = archives.member_path(archive_path, name)
+                    record = DicomScanner.read_record_stream(stream, file_path, size, profile, interner)
+                if profile:
+                    profile.add_stage_time("parse", time.perf_counter() - parse_start)
+                if member is None:
+                    break
+                if record:
+                    yield record.series_instance_uid, file_path, size, record.geometry
+        except Exception as e:
+            # 损坏的压缩包：已产出的成员保留，其余放弃
+            logger.warning(f"读取压缩包失败 {archive_path}: {e}")
+            if profile:
+                profile.record_failure(archive_path, e)
+        if profile:
+            profile.files_walked += count
+            profile.record_directory(archive_path, time.perf_counter() - start, count)
 
-        return dicom_files
+    @staticmethod
+    def scan_directory(root_path: str, recursive: bool = True,
+                       profile: Optional[ScanProfile] = None) -> List[str]:
+        """扫描目录下所有DICOM文件"""
+        return list(DicomScanner.iter_dicom_files(root_path, recursive, profile))
 
     @staticmethod
-    def group_by_series(file_paths: List[str]) -> Dict[str, List[str]]:
+    def iter_series_entries(file_paths: Iterable[str],
+                            profile: Optional[ScanProfile] = None) -> Iterator[SeriesEntry]:
+        """逐个解析文件，产出 (series_uid, 路径, 文件大小, 几何信息)"""
+        interner = StringInterner(INTERNER_MAX_SIZE)
+
+        # 文件按目录顺序到达，同目录文件连续，按段计入目录耗时
+        current_dir = None
+        dir_start = time.perf_counter()
+
+        for file_path in file_paths:
+            if profile:
+                dirname = os.path.dirname(file_path)
+                if dirname != current_dir:
+                    if current_dir is not None:
+                        profile.record_directory(current_dir, time.perf_counter() - dir_start)
+                    current_dir = dirname
+                    dir_start = time.perf_counter()
+
+            parse_start = time.perf_counter()
+            record = DicomScanner.read_record(file_path, profile, interner)
+            if profile:
+                profile.add_stage_time("parse", time.perf_counter() - parse_start)
+            if record:
+                yield record.series_instance_uid, file_path, record.file_size, record.geometry
+
+        if profile and current_dir is not None:
+            profile.record_directory(current_dir, time.perf_counter() - dir_start)
+
+    @staticmethod
+    def group_by_series(file_paths: Iterable[str],
+                        profile: Optional[ScanProfile] = None) -> Dict[str, List[str]]:
         """按SeriesInstanceUID分组"""
         series_map: Dict[str, List[str]] = {}
 
-        for file_path in file_paths:
-            info = DicomScanner.read_dicom(file_path)
-            if info and info.series_instance_uid:
-                if info.series_instance_uid not in series_map:
-                    series_map[info.series_instance_uid] = []
-                series_map[info.series_instance_uid].append(file_path)
+        for series_uid, file_path, _, _ in DicomScanner.iter_series_entries(file_paths, profile):
+            if series_uid not in series_map:
+                series_map[series_uid] = []
+            series_map[series_uid].append(file_path)
 
         return series_map
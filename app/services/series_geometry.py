@@ -0,0 +1,159 @@
+"""
+序列几何与完整性分析
+入库解析时顺带记录每个实例的 InstanceNumber / ImagePositionPatient / ImageOrientationPatient，
+入库前对整个序列做一次向量化计算：层间距、缺层、重复层、方向是否一致
+"""
+from typing import Any, Dict, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 同一位置判定（mm）
+POSITION_TOLERANCE = 1e-3
+# 方向余弦一致判定
+ORIENTATION_TOLERANCE = 1e-3
+# 相邻层距超过中位层距的该倍数视为缺层
+GAP_FACTOR = 1.5
+
+
+class InstanceGeometry(NamedTuple):
+    """单个实例的几何信息"""
+    instance_number: Optional[int]
+    position: Optional[Tuple[float, float, float]]
+    orientation: Optional[Tuple[float, ...]]
+
+
+def geometry_from_dataset(ds, intern=None) -> Optional[InstanceGeometry]:
+    """从数据集提取几何信息，三项都没有时返回None"""
+    instance_number = _to_int(ds.get("InstanceNumber"))
+    position = _to_floats(ds.get("ImagePositionPatient"), 3)
+    orientation = _to_floats(ds.get("ImageOrientationPatient"), 6)
+    if orientation is not None:
+        # 同一序列各实例方向相同，驻留后共享一个元组
+        orientation = tuple(round(v, 6) for v in orientation)
+        if intern is not None:
+            orientation = intern(orientation)
+    if instance_number is None and position is None and orientation is None:
+        return None
+    return InstanceGeometry(instance_number, position, orientation)
+
+
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_floats(value, count: int) -> Optional[Tuple[float, ...]]:
+    try:
+        if value is None or len(value) != count:
+            return None
+        return tuple(float(v) for v in value)
+    except (TypeError, ValueError):
+        return None
+
+
+def encode_orientation(orientation: Optional[Sequence[float]]) -> Optional[str]:
+    """方向余弦存为 DICOM 多值字符串格式"""
+    if orientation is None:
+        return None
+    return "\\".join(repr(v) for v in orientation)
+
+
+def decode_orientation(text: Optional[str]) -> Optional[Tuple[float, ...]]:
+    if not text:
+        return None
+    return tuple(float(v) for v in text.split("\\"))
+
+
+# 数据库中按列存储几何信息（series / series_paths / scan_work_results 共用列名）
+GEOMETRY_COLUMNS = ("instance_number", "position_x", "position_y", "position_z", "orientation")
+
+
+def geometry_columns(geometry: Optional[InstanceGeometry]) -> Dict[str, Any]:
+    """几何信息转为按列存储的字典"""
+    if geometry is None:
+        return dict.fromkeys(GEOMETRY_COLUMNS)
+    x, y, z = geometry.position or (None, None, None)
+    return {
+        "instance_number": geometry.instance_number,
+        "position_x": x,
+        "position_y": y,
+        "position_z": z,
+        "orientation": encode_orientation(geometry.orientation),
+    }
+
+
+def geometry_from_columns(instance_number, x, y, z, orientation,
+                          cache: Optional[Dict[str, Any]] = None) -> Optional[InstanceGeometry]:
+    """从按列存储的值还原几何信息；cache 用于同一方向字符串只解码一次"""
+    if instance_number is None and x is None and not orientation:
+        return None
+    if cache is None:
+        decoded = decode_orientation(orientation)
+    else:
+        if orientation not in cache:
+            cache[orientation] = decode_orientation(orientation)
+        decoded = cache[orientation]
+    position = (x, y, z) if x is not None else None
+    return InstanceGeometry(instance_number, position, decoded)
+
+
+def instance_key(geometry: Optional[InstanceGeometry]) -> Optional[Tuple]:
+    """判断同一实例的副本：实例编号与位置都相同；没有几何信息时无法判断"""
+    if geometry is None or (geometry.instance_number is None and geometry.position is None):
+        return None
+    position = tuple(round(v, 3) for v in geometry.position) if geometry.position else None
+    return geometry.instance_number, position
+
+
+def analyze_geometry(geometries: Sequence[Optional[InstanceGeometry]]) -> Dict[str, Any]:
+    """计算序列的几何统计，返回可直接写入Series的字段（无法计算的为None）"""
+    result: Dict[str, Any] = {
+        "slice_count": None,
+        "slice_spacing": None,
+        "missing_slices": None,
+        "duplicate_slices": None,
+        "orientation_consistent": None,
+        "missing_instance_numbers": None,
+        "geometry_ok": None,
+    }
+    known = [g for g in geometries if g is not None]
+
+    numbers = np.array([g.instance_number for g in known if g.instance_number is not None], dtype=np.int64)
+    if numbers.size:
+        # 编号范围内缺失的数量（重复编号不算）
+        result["missing_instance_numbers"] = int(numbers.max() - numbers.min() + 1 - np.unique(numbers).size)
+
+    with_position = [g for g in known if g.position is not None and g.orientation is not None]
+    if len(with_position) < 2:
+        return result
+
+    positions = np.array([g.position for g in with_position], dtype=np.float64)
+    orientations = np.array([g.orientation for g in with_position], dtype=np.float64)
+
+    consistent = bool(np.all(np.abs(orientations - orientations[0]) <= ORIENTATION_TOLERANCE))
+    result["orientation_consistent"] = consistent
+
+    # 沿第一个实例的法向投影后排序，相邻差即层距
+    normal = np.cross(orientations[0, :3], orientations[0, 3:])
+    distances = np.sort(positions @ normal)
+    steps = np.diff(distances)
+
+    duplicates = steps <= POSITION_TOLERANCE
+    result["duplicate_slices"] = int(duplicates.sum())
+    result["slice_count"] = int(distances.size - duplicates.sum())
+
+    steps = steps[~duplicates]
+    if steps.size:
+        spacing = float(np.median(steps))
+        gaps = steps[steps > spacing * GAP_FACTOR]
+        result["slice_spacing"] = round(spacing, 4)
+        result["missing_slices"] = int((np.rint(gaps / spacing) - 1).sum())
+    else:
+        result["missing_slices"] = 0
+
+    result["geometry_ok"] = bool(
+        consistent and result["missing_slices"] == 0 and result["duplicate_slices"] == 0
+    )
+    return result
@@ -0,0 +1,139 @@
+"""
+序列分组暂存
+超大扫描根目录下，将 (SeriesInstanceUID, 路径, 大小, 几何信息) 写入磁盘上的SQLite暂存表，
+再按UID顺序流式读出每个序列，内存占用与归档规模无关。
+暂存表同时记录已完成的目录，进程中断后可从断点继续遍历。
+"""
+import os
+import sqlite3
+from typing import Iterator, List, Optional, Tuple
+
+from app.services.series_geometry import (
+    InstanceGeometry, encode_orientation, geometry_from_columns,
+)
+
+# 暂存文件目录
+STAGING_DIR = os.environ.get("SCAN_STAGING_DIR", "./data/staging")
+
+
+def staging_path_for(scan_id: str) -> str:
+    """扫描对应的暂存文件路径"""
+    return os.path.join(STAGING_DIR, f"{scan_id}.db")
+
+
+class SeriesStaging:
+    """基于SQLite的序列暂存表"""
+
+    # 缓冲达到该行数后，在目录边界处落盘
+    BATCH_SIZE = 5000
+
+    GEOMETRY_COLUMNS = (("instance_number", "INTEGER"), ("pos_x", "REAL"), ("pos_y", "REAL"),
+                        ("pos_z", "REAL"), ("orientation", "TEXT"))
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        # WAL保证中断后已提交的目录完整可用
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS staged ("
+            "series_uid TEXT NOT NULL, file_path TEXT NOT NULL, file_size INTEGER NOT NULL, "
+            "instance_number INTEGER, pos_x REAL, pos_y REAL, pos_z REAL, orientation TEXT)"
+        )
+        # 旧版本留下的暂存文件没有几何列，续扫时补上（已暂存的行几何为空）
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(staged)")}
+        for name, sql_type in self.GEOMETRY_COLUMNS:
+            if name not in columns:
+                self.conn.execute(f"ALTER TABLE staged ADD COLUMN {name} {sql_type}")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS done_dirs (dir_path TEXT PRIMARY KEY)")
+        self.conn.commit()
+        self._buffer: List[tuple] = []
+        self._done_buffer: List[Tuple[str]] = []
+        self.file_count = 0
+
+    def add(self, series_uid: str, file_path: str, file_size: int,
+            geometry: Optional[InstanceGeometry] = None):
+        """暂存一个文件（目录完成前只在内存缓冲）"""
+        if geometry is None:
+            self._buffer.append((series_uid, file_path, file_size, None, None, None, None, None))
+        else:
+            x, y, z = geometry.position or (None, None, None)
+            self._buffer.append((series_uid, file_path, file_size, geometry.instance_number,
+                                 x, y, z, encode_orientation(geometry.orientation)))
+        self.file_count += 1
+
+    def mark_dir_done(self, dir_path: str):
+        """标记目录已全部暂存，文件与目录标记在同一事务中落盘"""
+        self._done_buffer.append((dir_path,))
+        if len(self._buffer) >= self.BATCH_SIZE:
+            self.flush()
+
+    def is_dir_done(self, dir_path: str) -> bool:
+        row = self.conn.execute("SELECT 1 FROM done_dirs WHERE dir_path = ?", (dir_path,)).fetchone()
+        return row is not None
+
+    def flush(self):
+        """提交已完成目录的缓冲"""
+        if self._buffer:
+            self.conn.executemany(
+                "INSERT INTO staged (series_uid, file_path, file_size, instance_number, "
+                "pos_x, pos_y, pos_z, orientation) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self._buffer,
+            )
+        if self._done_buffer:
+            self.conn.executemany("INSERT OR IGNORE INTO done_dirs VALUES (?)", self._done_buffer)
+        self.conn.commit()
+        self._buffer = []
+        self._done_buffer = []
+
+    def total_files(self) -> int:
+        self.flush()
+        return self.conn.execute("SELECT COUNT(*) FROM staged").fetchone()[0]
+
+    def series_count(self) -> int:
+        self.flush()
+        return self.conn.execute("SELECT COUNT(DISTINCT series_uid) FROM staged").fetchone()[0]
+
+    def iter_series(self, after_uid: Optional[str] = None
+                    ) -> Iterator[Tuple[str, List[str], List[int], List[Optional[InstanceGeometry]]]]:
+        """按UID顺序流式输出 (series_uid, 文件列表, 文件大小列表, 几何信息列表)，同一时刻只持有一个序列
+
+        after_uid: 只输出UID大于该值的序列，用于从入库断点继续
+        """
+        self.flush()
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_staged_uid ON staged (series_uid, file_path)")
+
+        cursor = self.conn.execute(
+            "SELECT series_uid, file_path, file_size, instance_number, pos_x, pos_y, pos_z, orientation "
+            "FROM staged "
+            "WHERE series_uid > ? ORDER BY series_uid, file_path",
+            (after_uid or "",),
+        )
+        current_uid = None
+        file_list: List[str] = []
+        sizes: List[int] = []
+        geometries: List[Optional[InstanceGeometry]] = []
+        orientations = {}  # 同一方向字符串只解码一次
+        for series_uid, file_path, file_size, number, x, y, z, orientation in cursor:
+            if series_uid != current_uid:
+                if current_uid is not None:
+                    yield current_uid, file_list, sizes, geometries
+                current_uid = series_uid
+                file_list = []
+                sizes = []
+                geometries = []
+            file_list.append(file_path)
+            sizes.append(file_size)
+            geometries.append(geometry_from_columns(number, x, y, z, orientation, orientations))
+        if current_uid is not None:
+            yield current_uid, file_list, sizes, geometries
+
+    def close(self, remove: bool = True):
+        """关闭暂存表，remove=True时删除暂存文件（保留则可用于续扫）"""
+        self.conn.close()
+        if remove:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
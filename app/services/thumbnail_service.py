@@ -0,0 +1,305 @@
+"""
+序列缩略图
+按入库时记录的InstanceNumber取中间一层，窗宽窗位后用NumPy缩小并编码为PNG；
+结果缓存在磁盘上，总大小超限时按修改时间（命中时刷新）淘汰最久未用的
+"""
+import io
+import os
+import struct
+import threading
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pydicom
+from pydicom.filereader import read_partial
+from pydicom.tag import Tag
+
+from app.services import archives
+
+THUMBNAIL_DIR = os.environ.get("THUMBNAIL_DIR", "./data/thumbnails")
+THUMBNAIL_CACHE_MB = int(os.environ.get("THUMBNAIL_CACHE_MB", "256"))
+DEFAULT_THUMBNAIL_SIZE = 256
+# 没有入库编号（升级前入库的序列）时最多读取的文件头数
+SAMPLE_HEADERS = 16
+# 压缩包成员只读开头这么多字节取InstanceNumber，不解压整个成员
+MEMBER_HEADER_BYTES = 64 * 1024
+
+_INSTANCE_NUMBER = Tag("InstanceNumber")
+
+
+class ThumbnailError(Exception):
+    """无法生成缩略图（文件不可用或像素无法解码）"""
+
+
+# ========== 选层 ==========
+
+def _read_instance_number(stream) -> Optional[int]:
+    """只读到InstanceNumber为止"""
+    try:
+        ds = read_partial(stream, stop_when=lambda tag, vr, length: tag > _INSTANCE_NUMBER,
+                          specific_tags=[_INSTANCE_NUMBER])
+        value = ds.get("InstanceNumber")
+        return int(value) if value not in (None, "") else None
+    except Exception:
+        return None
+
+
+def instance_numbers(paths: List[str]) -> Dict[str, Optional[int]]:
+    """各实例的InstanceNumber（压缩包成员按归档顺序读一遍）"""
+    numbers: Dict[str, Optional[int]] = {}
+    plain, members = archives.group_by_archive(paths)
+    for path in plain:
+        try:
+            with open(path, "rb") as f:
+                numbers[path] = _read_instance_number(f)
+        except OSError:
+            continue
+    for archive_path, names in members.items():
+        wanted = set(names)
+        try:
+            for name, _, stream in archives.iter_members(archive_path):
+                if name in wanted:
+                    numbers[archives.member_path(archive_path, name)] = _read_instance_number(
+                        io.BytesIO(stream.read(MEMBER_HEADER_BYTES))
+                    )
+                    wanted.discard(name)
+                    if not wanted:
+                        break
+        except Exception:
+            continue
+    return numbers
+
+
+def middle_instance(instances: List[Tuple[str, Optional[int]]]) -> Optional[str]:
+    """按InstanceNumber排序后的中间实例，instances 为 (路径, 入库时记录的编号)
+
+    有编号时不读文件（同一实例的副本没有编号，不参与排序）；都没有编号时从按路径排序的实例中
+    均匀抽取最多 SAMPLE_HEADERS 个读取文件头，无编号的排在后面
+    """
+    numbered = sorted((number, path) for path, number in instances if number is not None)
+    if numbered:
+        return numbered[len(numbered) // 2][1]
+
+    paths = sorted(path for path, _ in instances)
+    step = max(1, len(paths) // SAMPLE_HEADERS)
+    numbers = instance_numbers(paths[step // 2::step][:SAMPLE_HEADERS])
+    if not numbers:
+        return None
+    ordered = sorted(numbers, key=lambda p: (numbers[p] is None, numbers[p] or 0, p))
+    return ordered[len(ordered) // 2]
+
+
+# ========== 渲染 ==========
+
+def _first_value(value) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, pydicom.multival.MultiValue):
+        value = value[0] if len(value) else None
+    return float(value) if value is not None else None
+
+
+def _load_dataset(path: str) -> pydicom.Dataset:
+    if archives.is_member_path(path):
+        with archives.open_member(path) as stream:
+            return pydicom.dcmread(io.BytesIO(stream.read()), force=True)
+    return pydicom.dcmread(path, force=True)
+
+
+def _window(ds: pydicom.Dataset, pixels: np.ndarray) -> np.ndarray:
+    """灰度图：Rescale -> 窗宽窗位（无窗信息时取1%~99%分位） -> 0..255"""
+    slope = _first_value(ds.get("RescaleSlope")) or 1.0
+    intercept = _first_value(ds.get("RescaleIntercept")) or 0.0
+    values = pixels.astype(np.float32) * slope + intercept
+
+    center = _first_value(ds.get("WindowCenter"))
+    width = _first_value(ds.get("WindowWidth"))
+    if center is not None and width and width > 1:
+        low, high = center - width / 2.0, center + width / 2.0
+    else:
+        low, high = np.percentile(values, [1, 99])
+    if high <= low:
+        high = low + 1.0
+
+    scaled = (np.clip(values, low, high) - low) * (255.0 / (high - low))
+    if str(ds.get("PhotometricInterpretation", "")).upper() == "MONOCHROME1":
+        scaled = 255.0 - scaled
+    return scaled
+
+
+def _downscale(image: np.ndarray, size: int) -> np.ndarray:
+    """按整数倍块平均缩小，使长边不超过size"""
+    height, width = image.shape[:2]
+    factor = max(1, -(-max(height, width) // size))
+    if factor == 1:
+        return image
+    height, width = height // factor * factor, width // factor * factor
+    image = image[:height, :width]
+    blocks = image.reshape(height // factor, factor, width // factor, factor, *image.shape[2:])
+    return blocks.mean(axis=(1, 3))
+
+
+def render_thumbnail(path: str, size: int = DEFAULT_THUMBNAIL_SIZE) -> bytes:
+    """解码单个实例并生成PNG"""
+    try:
+        ds = _load_dataset(path)
+        pixels = ds.pixel_array
+    except Exception as e:
+        raise ThumbnailError(f"无法解码像素数据: {e}")
+
+    samples = int(ds.get("SamplesPerPixel", 1) or 1)
+    if (samples == 1 and pixels.ndim == 3) or (samples > 1 and pixels.ndim == 4):
+        pixels = pixels[len(pixels) // 2]  # 多帧取中间帧
+
+    if samples == 1:
+        image = _window(ds, pixels)
+    else:
+        image = pixels[..., :3].astype(np.float32)
+        if pixels.dtype != np.uint8:
+            image *= 255.0 / max(float(image.max()), 1.0)
+
+    image = _downscale(image, size)
+    return encode_png(np.clip(image + 0.5, 0, 255).astype(np.uint8))
+
+
+def encode_png(image: np.ndarray) -> bytes:
+    """8位灰度或RGB数组编码为PNG（无滤波，zlib压缩）"""
+    height, width = image.shape[:2]
+    color_type = 2 if image.ndim == 3 else 0
+    # 每行前加滤波类型字节0
+    rows = np.ascontiguousarray(image).reshape(height, -1)
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rows]).tobytes()
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b""))
+
+
+# ========== 缓存 ==========
+
+class ThumbnailCache:
+    """磁盘缓存：同一key并发请求只生成一次，总大小超限时淘汰到低水位"""
+
+    LOW_WATERMARK = 0.8
+
+    def __init__(self, directory: str = THUMBNAIL_DIR, max_bytes: int = THUMBNAIL_CACHE_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._guard = threading.Lock()
+        self._key_locks: Dict[str, Tuple[threading.Lock, int]] = {}
+        self._total_bytes: Optional[int] = None
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.png")
+
+    def _acquire_key(self, key: str) -> threading.Lock:
+        with self._guard:
+            lock, waiters = self._key_locks.get(key, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self._key_locks[key] = (lock, waiters + 1)
+        lock.acquire()
+        return lock
+
+    def _release_key(self, key: str, lock: threading.Lock):
+        lock.release()
+        with self._guard:
+            _, waiters = self._key_locks[key]
+            if waiters <= 1:
+                del self._key_locks[key]
+            else:
+                self._key_locks[key] = (lock, waiters - 1)
+
+    @staticmethod
+    def _read(path: str) -> Optional[bytes]:
+        """读取缓存并刷新修改时间（LRU依据），不存在返回None"""
+        try:
+            os.utime(path)
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def get_or_create(self, key: str, render: Callable[[], bytes]) -> bytes:
+        """返回缓存内容，未命中时调用render生成并写入"""
+        path = self._path(key)
+        data = self._read(path)
+        if data is not None:
+            return data
+
+        lock = self._acquire_key(key)
+        try:
+            # 排队期间可能已由其他请求生成
+            data = self._read(path)
+            if data is not None:
+                return data
+            data = render()
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        finally:
+            self._release_key(key, lock)
+
+        self._account(len(data))
+        return data
+
+    def _account(self, added: int):
+        with self._guard:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._entries())
+            else:
+                self._total_bytes += added
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(".png"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _evict(self):
+        """按修改时间从旧到新删除，直到低于低水位"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * self.LOW_WATERMARK
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._total_bytes = total
+
+
+thumbnail_cache = ThumbnailCache()
+
+
+def series_thumbnail(series_id: str, file_count: int,
+                     load_instances: Callable[[], List[Tuple[str, Optional[int]]]],
+                     size: int = DEFAULT_THUMBNAIL_SIZE) -> bytes:
+    """序列缩略图PNG；文件数变化（追加实例）后自动换新
+
+    load_instances 返回 (路径, 编号) 列表，只在缓存未命中需要生成时调用
+    """
+    def render() -> bytes:
+        path = middle_instance(load_instances())
+        if path is None:
+            raise ThumbnailError("序列文件不可用")
+        return render_thumbnail(path, size)
+
+    return thumbnail_cache.get_or_create(f"{series_id}_{file_count}_{size}", render)
@@ -0,0 +1,313 @@
+"""
+目录监听服务
+订阅扫描路径的文件系统事件（inotify，网络挂载自动改为轮询），
+序列在静默期内没有新文件后，只将变化的文件通过扫描服务入库
+"""
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Set
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
+
+from app.db.database import SessionLocal
+from app.db.models import Scan, ScanConfig
+from app.services.mounts import is_network_mount
+from app.services.scanner import DicomScanner, StringInterner
+from app.services.scan_service import ScanService, generate_scan_id
+
+# 默认静默期（秒）
+DEFAULT_QUIET_SECONDS = 30
+# 轮询模式的检查间隔（秒）
+POLLING_INTERVAL = 5
+
+
+class _ChangeHandler(FileSystemEventHandler):
+    """将文件创建/写入/移入事件放入队列"""
+
+    EVENT_TYPES = {"created", "modified", "moved", "closed"}
+
+    def __init__(self, events: "queue.Queue[str]"):
+        self.events = events
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in self.EVENT_TYPES:
+            return
+        path = getattr(event, "dest_path", "") or event.src_path
+        self.events.put(os.fsdecode(path))
+
+
+class SeriesWatcher:
+    """单个扫描配置的监听器"""
+
+    def __init__(self, config_id: int, scan_path: str,
+                 quiet_seconds: int = DEFAULT_QUIET_SECONDS, force_polling: bool = False):
+        self.config_id = config_id
+        self.scan_path = scan_path
+        self.quiet_seconds = quiet_seconds
+        self.force_polling = force_polling
+        self.polling = force_polling or is_network_mount(scan_path)
+        self.scan_id: Optional[str] = None
+
+        self._events: "queue.Queue[str]" = queue.Queue()
+        self._stop = threading.Event()
+        self._observer = None
+        self._thread: Optional[threading.Thread] = None
+
+        # 待解析文件: 路径 -> 最后事件时间
+        self._pending_files: Dict[str, float] = {}
+        # 待入库序列: UID -> {"files": {路径: 几何信息}, "last_seen": 最后事件时间}
+        self._pending_series: Dict[str, Dict[str, Any]] = {}
+        self._file_series: Dict[str, str] = {}  # 已归类文件 -> UID
+
+        # 本次监听涉及的序列（同一序列分多次写入只计一次）
+        self._new_series: Set[str] = set()
+        self._updated_series: Set[str] = set()
+        self.files_ingested = 0
+        self.last_ingest_at: Optional[str] = None
+
+    def start(self):
+        """开始监听，创建一条watch类型的扫描记录"""
+        db = SessionLocal()
+        try:
+            self.scan_id = generate_scan_id()
+            db.add(Scan(
+                id=self.scan_id,
+                config_id=self.config_id,
+                scan_path=self.scan_path,
+                scan_type="watch",
+                started_at=datetime.now().isoformat(),
+                status="running",
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+        if self.polling:
+            self._observer = PollingObserver(timeout=POLLING_INTERVAL)
+        else:
+            self._observer = Observer()
+        self._observer.schedule(_ChangeHandler(self._events), self.scan_path, recursive=True)
+        self._observer.start()
+
+        self._thread = threading.Thread(target=self._run, name=f"watch-{self.config_id}", daemon=True)
+        self._thread.start()
+        print(f"开始监听: {self.scan_path} ({'polling' if self.polling else 'inotify'})")
+
+    def stop(self):
+        """停止监听，入库剩余的序列"""
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        if self._thread is not None:
+            self._thread.join()
+
+        db = SessionLocal()
+        try:
+            scan = db.query(Scan).filter(Scan.id == self.scan_id).first()
+            if scan:
+                scan.status = "completed"
+                scan.finished_at = datetime.now().isoformat()
+                db.commit()
+        finally:
+            db.close()
+        print(f"停止监听: {self.scan_path}")
+
+    @property
+    def series_new(self) -> int:
+        return len(self._new_series)
+
+    @property
+    def series_updated(self) -> int:
+        """追加了实例的已有序列数（不含本次监听新建的序列）"""
+        return len(self._updated_series - self._new_series)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "config_id": self.config_id,
+            "scan_path": self.scan_path,
+            "scan_id": self.scan_id,
+            "mode": "polling" if self.polling else "inotify",
+            "quiet_seconds": self.quiet_seconds,
+            "pending_files": len(self._pending_files),
+            "pending_series": len(self._pending_series),
+            "series_new": self.series_new,
+            "series_updated": self.series_updated,
+            "files_ingested": self.files_ingested,
+            "last_ingest_at": self.last_ingest_at,
+        }
+
+    def _run(self):
+        """后台线程：收集事件 -> 解析文件 -> 静默后按序列入库"""
+        tick = max(0.2, min(1.0, self.quiet_seconds / 4))
+        while not self._stop.is_set():
+            self._drain_events(timeout=tick)
+            self._classify_files(time.monotonic())
+            self._flush_quiet_series(time.monotonic())
+
+        # 退出前入库所有已识别的序列
+        self._drain_events(timeout=0)
+        self._classify_files(float("inf"))
+        self._flush_quiet_series(float("inf"))
+
+    def _drain_events(self, timeout: float):
+        try:
+            path = self._events.get(timeout=timeout) if timeout else self._events.get_nowait()
+        except queue.Empty:
+            return
+        now = time.monotonic()
+        while True:
+            series_uid = self._file_series.get(path)
+            if series_uid is not None:
+                # 已归类的文件再次写入，只推迟其序列的入库
+                self._pending_series[series_uid]["last_seen"] = now
+            else:
+                self._pending_files[path] = now
+            try:
+                path = self._events.get_nowait()
+            except queue.Empty:
+                break
+
+    def _classify_files(self, now: float):
+        """解析已停止写入的文件头，归入所属序列；仍在写入或解析失败的文件留待下次"""
+        settle = min(2.0, self.quiet_seconds / 2)
+        interner = StringInterner()
+        for path, last_event in list(self._pending_files.items()):
+            if now - last_event < settle:
+                continue
+            if not os.path.isfile(path) or not DicomScanner.is_dicom_file(path):
+                # 静默期过后仍不是DICOM则放弃
+                if now - last_event >= self.quiet_seconds:
+                    del self._pending_files[path]
+                continue
+
+            record = DicomScanner.read_record(path, interner=interner)
+            if not record or not record.series_instance_uid:
+                if now - last_event >= self.quiet_seconds:
+                    del self._pending_files[path]
+                continue
+
+            del self._pending_files[path]
+            series = self._pending_series.setdefault(
+                record.series_instance_uid, {"files": {}, "last_seen": last_event}
+            )
+            series["files"][path] = (record.file_size, record.geometry)
+            series["last_seen"] = max(series["last_seen"], last_event)
+            self._file_series[path] = record.series_instance_uid
+
+    def _flush_quiet_series(self, now: float):
+        """入库静默期内没有新文件的序列"""
+        quiet = [uid for uid, series in self._pending_series.items()
+                 if now - series["last_seen"] >= self.quiet_seconds]
+        if not quiet:
+            return
+
+        db = SessionLocal()
+        try:
+            service = ScanService(db)
+            for series_uid in quiet:
+                pending = self._pending_series.pop(series_uid)["files"]
+                files: List[str] = sorted(pending)
+                for path in files:
+                    self._file_series.pop(path, None)
+                try:
+                    is_new = service.ingest_files(series_uid, files, self.scan_id,
+                                                  [pending[path][0] for path in files],
+                                                  [pending[path][1] for path in files])
+                except Exception as e:
+                    db.rollback()
+                    print(f"监听入库失败 {series_uid}: {e}")
+                    continue
+                if is_new is None:
+                    continue
+                if is_new:
+                    self._new_series.add(series_uid)
+                else:
+                    self._updated_series.add(series_uid)
+                self.files_ingested += len(files)
+                self.last_ingest_at = datetime.now().isoformat()
+
+            scan = db.query(Scan).filter(Scan.id == self.scan_id).first()
+            if scan:
+                scan.series_new = self.series_new
+                scan.series_duplicated = self.series_updated
+                scan.series_found = self.series_new + self.series_updated
+                db.commit()
+        finally:
+            db.close()
+
+
+class WatchManager:
+    """管理所有扫描配置的监听器"""
+
+    def __init__(self):
+        self._watchers: Dict[int, SeriesWatcher] = {}
+        self._lock = threading.Lock()
+
+    def start(self, config: ScanConfig, force_polling: bool = False) -> SeriesWatcher:
+        with self._lock:
+            if config.id in self._watchers:
+                return self._watchers[config.id]
+            if not os.path.isdir(config.scan_path):
+                raise ValueError(f"扫描路径不存在: {config.scan_path}")
+            watcher = SeriesWatcher(
+                config.id, config.scan_path,
+                quiet_seconds=config.watch_quiet_seconds or DEFAULT_QUIET_SECONDS,
+                force_polling=force_polling,
+            )
+            watcher.start()
+            self._watchers[config.id] = watcher
+            return watcher
+
+    def reload(self, config: ScanConfig) -> Optional[SeriesWatcher]:
+        """配置修改后，监听路径或静默期变化的监听器按新配置重启；未在监听时返回None"""
+        watcher = self.get(config.id)
+        if watcher is None:
+            return None
+        quiet_seconds = config.watch_quiet_seconds or DEFAULT_QUIET_SECONDS
+        if watcher.scan_path == config.scan_path and watcher.quiet_seconds == quiet_seconds:
+            return watcher
+        self.stop(config.id)
+        return self.start(config, force_polling=watcher.force_polling)
+
+    def stop(self, config_id: int) -> bool:
+        with self._lock:
+            watcher = self._watchers.pop(config_id, None)
+        if watcher is None:
+            return False
+        watcher.stop()
+        return True
+
+    def stop_all(self):
+        for config_id in list(self._watchers):
+            self.stop(config_id)
+
+    def get(self, config_id: int) -> Optional[SeriesWatcher]:
+        return self._watchers.get(config_id)
+
+    def list_status(self) -> List[Dict[str, Any]]:
+        return [watcher.status() for watcher in list(self._watchers.values())]
+
+    def restore(self):
+        """启动时恢复已开启监听的配置"""
+        db = SessionLocal()
+        try:
+            configs = db.query(ScanConfig).filter(
+                ScanConfig.watch_enabled == True,
+                ScanConfig.is_active == True
+            ).all()
+            for config in configs:
+                try:
+                    self.start(config)
+                except Exception as e:
+                    print(f"恢复监听失败 {config.scan_path}: {e}")
+        finally:
+            db.close()
+
+
+watch_manager = WatchManager()
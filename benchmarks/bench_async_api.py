@@ -0,0 +1,168 @@
+"""
+查询接口并发基准：同步会话（线程池） vs 异步会话
+
+用法:
+    python benchmarks/bench_async_api.py --series 20000 --concurrency 50 200 400
+
+在临时SQLite库中写入测试序列，用uvicorn子进程启动服务，分别压测
+  /bench/sync/series  —— 旧实现：def路由 + get_db，经Starlette线程池执行
+  /api/series         —— 新实现：async路由 + get_async_db
+输出每个并发度下的吞吐量和延迟分位数。
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+if os.environ.get("BENCH_SERVER"):
+    # 子进程：在正式应用上挂一个与旧实现一致的同步路由
+    from fastapi import Depends, Query
+    from sqlalchemy.orm import Session
+    from typing import List as _List
+
+    from app.main import app as bench_app
+    from app.db.database import get_db
+    from app.db.models import Series
+    from app.schemas.series import SeriesResponse
+
+    @bench_app.get("/bench/sync/series", response_model=_List[SeriesResponse])
+    def sync_series(
+        page: int = Query(1, ge=1),
+        page_size: int = Query(20, ge=1, le=100),
+        modality: Optional[str] = None,
+        db: Session = Depends(get_db)
+    ):
+        query = db.query(Series).filter(Series.is_active == True)
+        if modality:
+            query = query.filter(Series.modality == modality)
+        offset = (page - 1) * page_size
+        return query.order_by(Series.created_at.desc()).offset(offset).limit(page_size).all()
+
+
+def seed(database_url: str, count: int):
+    """写入测试序列"""
+    os.environ["DATABASE_URL"] = database_url
+    from app.db.database import SessionLocal, init_db
+    from app.db.models import Series
+
+    init_db()
+    db = SessionLocal()
+    modalities = ["CT", "MR", "DX", "CR", "US"]
+    for i in range(count):
+        db.add(Series(
+            id=f"SER{i:012d}",
+            patient_id=f"P{i // 20:06d}",
+            patient_name=f"Patient^{i // 20}",
+            study_instance_uid=f"1.2.3.{i // 5}",
+            study_date=f"2024{(i % 12) + 1:02d}{(i % 28) + 1:02d}",
+            series_instance_uid=f"1.2.3.4.{i}",
+            modality=modalities[i % len(modalities)],
+            file_path=f"/data/{i}/1.dcm",
+            file_count=100,
+            file_size_total=100 * 512 * 1024,
+            created_at=f"2024-01-01T00:{i % 60:02d}:00",
+            is_active=True,
+        ))
+        if i % 5000 == 0:
+            db.commit()
+    db.commit()
+    db.close()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def load(url: str, concurrency: int, total: int) -> dict:
+    """以固定并发发送total个请求"""
+    import httpx
+
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async with httpx.AsyncClient(timeout=60, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                start = time.perf_counter()
+                try:
+                    resp = await client.get(url, params={"page": i % 50 + 1, "modality": "CT"})
+                    ok = resp.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                if not ok:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {
+        "rps": total / elapsed,
+        "p50": pct(0.50),
+        "p95": pct(0.95),
+        "p99": pct(0.99),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询接口并发基准")
+    parser.add_argument("--series", type=int, default=20000, help="测试序列数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200, 400])
+    parser.add_argument("--requests", type=int, default=4000, help="每轮请求数")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_async_")
+    database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    print(f"写入 {args.series} 条序列 -> {database_url}")
+    seed(database_url, args.series)
+
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=database_url, BENCH_SERVER="1")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.bench_async_api:bench_app",
+         "--port", str(port), "--log-level", "critical"],
+        cwd=ROOT, env=env, stderr=subprocess.DEVNULL,
+    )
+    try:
+        import httpx
+        for _ in range(100):
+            try:
+                httpx.get(f"http://127.0.0.1:{port}/health")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+
+        print(f"{'endpoint':<22}{'conc':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'err':>6}")
+        for concurrency in args.concurrency:
+            for name, path in (("sync (threadpool)", "/bench/sync/series"), ("async", "/api/series")):
+                url = f"http://127.0.0.1:{port}{path}"
+                asyncio.run(load(url, concurrency, min(200, args.requests)))  # 预热
+                r = asyncio.run(load(url, concurrency, args.requests))
+                print(f"{name:<22}{concurrency:>6}{r['rps']:>10.0f}{r['p50']:>10.1f}"
+                      f"{r['p95']:>10.1f}{r['p99']:>10.1f}{r['errors']:>6}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+单文件记录内存基准：DicomInfo vs 驻留的DicomRecord
+
+用法:
+    python benchmarks/bench_dicom_record.py --files 1000000
+    python benchmarks/bench_dicom_record.py --files 1000000 --dir /data/nas/dicom1   # 附带真实文件解析耗时
+
+按真实归档的分布（每序列约200张、每检查约4个序列）构造记录，字符串每个文件都是新对象，
+与pydicom逐文件解析的结果一致。分别统计保留全部记录时的内存占用与分配峰值，
+以及流式扫描（记录产出后即丢弃，如超大目录扫描）时驻留表本身的内存占用。
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.services.scanner import (  # noqa: E402
+    INTERNER_MAX_SIZE, DicomInfo, DicomRecord, DicomScanner, StringInterner,
+)
+
+FILES_PER_SERIES = 200
+SERIES_PER_STUDY = 4
+
+
+def _fresh(value: str) -> str:
+    """返回内容相同的新字符串对象（模拟逐文件解析）"""
+    return "".join(list(value))
+
+
+def _ids(i: int):
+    series = i // FILES_PER_SERIES
+    study = series // SERIES_PER_STUDY
+    return (
+        f"/data/nas/dicom1/P{study:07d}/S{series:08d}/IM{i:010d}.dcm",
+        f"1.2.840.113619.2.55.3.{series:012d}",
+        f"1.2.840.113619.2.55.1.{study:012d}",
+        f"P{study:07d}",
+    )
+
+
+def build_info(i: int) -> DicomInfo:
+    path, series_uid, study_uid, patient_id = _ids(i)
+    return DicomInfo(
+        file_path=path,
+        patient_id=_fresh(patient_id),
+        patient_name=_fresh("ZHANG^SAN"),
+        patient_sex=_fresh("M"),
+        patient_birth_date=_fresh("19700101"),
+        study_instance_uid=_fresh(study_uid),
+        study_date=_fresh("20240101"),
+        series_instance_uid=_fresh(series_uid),
+        series_number=3,
+        series_description=_fresh("Chest 1.0 B31f"),
+        modality=_fresh("CT"),
+        protocol_name=_fresh("Thorax Routine"),
+        manufacturer=_fresh("SIEMENS"),
+        manufacturer_model=_fresh("SOMATOM Definition AS"),
+        slice_thickness=1.0,
+        ct_params={"slice_thickness": 1.0, "kvp": 120.0, "rotation_time": 0.5},
+        file_size=526336,
+        file_modified=_fresh("2024-01-01T08:00:00"),
+    )
+
+
+def build_record(i: int, interner: StringInterner) -> DicomRecord:
+    path, series_uid, study_uid, patient_id = _ids(i)
+    return DicomRecord(
+        file_path=path,
+        series_instance_uid=interner(_fresh(series_uid)),
+        study_instance_uid=interner(_fresh(study_uid)),
+        patient_id=interner(_fresh(patient_id)),
+        file_size=526336,
+    )
+
+
+def measure(name: str, factory, count: int) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    items = [factory(i) for i in range(count)]
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    gc.collect()
+    return {"name": name, "retained": current, "peak": peak, "seconds": elapsed}
+
+
+def measure_stream(name: str, interner: StringInterner, count: int) -> dict:
+    """流式扫描：记录产出后即丢弃，剩余内存即驻留表"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(count):
+        build_record(i, interner)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"name": name, "retained": current, "peak": peak, "seconds": elapsed, "entries": len(interner)}
+
+
+def measure_parse(directory: str, limit: int):
+    """真实文件：read_dicom 与 read_record 的单文件耗时"""
+    files = []
+    for path in DicomScanner.iter_dicom_files(directory):
+        files.append(path)
+        if len(files) >= limit:
+            break
+    if not files:
+        print(f"{directory} 下没有DICOM文件")
+        return
+
+    for name, reader in (("read_dicom", DicomScanner.read_dicom),
+                         ("read_record", DicomScanner.read_record)):
+        start = time.perf_counter()
+        for path in files:
+            reader(path)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<14}{len(files):>8} files{elapsed / len(files) * 1e6:>10.1f} us/file")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="单文件记录内存基准")
+    parser.add_argument("--files", type=int, default=1_000_000)
+    parser.add_argument("--dir", help="可选：真实DICOM目录，对比解析耗时")
+    parser.add_argument("--parse-limit", type=int, default=2000)
+    args = parser.parse_args()
+
+    interner = StringInterner()
+    results = [
+        measure("DicomInfo", build_info, args.files),
+        measure("DicomRecord", lambda i: build_record(i, interner), args.files),
+    ]
+
+    scale = 1_000_000 / args.files
+    print(f"{'record':<14}{'MB/1M retained':>16}{'MB/1M peak':>14}{'B/file':>10}{'seconds':>10}")
+    for r in results:
+        print(f"{r['name']:<14}{r['retained'] * scale / 2**20:>16.1f}{r['peak'] * scale / 2**20:>14.1f}"
+              f"{r['retained'] / args.files:>10.0f}{r['seconds']:>10.2f}")
+    base, compact = results
+    print(f"retained reduction: {1 - compact['retained'] / base['retained']:.1%}")
+
+    print(f"\n{'stream':<14}{'MB retained':>16}{'MB peak':>14}{'entries':>10}{'seconds':>10}")
+    for r in (measure_stream("unbounded", StringInterner(), args.files),
+              measure_stream("bounded", StringInterner(INTERNER_MAX_SIZE), args.files)):
+        print(f"{r['name']:<14}{r['retained'] / 2**20:>16.1f}{r['peak'] / 2**20:>14.1f}"
+              f"{r['entries']:>10}{r['seconds']:>10.2f}")
+
+    if args.dir:
+        measure_parse(args.dir, args.parse_limit)
+
+
+if __name__ == "__main__":
+    main()
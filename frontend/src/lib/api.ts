@@ -27,6 +27,13 @@ export interface Series {
   file_count?: number
   file_size_total?: number
   file_modified_date?: string
+  slice_count?: number
+  slice_spacing?: number
+  missing_slices?: number
+  duplicate_slices?: number
+  orientation_consistent?: boolean
+  missing_instance_numbers?: number
+  geometry_ok?: boolean
   created_at?: string
   is_active?: boolean
 }
@@ -39,6 +46,8 @@ export interface ScanConfig {
   schedule_type: string
   last_scan_at?: string
   filter_rules?: Record<string, any>
+  watch_enabled?: boolean
+  watch_quiet_seconds?: number
 }
 
 export interface Scan {
@@ -51,6 +60,30 @@ export interface Scan {
   series_new: number
   series_duplicated: number
   status: string
+  profile?: Record<string, any>
+}
+
+export interface Patient {
+  patient_id: string
+  patient_name?: string
+  patient_sex?: string
+  patient_birth_date?: string
+  study_count: number
+  series_count: number
+  file_size_total: number
+  modalities: string[]
+  first_study_date?: string
+  last_study_date?: string
+}
+
+export interface Study {
+  study_instance_uid: string
+  patient_id?: string
+  study_date?: string
+  series_count: number
+  file_count: number
+  file_size_total: number
+  modalities: string[]
 }
 
 export interface FilterRule {
@@ -73,6 +106,8 @@ export const seriesApi = {
 
   getById: (id: string) => api.get<Series>(`/series/${id}`),
 
+  thumbnailUrl: (id: string, size = 96) => `/api/series/${id}/thumbnail?size=${size}`,
+
   count: (params?: {
     patient_id?: string
     patient_name?: string
@@ -80,6 +115,20 @@ export const seriesApi = {
   }) => api.get<{ total: number }>('/series/count', { params }),
 }
 
+export const hierarchyApi = {
+  patients: (params?: {
+    page?: number
+    page_size?: number
+    patient_id?: string
+    patient_name?: string
+    modalities?: string
+  }) => api.get<Patient[]>('/patients', { params }),
+
+  patientStudies: (patientId: string) => api.get<Study[]>(`/patients/${patientId}/studies`),
+
+  studySeries: (studyUid: string) => api.get<Series[]>(`/studies/${studyUid}/series`),
+}
+
 export const configApi = {
   list: () => api.get<ScanConfig[]>('/configs'),
 
@@ -93,6 +142,10 @@ export const configApi = {
   update: (id: number, data: Partial<ScanConfig>) => api.put<ScanConfig>(`/configs/${id}`, data),
 
   delete: (id: number) => api.delete(`/configs/${id}`),
+
+  startWatch: (id: number) => api.post(`/configs/${id}/watch`),
+
+  stopWatch: (id: number) => api.delete(`/configs/${id}/watch`),
 }
 
 export const scanApi = {
@@ -100,6 +153,10 @@ export const scanApi = {
 
   list: (params?: { page?: number; page_size?: number }) =>
     api.get<Scan[]>('/scans', { params }),
+
+  getById: (id: string) => api.get<Scan>(`/scans/${id}`),
+
+  resume: (id: string) => api.post<Scan>(`/scans/${id}/resume`),
 }
 
 export const filterRuleApi = {
@@ -115,8 +172,8 @@ export const filterRuleApi = {
 }
 
 export const exportApi = {
-  export: (seriesIds: string[], targetDir: string) =>
-    api.post('/export', { series_ids: seriesIds, target_dir: targetDir }),
+  export: (seriesIds: string[], targetDir: string, anonymize?: Record<string, any>) =>
+    api.post('/export', { series_ids: seriesIds, target_dir: targetDir, anonymize }),
 }
 
 export const statsApi = {
@@ -57,15 +57,20 @@ export function SeriesPage() {
 
     const targetDir = prompt('请输入导出目录路径:', '/data/exports')
     if (!targetDir) return
+    const anonymize = confirm('是否匿名化导出？（去除患者信息并替换UID）')
 
     try {
       const res = await fetch('/api/export', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ series_ids: selected, target_dir: targetDir }),
+        body: JSON.stringify({
+          series_ids: selected,
+          target_dir: targetDir,
+          ...(anonymize ? { anonymize: {} } : {}),
+        }),
       })
       const data = await res.json()
-      alert(`导出完成！共导出 ${data.exported_count} 个序列到 ${data.target_dir}`)
+      alert(`${data.message}，导出到 ${data.target_dir}`)
     } catch (error) {
       alert('导出失败')
     }
@@ -140,6 +145,7 @@ export function SeriesPage() {
           <thead className="bg-gray-50">
             <tr>
               <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">选择</th>
+              <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">预览</th>
               <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">ID</th>
               <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">患者</th>
               <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">模态</th>
@@ -152,13 +158,13 @@ export function SeriesPage() {
           <tbody className="bg-white divide-y divide-gray-200">
             {loading ? (
               <tr>
-                <td colSpan={8} className="px-6 py-4 text-center text-gray-500">
+                <td colSpan={9} className="px-6 py-4 text-center text-gray-500">
                   加载中...
                 </td>
               </tr>
             ) : series.length === 0 ? (
               <tr>
-                <td colSpan={8} className="px-6 py-4 text-center text-gray-500">
+                <td colSpan={9} className="px-6 py-4 text-center text-gray-500">
                   暂无数据
                 </td>
               </tr>
@@ -181,6 +187,17 @@ export function SeriesPage() {
                       }}
                     />
                   </td>
+                  <td className="px-6 py-2">
+                    <img
+                      src={seriesApi.thumbnailUrl(s.id)}
+                      alt=""
+                      loading="lazy"
+                      className="w-12 h-12 object-contain bg-black rounded"
+                      onError={(e) => {
+                        e.currentTarget.style.visibility = 'hidden'
+                      }}
+                    />
+                  </td>
                   <td className="px-6 py-4 text-sm font-mono text-gray-900">{s.id}</td>
                   <td className="px-6 py-4 text-sm">
                     <div className="text-gray-900">{s.patient_name || '-'}</div>
@@ -193,7 +210,17 @@ export function SeriesPage() {
                   </td>
                   <td className="px-6 py-4 text-sm text-gray-600">{s.protocol_name || '-'}</td>
                   <td className="px-6 py-4 text-sm text-gray-600">{s.study_date || '-'}</td>
-                  <td className="px-6 py-4 text-sm text-gray-600">{s.file_count}</td>
+                  <td className="px-6 py-4 text-sm text-gray-600">
+                    {s.file_count}
+                    {s.geometry_ok === false && (
+                      <span
+                        className="ml-2 text-xs text-red-600"
+                        title={`缺层 ${s.missing_slices ?? 0}，重复层 ${s.duplicate_slices ?? 0}${s.orientation_consistent === false ? '，方向不一致' : ''}`}
+                      >
+                        不完整
+                      </span>
+                    )}
+                  </td>
                   <td className="px-6 py-4 text-sm text-gray-600">
                     <div className="text-xs">{s.manufacturer}</div>
                     <div className="text-xs text-gray-400">{s.manufacturer_model}</div>
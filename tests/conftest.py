@@ -0,0 +1,38 @@
+"""
+测试公共夹具
+导入app之前把数据库、暂存目录和缩略图缓存指向临时目录
+"""
+import os
+import tempfile
+
+_TMP = tempfile.mkdtemp(prefix="dicom-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_TMP}/test.db"
+os.environ["SCAN_STAGING_DIR"] = os.path.join(_TMP, "staging")
+os.environ["THUMBNAIL_DIR"] = os.path.join(_TMP, "thumbnails")
+os.environ["EXPORT_WORKERS"] = "1"
+
+import pytest  # noqa: E402
+
+from app.db.database import Base, SessionLocal, engine, init_db  # noqa: E402
+from app.db.models import ScanConfig  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """每个测试使用空数据库"""
+    Base.metadata.drop_all(bind=engine)
+    init_db()
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def make_config(db):
+    def make(scan_path: str) -> ScanConfig:
+        config = ScanConfig(scan_path=str(scan_path), schedule_type="manual")
+        db.add(config)
+        db.commit()
+        return config
+    return make
+
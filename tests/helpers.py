@@ -0,0 +1,58 @@
+"""测试用DICOM文件生成"""
+import os
+
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+
+def write_dicom(path, patient_id="P1", study_uid=None, series_uid=None, modality="CT",
+                instance_number=1, z=0.0, rows=4, **elements) -> Dataset:
+    """写一个带像素数据的CT图像，elements 为额外的DICOM关键字"""
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.2"
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.PatientID = patient_id
+    ds.PatientName = f"Name^{patient_id}"
+    ds.PatientSex = "M"
+    ds.PatientBirthDate = "19700101"
+    ds.StudyInstanceUID = study_uid or generate_uid()
+    ds.StudyDate = "20240101"
+    ds.SeriesInstanceUID = series_uid or generate_uid()
+    ds.SeriesNumber = 1
+    ds.Modality = modality
+    ds.InstanceNumber = instance_number
+    ds.ImagePositionPatient = [0.0, 0.0, float(z)]
+    ds.ImageOrientationPatient = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+    ds.Rows = rows
+    ds.Columns = rows
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 1
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.PixelData = (np.arange(rows * rows, dtype=np.int16) * instance_number).tobytes()
+    for keyword, value in elements.items():
+        setattr(ds, keyword, value)
+    os.makedirs(os.path.dirname(str(path)), exist_ok=True)
+    ds.save_as(str(path), enforce_file_format=True)
+    return ds
+
+
+def write_series(directory, count=3, spacing=2.0, **kwargs):
+    """在目录下写一个连续的序列，返回 (series_uid, 文件路径列表)"""
+    series_uid = kwargs.pop("series_uid", None) or generate_uid()
+    study_uid = kwargs.pop("study_uid", None) or generate_uid()
+    paths = []
+    for i in range(count):
+        path = os.path.join(str(directory), f"IM{i}.dcm")
+        write_dicom(path, study_uid=study_uid, series_uid=series_uid,
+                    instance_number=i + 1, z=i * spacing, **kwargs)
+        paths.append(path)
+    return series_uid, paths
@@ -0,0 +1,186 @@
+import json
+import os
+
+import pydicom
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+from pydicom.dataset import Dataset
+from pydicom.encaps import encapsulate
+from pydicom.uid import JPEGBaseline8Bit
+
+from app.db.models import Series
+from app.main import app
+from app.schemas.series import AnonymizeOptions
+from app.services import anonymizer as anonymizer_module
+from app.services.anonymizer import Anonymizer, AnonymizeError, _has_trailing_elements, anonymize_parallel
+from app.services.scan_service import ExportService, ScanService, generate_series_id
+from tests.helpers import write_dicom, write_series
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """记录 dcmread 是否读入了像素数据（整体重写）"""
+    calls = []
+    dcmread = pydicom.dcmread
+
+    def counting(*args, **kwargs):
+        calls.append(kwargs.get("stop_before_pixels", False))
+        return dcmread(*args, **kwargs)
+
+    monkeypatch.setattr(anonymizer_module.pydicom, "dcmread", counting)
+    return calls
+
+
+def _source(path, **elements):
+    icon = Dataset()
+    icon.Rows = 1
+    ref = Dataset()
+    ref.ReferencedSOPInstanceUID = "1.2.3.4"
+    ref.IconImageSequence = [icon]
+    ds = write_dicom(path, ReviewerName="Smith^John", StudyID="S123", OperatorsName="Op^A",
+                     ReferencedImageSequence=[ref], **elements)
+    ds.add_new(0x00090010, "LO", "ACME")
+    ds.add_new(0x00091001, "LO", "private")
+    ds.save_as(str(path), enforce_file_format=True)
+    return ds
+
+
+def _write(anonymizer, src, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    with open(src, "rb") as stream:
+        return anonymizer.write(stream, str(src), str(out_dir))
+
+
+def test_splice_rewrites_header_and_copies_pixels(tmp_path, reads):
+    src = tmp_path / "src.dcm"
+    original = _source(src)
+    anonymizer = Anonymizer(key="cohort")
+
+    dst = _write(anonymizer, src, tmp_path / "out")
+
+    assert reads == [True]  # 只读头部，像素数据拼接
+    out = pydicom.dcmread(dst)
+    assert out.PixelData == original.PixelData
+    assert out.PatientName == anonymizer.hash("Name^P1")
+    assert out.PatientID == anonymizer.hash("P1")
+    assert out.ReviewerName == "" and out.StudyID == ""
+    assert "OperatorsName" not in out and "PatientBirthDate" in out and out.PatientBirthDate == ""
+    assert not any(elem.tag.is_private for elem in out)
+    assert "IconImageSequence" not in out.ReferencedImageSequence[0]
+    assert out.ReferencedImageSequence[0].ReferencedSOPInstanceUID == anonymizer.uid("1.2.3.4")
+    assert out.SOPInstanceUID == anonymizer.uid(original.SOPInstanceUID)
+    assert out.file_meta.MediaStorageSOPInstanceUID == out.SOPInstanceUID
+
+
+def test_elements_after_pixel_data_force_rewrite(tmp_path, reads):
+    src = tmp_path / "src.dcm"
+    ds = _source(src)
+    ds.add_new(0x7FE10010, "LO", "SIEMENS CSA NON-IMAGE")
+    ds.add_new(0x7FE11010, "OB", b"secret-trailer")
+    ds.save_as(str(src), enforce_file_format=True)
+
+    dst = _write(Anonymizer(key="cohort"), src, tmp_path / "out")
+
+    assert reads == [True, False]
+    assert b"secret-trailer" not in open(dst, "rb").read()
+    assert pydicom.dcmread(dst).PixelData == ds.PixelData
+
+
+@pytest.mark.parametrize("trailing", [False, True])
+def test_has_trailing_elements_with_encapsulated_pixels(tmp_path, trailing):
+    path = str(tmp_path / "jpeg.dcm")
+    ds = write_dicom(path)
+    ds.file_meta.TransferSyntaxUID = JPEGBaseline8Bit
+    ds.PixelData = encapsulate([b"\xff\xd8frame1\xff\xd9", b"\xff\xd8frame2\xff\xd9"])
+    if trailing:
+        ds.add_new(0x7FE10010, "LO", "SIEMENS")
+    ds.save_as(path, enforce_file_format=True)
+
+    with open(path, "rb") as stream:
+        header = pydicom.dcmread(stream, stop_before_pixels=True)
+        assert _has_trailing_elements(stream, stream.tell(), *header.original_encoding) is trailing
+
+
+def test_uids_consistent_for_same_cohort_key(tmp_path):
+    src = tmp_path / "src.dcm"
+    _source(src)
+
+    first = pydicom.dcmread(_write(Anonymizer(key="cohort"), src, tmp_path / "a"))
+    second = pydicom.dcmread(_write(Anonymizer(key="cohort"), src, tmp_path / "b"))
+    other = pydicom.dcmread(_write(Anonymizer(key="other"), src, tmp_path / "c"))
+
+    assert os.listdir(tmp_path / "a") == os.listdir(tmp_path / "b") != os.listdir(tmp_path / "c")
+    for keyword in ("StudyInstanceUID", "SeriesInstanceUID", "SOPInstanceUID", "PatientID"):
+        assert first[keyword].value == second[keyword].value != other[keyword].value
+    assert first.StudyInstanceUID.startswith("2.25.")
+    assert Anonymizer(key="cohort").key_id == Anonymizer(key="cohort").key_id
+    assert Anonymizer().key_id is None
+
+
+def test_invalid_actions_rejected():
+    with pytest.raises(AnonymizeError):
+        Anonymizer(actions={"PatientNmae": "remove"})
+    with pytest.raises(AnonymizeError):
+        Anonymizer(actions={"PatientName": "scramble"})
+
+
+def test_failed_write_leaves_no_temp_file(tmp_path, monkeypatch):
+    src = tmp_path / "src.dcm"
+    _source(src)
+
+    def broken(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(anonymizer_module.pydicom, "dcmwrite", broken)
+    with pytest.raises(OSError):
+        _write(Anonymizer(key="cohort"), src, tmp_path / "out")
+    assert os.listdir(tmp_path / "out") == []
+
+
+def test_anonymized_export_writes_pseudonymous_meta(db, tmp_path, make_config):
+    series_uid, paths = write_series(tmp_path / "root", count=3, patient_id="SECRET01")
+    ScanService(db).run_scan(make_config(tmp_path / "root").id)
+    series = db.query(Series).one()
+    anonymizer = Anonymizer(key="cohort")
+
+    result = ExportService(db).export_series([series.id], str(tmp_path / "out"), anonymizer, workers=1)
+
+    assert result["success"] and result["exported_count"] == 1
+    folder = tmp_path / "out" / generate_series_id(anonymizer.uid(series_uid))
+    assert sorted(os.listdir(folder)) == sorted(
+        [f"{anonymizer.uid(pydicom.dcmread(p).SOPInstanceUID)}.dcm" for p in paths] + ["meta.json"]
+    )
+    text = (folder / "meta.json").read_text(encoding="utf-8")
+    meta = json.loads(text)
+    assert "SECRET01" not in text and series_uid not in text and "patient_name" not in meta
+    assert meta["patient_id"] == anonymizer.hash("SECRET01")
+    assert meta["series_instance_uid"] == anonymizer.uid(series_uid)
+    assert meta["study_instance_uid"] == anonymizer.uid(series.study_instance_uid)
+    assert meta["anonymization_key_id"] == anonymizer.key_id
+    assert meta["file_count"] == 3
+
+
+def test_requested_workers_are_bounded(tmp_path, monkeypatch):
+    with pytest.raises(ValidationError):
+        AnonymizeOptions(workers=10000)
+    with pytest.raises(ValidationError):
+        AnonymizeOptions(workers=0)
+    response = TestClient(app).post("/api/export", json={
+        "series_ids": [], "target_dir": str(tmp_path), "anonymize": {"workers": 10000},
+    })
+    assert response.status_code == 422
+
+    sizes = []
+
+    class Pool:
+        def __init__(self, max_workers, mp_context):
+            sizes.append(max_workers)
+            raise RuntimeError("stop")
+
+    monkeypatch.setattr(anonymizer_module, "ProcessPoolExecutor", Pool)
+    monkeypatch.setattr(anonymizer_module.os, "cpu_count", lambda: 2)
+    files = [(f"/src/{i}.dcm", "/dst") for i in range(anonymizer_module.FILES_PER_TASK * 8)]
+    with pytest.raises(RuntimeError):
+        anonymize_parallel(Anonymizer(), files, [], workers=64)
+    assert sizes == [2]
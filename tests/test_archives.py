@@ -0,0 +1,76 @@
+import os
+import tarfile
+import zipfile
+
+from app.db.models import Series
+from app.services import archives
+from app.services.scan_service import ExportService, ScanService
+from app.services.scanner import DicomScanner
+from tests.helpers import write_series
+
+
+def _zip(path, files):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, src in files.items():
+            archive.write(src, name)
+
+
+def test_scan_enumerates_zip_and_tar_members(db, tmp_path, make_config):
+    uid_zip, zip_files = write_series(tmp_path / "src" / "a", count=3)
+    uid_tar, tar_files = write_series(tmp_path / "src" / "b", count=2)
+    root = tmp_path / "root"
+    root.mkdir()
+    _zip(root / "a.zip", {f"S1/{os.path.basename(f)}": f for f in zip_files})
+    with tarfile.open(root / "b.tar.gz", "w:gz") as archive:
+        for f in tar_files:
+            archive.add(f, f"S2/{os.path.basename(f)}")
+
+    entries = sorted(DicomScanner.iter_archive_entries(str(root / "a.zip")), key=lambda e: e[1])
+    assert [entry[1] for entry in entries] == [
+        archives.member_path(str(root / "a.zip"), f"S1/IM{i}.dcm") for i in range(3)
+    ]
+    assert entries[0][3].instance_number == 1
+
+    scan = ScanService(db).run_scan(make_config(root).id)
+    assert scan.status == "completed" and scan.series_new == 2
+    series = {s.series_instance_uid: s for s in db.query(Series)}
+    assert series[uid_zip].file_count == 3 and series[uid_tar].file_count == 2
+    assert archives.split_member_path(series[uid_tar].file_path) == (str(root / "b.tar.gz"), "S2/IM0.dcm")
+
+
+def test_extract_members_keeps_relative_paths(tmp_path):
+    _, files = write_series(tmp_path / "src", count=2)
+    archive_path = str(tmp_path / "a.zip")
+    _zip(archive_path, {"S1/IM0.dcm": files[0], "S2/IM0.dcm": files[1], "../../evil.dcm": files[0]})
+    target = tmp_path / "out"
+    target.mkdir()
+
+    extracted, missing = archives.extract_members(
+        archive_path, ["S1/IM0.dcm", "S2/IM0.dcm", "../../evil.dcm", "gone.dcm"], str(target)
+    )
+
+    assert extracted == 3
+    assert missing == [archives.member_path(archive_path, "gone.dcm")]
+    assert (target / "S1" / "IM0.dcm").read_bytes() == open(files[0], "rb").read()
+    assert (target / "S2" / "IM0.dcm").read_bytes() == open(files[1], "rb").read()
+    assert (target / "evil.dcm").exists() and not (tmp_path.parent / "evil.dcm").exists()
+
+
+def test_safe_member_name():
+    assert archives.safe_member_name("/abs/./x/../IM1") == os.path.join("abs", "x", "IM1")
+    assert archives.safe_member_name("C:\\data\\IM1") == os.path.join("data", "IM1")
+    assert archives.safe_member_name("../..") == ""
+
+
+def test_export_archive_series(db, tmp_path, make_config):
+    uid, files = write_series(tmp_path / "src", count=2)
+    root = tmp_path / "root"
+    root.mkdir()
+    _zip(root / "a.zip", {f"A/{os.path.basename(f)}": f for f in files})
+    ScanService(db).run_scan(make_config(root).id)
+    series = db.query(Series).filter(Series.series_instance_uid == uid).one()
+
+    result = ExportService(db).export_series([series.id], str(tmp_path / "out"))
+
+    assert result["exported_count"] == 1
+    assert sorted(os.listdir(tmp_path / "out" / series.id / "A")) == ["IM0.dcm", "IM1.dcm"]
@@ -0,0 +1,87 @@
+import csv
+import io
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from app.db.models import Series
+from app.services.catalog_export import EXPORT_COLUMNS, export_catalog, series_filters
+from app.services.scan_service import ScanService
+from tests.helpers import write_series
+
+
+@pytest.fixture
+def catalog(db, tmp_path, make_config):
+    """CT序列3个实例、MR序列2个实例（有缺层）"""
+    root = tmp_path / "root"
+    write_series(root / "ct", count=3, patient_id="P1", KVP=120)
+    write_series(root / "mr", count=2, spacing=5.0, patient_id="P2", modality="MR", RepetitionTime=500)
+    ScanService(db).run_scan(make_config(root).id)
+    return {series.id: series for series in db.query(Series)}
+
+
+def _export(db, fmt, chunk_size=1, **filters):
+    return b"".join(export_catalog(db, fmt, series_filters(**filters), include_paths=True,
+                                   chunk_size=chunk_size))
+
+
+def _read(fmt, data):
+    """解析导出结果，嵌套字段统一还原为Python对象"""
+    if fmt == "ndjson":
+        return [json.loads(line) for line in data.decode("utf-8").splitlines()]
+    if fmt == "csv":
+        rows = list(csv.DictReader(io.StringIO(data.decode("utf-8"))))
+        assert list(rows[0]) == EXPORT_COLUMNS + ["instance_paths"]
+        for row in rows:
+            row["instance_paths"] = json.loads(row["instance_paths"])
+            row["file_count"] = int(row["file_count"])
+            row["geometry_ok"] = row["geometry_ok"] == "True"
+        return _decode_params(rows)
+    if fmt == "parquet":
+        table = pq.read_table(io.BytesIO(data))
+    else:
+        table = pa.ipc.open_stream(io.BytesIO(data)).read_all()
+    assert table.schema.field("instance_paths").type == pa.list_(pa.string())
+    return _decode_params(table.to_pylist())
+
+
+def _decode_params(rows):
+    for row in rows:
+        for name in ("ct_params", "mr_params", "dx_params"):
+            row[name] = json.loads(row[name]) if row[name] else None
+    return rows
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "csv", "parquet", "arrow"])
+def test_round_trip(db, catalog, fmt):
+    rows = {row["id"]: row for row in _read(fmt, _export(db, fmt))}
+
+    assert set(rows) == set(catalog)
+    for series_id, series in catalog.items():
+        row = rows[series_id]
+        assert row["series_instance_uid"] == series.series_instance_uid
+        assert row["file_count"] == series.file_count
+        assert row["geometry_ok"] is series.geometry_ok
+        assert row["instance_paths"][0] == series.file_path and len(row["instance_paths"]) == series.file_count
+        assert row["ct_params"] == (json.loads(series.ct_params) if series.ct_params else None)
+        assert row["mr_params"] == (json.loads(series.mr_params) if series.mr_params else None)
+    ct = next(row for row in rows.values() if row["modality"] == "CT")
+    assert ct["ct_params"]["kvp"] == 120
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "csv", "parquet", "arrow"])
+def test_filters_apply_to_every_format(db, catalog, fmt):
+    rows = _read(fmt, _export(db, fmt, chunk_size=1000, modality="MR"))
+    assert [row["modality"] for row in rows] == ["MR"]
+
+
+def test_nested_fields_differ_only_in_encoding(db, catalog):
+    ndjson = {row["id"]: row for row in _read("ndjson", _export(db, "ndjson"))}
+    csv_rows = list(csv.DictReader(io.StringIO(_export(db, "csv").decode("utf-8"))))
+    for row in csv_rows:
+        # CSV/Parquet/Arrow中为JSON文本，NDJSON中为对象
+        if row["ct_params"]:
+            assert json.loads(row["ct_params"]) == ndjson[row["id"]]["ct_params"]
+        assert json.loads(row["instance_paths"]) == ndjson[row["id"]]["instance_paths"]
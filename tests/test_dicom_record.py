@@ -0,0 +1,54 @@
+import pydicom
+import pytest
+
+from app.services.scanner import DicomRecord, DicomScanner, StringInterner
+from tests.helpers import write_series
+
+
+def test_interner_shares_equal_strings():
+    intern = StringInterner()
+    first = intern("".join(["1.2.", "840"]))
+    second = intern("".join(["1.2.8", "40"]))
+    assert first is second and len(intern) == 1
+
+
+def test_bounded_interner_clears_when_full():
+    intern = StringInterner(max_size=3)
+    for value in ("a", "b", "c"):
+        intern(value)
+    assert len(intern) == 3
+    # 超过上限时清空重建，只保留最近的值
+    intern("d")
+    assert len(intern) == 1
+    recent = intern("".join(["d"]))
+    assert recent == "d" and len(intern) == 1
+
+
+def test_record_has_no_instance_dict():
+    record = DicomRecord("/a.dcm", "1.2", "1.1", "P1", 10)
+    assert not hasattr(record, "__dict__")
+    with pytest.raises(AttributeError):
+        record.patient_name = "x"
+
+
+def test_records_of_one_series_share_uid_strings(tmp_path):
+    series_uid, paths = write_series(tmp_path / "S", count=3, patient_id="P1")
+    intern = StringInterner()
+    records = [DicomScanner.read_record(str(path), interner=intern) for path in paths]
+
+    assert {record.series_instance_uid for record in records} == {series_uid}
+    assert all(record.series_instance_uid is records[0].series_instance_uid for record in records)
+    assert all(record.study_instance_uid is records[0].study_instance_uid for record in records)
+    assert all(record.patient_id is records[0].patient_id for record in records)
+    assert records[0].file_size == (tmp_path / "S" / "IM0.dcm").stat().st_size
+
+
+def test_record_matches_full_read(tmp_path):
+    _, paths = write_series(tmp_path / "S", count=2, patient_id="P7")
+    record = DicomScanner.read_record(str(paths[1]))
+    ds = pydicom.dcmread(str(paths[1]))
+
+    assert (record.series_instance_uid, record.study_instance_uid, record.patient_id) == (
+        ds.SeriesInstanceUID, ds.StudyInstanceUID, ds.PatientID)
+    assert record.geometry.instance_number == ds.InstanceNumber
+    assert record.geometry.position == tuple(float(v) for v in ds.ImagePositionPatient)
@@ -0,0 +1,109 @@
+import os
+import shutil
+
+import pydicom
+import pytest
+from pydicom.fileset import FileSet
+
+from app.db.models import Series
+from app.services.scan_profile import ScanProfile
+from app.services.scan_service import ScanService
+from app.services.scanner import DicomScanner
+from tests.helpers import write_dicom, write_series
+
+FILESET_ELEMENTS = {"StudyTime": "120000", "StudyID": "1", "AccessionNumber": ""}
+
+
+@pytest.fixture
+def media(tmp_path):
+    """按DICOMDIR组织的光盘目录：两个序列共5个实例"""
+    uids = {}
+    fileset = FileSet()
+    for name, count in (("A", 3), ("B", 2)):
+        uid, paths = write_series(tmp_path / "src" / name, count=count, patient_id=f"P{name}",
+                                  **FILESET_ELEMENTS)
+        uids[uid] = count
+        for path in paths:
+            fileset.add(pydicom.dcmread(path))
+    root = tmp_path / "media"
+    fileset.write(str(root))
+    (root / "AUTORUN.INF").write_text("x")
+    return root, uids
+
+
+def _enumerate(root):
+    profile = ScanProfile()
+    entries = [entry for _, dir_entries in DicomScanner.iter_series_dirs(str(root), profile)
+               for entry in dir_entries]
+    counts = {}
+    for series_uid, *_ in entries:
+        counts[series_uid] = counts.get(series_uid, 0) + 1
+    return counts, entries, profile
+
+
+def _image_files(root):
+    return sorted(os.path.join(dirpath, name) for dirpath, _, names in os.walk(root)
+                  for name in names if name.startswith("IM"))
+
+
+def test_dicomdir_enumerates_without_opening_every_file(media):
+    root, uids = media
+
+    counts, entries, profile = _enumerate(root)
+
+    assert counts == uids
+    assert profile.files_indexed == 5
+    assert profile.files_parsed == 2  # 每个序列只解析代表文件
+    assert profile.non_dicom_skipped == 1
+    # DICOMDIR记录中的实例编号作为几何信息
+    assert sorted(entry[3].instance_number for entry in entries) == [1, 1, 2, 2, 3]
+
+
+def test_unreferenced_dicom_file_is_parsed(media):
+    root, uids = media
+    extra = write_dicom(os.path.dirname(_image_files(root)[0]) + "/EXTRA")
+
+    counts, _, profile = _enumerate(root)
+
+    assert counts == {**uids, extra.SeriesInstanceUID: 1}
+    assert (profile.files_indexed, profile.files_parsed) == (5, 3)
+
+
+@pytest.mark.parametrize("damage", ["missing", "mismatch"])
+def test_stale_dicomdir_falls_back_to_walk(media, tmp_path, damage):
+    root, _ = media
+    images = _image_files(root)
+    if damage == "missing":
+        os.remove(images[-1])
+    else:
+        # 代表文件被替换为其他序列的文件
+        write_dicom(tmp_path / "other.dcm")
+        shutil.copy(tmp_path / "other.dcm", images[0])
+
+    counts, _, profile = _enumerate(root)
+
+    assert profile.files_indexed == 0
+    assert sum(counts.values()) == (4 if damage == "missing" else 5)
+    assert len(counts) == (2 if damage == "missing" else 3)
+
+
+def test_lowercase_mount_still_uses_index(media):
+    root, uids = media
+    for name in os.listdir(root):
+        if name != "DICOMDIR":
+            os.rename(root / name, root / name.lower())
+
+    counts, _, profile = _enumerate(root)
+
+    assert counts == uids and profile.files_indexed == 5
+
+
+def test_scan_catalogs_media(db, media, make_config):
+    root, uids = media
+
+    scan = ScanService(db).run_scan(make_config(root).id)
+
+    assert scan.status == "completed" and scan.series_new == 2
+    assert {s.series_instance_uid: s.file_count for s in db.query(Series)} == uids
+    # 未打开的文件只有DICOMDIR中的实例编号
+    assert all(s.missing_instance_numbers == 0 for s in db.query(Series))
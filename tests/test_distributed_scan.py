@@ -0,0 +1,194 @@
+import threading
+import time
+
+import pytest
+
+from app.db.database import SessionLocal
+from app.db.models import Scan, ScanWorkResult, ScanWorkUnit, Series
+from app.services import distributed_scan
+from app.services.distributed_scan import DistributedScanService, ScanWorker
+from app.services.scan_service import ScanService
+from app.services.scanner import DicomScanner
+from tests.helpers import write_series
+
+EXPIRED = "2000-01-01T00:00:00+00:00"
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """root/A 与 root/A/B 各一个序列"""
+    root = tmp_path / "root"
+    uid_a, _ = write_series(root / "A", patient_id="PA")
+    uid_b, _ = write_series(root / "A" / "B", patient_id="PB")
+    return root, {uid_a, uid_b}
+
+
+def _process_all(db, worker):
+    while True:
+        unit = worker.lease_unit(db)
+        if unit is None:
+            return
+        worker.process_unit(db, unit)
+
+
+def _expire_leases(db):
+    db.query(ScanWorkUnit).filter(ScanWorkUnit.status == "leased").update(
+        {ScanWorkUnit.lease_expires_at: EXPIRED}, synchronize_session=False
+    )
+    db.commit()
+
+
+def test_workers_scan_tree_and_finalize(db, tree, make_config):
+    root, uids = tree
+    scan = DistributedScanService(db).create_scan(make_config(root).id)
+
+    assert ScanWorker(worker_id="w1").run() == 3
+
+    db.expire_all()
+    assert scan.status == "completed"
+    assert (scan.series_found, scan.series_new) == (2, 2)
+    assert scan.lease_owner is None and scan.checkpoint is None
+    assert {uid for (uid,) in db.query(Series.series_instance_uid)} == uids
+    assert db.query(ScanWorkResult).count() == 0
+
+
+def test_lease_uses_utc_and_expired_lease_is_taken_over(db, tree, make_config):
+    root, _ = tree
+    DistributedScanService(db).create_scan(make_config(root).id)
+    first, second = ScanWorker(worker_id="w1"), ScanWorker(worker_id="w2")
+
+    unit = first.lease_unit(db)
+    assert unit.lease_owner == "w1" and unit.lease_expires_at.endswith("+00:00")
+    assert second.lease_unit(db) is None
+
+    # w1 失联，租约过期后由 w2 接手
+    _expire_leases(db)
+    taken = second.lease_unit(db)
+    assert (taken.id, taken.lease_owner, taken.attempts) == (unit.id, "w2", 2)
+    assert first.process_unit(db, taken) is False
+    assert second.process_unit(db, taken) is True
+
+
+def test_unit_fails_after_repeated_expiry(db, tree, make_config):
+    root, _ = tree
+    DistributedScanService(db).create_scan(make_config(root).id)
+    worker = ScanWorker(worker_id="w1")
+
+    for _ in range(distributed_scan.MAX_ATTEMPTS):
+        assert worker.lease_unit(db) is not None
+        _expire_leases(db)
+
+    assert worker.lease_unit(db) is None
+    unit = db.query(ScanWorkUnit).one()
+    assert unit.status == "failed" and unit.error == "租约多次过期"
+
+
+def test_lease_renewed_while_listing_is_slow(db, tmp_path, make_config, monkeypatch):
+    root = tmp_path / "root"
+    write_series(root)
+    DistributedScanService(db).create_scan(make_config(root).id)
+    worker, other = ScanWorker(worker_id="w1", lease_seconds=1), ScanWorker(worker_id="w2", lease_seconds=1)
+
+    list_directory = ScanWorker._list_directory
+
+    def slow(dir_path):
+        time.sleep(1.5)
+        return list_directory(dir_path)
+
+    monkeypatch.setattr(ScanWorker, "_list_directory", staticmethod(slow))
+    unit_id = worker.lease_unit(db).id
+    result = {}
+
+    def run():
+        session = SessionLocal()
+        try:
+            result["ok"] = worker.process_unit(session, session.get(ScanWorkUnit, unit_id))
+        finally:
+            session.close()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    time.sleep(1.2)
+    assert other.lease_unit(db) is None
+    thread.join()
+    assert result["ok"] is True
+
+
+def test_failed_unit_keeps_subtree_and_results_until_retry(db, tree, make_config, monkeypatch):
+    root, uids = tree
+    scan = DistributedScanService(db).create_scan(make_config(root).id)
+    iter_dir_entries = DicomScanner.iter_dir_entries
+
+    def broken(dir_path, *args, **kwargs):
+        if dir_path.endswith("A"):
+            raise OSError("I/O error")
+        return iter_dir_entries(dir_path, *args, **kwargs)
+
+    monkeypatch.setattr(DicomScanner, "iter_dir_entries", staticmethod(broken))
+    ScanWorker(worker_id="w1").run()
+
+    db.expire_all()
+    assert scan.status == "failed"
+    units = {unit.dir_path: unit.status for unit in db.query(ScanWorkUnit)}
+    assert units[str(root / "A")] == "failed"
+    assert units[str(root / "A" / "B")] == "done"
+    assert db.query(ScanWorkResult).count() == 3
+    assert db.query(Series).count() == 0
+
+    monkeypatch.undo()
+    assert ScanService(db).resume_scan(scan.id).status == "running"
+    ScanWorker(worker_id="w1").run()
+
+    db.expire_all()
+    assert scan.status == "completed"
+    assert {uid for (uid,) in db.query(Series.series_instance_uid)} == uids
+    assert db.query(ScanWorkResult).count() == 0
+
+
+def test_finalize_is_leased(db, tree, make_config):
+    root, _ = tree
+    scan = DistributedScanService(db).create_scan(make_config(root).id)
+    _process_all(db, ScanWorker(worker_id="w1"))
+
+    db.query(Scan).filter(Scan.id == scan.id).update({
+        Scan.status: "finalizing",
+        Scan.lease_owner: "w0",
+        Scan.lease_expires_at: distributed_scan._lease_deadline(60),
+    })
+    db.commit()
+    assert DistributedScanService(db).finalize(scan.id, "w1") is None
+
+    db.query(Scan).filter(Scan.id == scan.id).update({Scan.lease_expires_at: EXPIRED})
+    db.commit()
+    assert DistributedScanService(db).finalize(scan.id, "w1").status == "completed"
+
+
+def test_crashed_finalize_resumes_from_checkpoint(db, tree, make_config, monkeypatch):
+    root, uids = tree
+    scan = DistributedScanService(db).create_scan(make_config(root).id)
+    _process_all(db, ScanWorker(worker_id="w1"))
+
+    persist_batch = ScanService._persist_batch
+
+    def crash_after_first(self, batch, scan_id, samples):
+        if db.query(Series).count():
+            raise KeyboardInterrupt
+        return persist_batch(self, batch, scan_id, samples)
+
+    monkeypatch.setattr(ScanService, "COMMIT_BATCH_SIZE", 1)
+    monkeypatch.setattr(ScanService, "_persist_batch", crash_after_first)
+    with pytest.raises(KeyboardInterrupt):
+        DistributedScanService(db).finalize(scan.id, "w1")
+    db.rollback()
+    monkeypatch.undo()
+
+    db.expire_all()
+    assert scan.status == "finalizing" and db.query(Series).count() == 1
+    assert DistributedScanService(db).finalize(scan.id, "w2") is None
+
+    db.query(Scan).filter(Scan.id == scan.id).update({Scan.lease_expires_at: EXPIRED})
+    db.commit()
+    finished = DistributedScanService(db).finalize(scan.id, "w2")
+    assert finished.status == "completed"
+    assert (finished.series_found, finished.series_new, finished.series_duplicated) == (2, 2, 0)
+    assert {uid for (uid,) in db.query(Series.series_instance_uid)} == uids
@@ -0,0 +1,77 @@
+from fastapi.testclient import TestClient
+from pydicom.uid import generate_uid
+
+from app.db.models import Patient, Study
+from app.main import app
+from app.services.hierarchy_service import HierarchyService, split_modalities
+from app.services.scan_service import ScanService
+from app.services.scanner import DicomScanner
+from tests.helpers import write_dicom, write_series
+
+
+def _snapshot(db):
+    db.expire_all()
+    studies = {
+        s.study_instance_uid: (s.patient_id, s.study_date, s.series_count, s.file_count, s.file_size_total,
+                               sorted(split_modalities(s.modalities)))
+        for s in db.query(Study)
+    }
+    patients = {
+        p.patient_id: (p.patient_name, p.patient_sex, p.patient_birth_date, p.study_count, p.series_count,
+                       p.file_size_total, sorted(split_modalities(p.modalities)),
+                       p.first_study_date, p.last_study_date)
+        for p in db.query(Patient)
+    }
+    return studies, patients
+
+
+def test_incremental_matches_rebuild(db, tmp_path, make_config):
+    root = tmp_path / "root"
+    shared, other = generate_uid(), generate_uid()
+    # 同一检查中两个PatientID（如合并前的重复建档），先入库的不是最小的
+    write_series(root / "a", count=2, patient_id="P2", study_uid=shared, StudyDate="20240105")
+    write_series(root / "b", count=3, patient_id="P1", study_uid=shared, modality="MR",
+                 StudyDate="20240101", PatientName="Alias^P1")
+    write_series(root / "c", count=1, patient_id="P1", study_uid=other, StudyDate="20230101")
+    write_series(root / "d", count=1, patient_id="P3", StudyDate="")
+
+    ScanService(db).run_scan(make_config(root).id)
+    incremental = _snapshot(db)
+
+    studies, patients = incremental
+    assert studies[shared][:3] == ("P1", "20240101", 2)
+    assert patients["P2"][3:5] == (1, 1) and patients["P1"][3:5] == (2, 2)
+    assert patients["P1"][0] == "Alias^P1"
+
+    HierarchyService(db).rebuild()
+    assert _snapshot(db) == incremental
+
+    # 追加实例后仍一致
+    extra = str(tmp_path / "late" / "IM9.dcm")
+    write_dicom(extra, patient_id="P2", study_uid=shared, series_uid=_series_uid(root / "a"),
+                instance_number=9, z=18.0, StudyDate="20240105")
+    record = DicomScanner.read_record(extra)
+    ScanService(db).ingest_files(record.series_instance_uid, [extra], "scan", [record.file_size],
+                                 [record.geometry])
+    appended = _snapshot(db)
+    HierarchyService(db).rebuild()
+    assert _snapshot(db) == appended
+
+
+def test_patient_studies_match_study_count(db, tmp_path, make_config):
+    root = tmp_path / "root"
+    shared = generate_uid()
+    write_series(root / "a", count=1, patient_id="P2", study_uid=shared)
+    write_series(root / "b", count=1, patient_id="P1", study_uid=shared)
+    ScanService(db).run_scan(make_config(root).id)
+    client = TestClient(app)
+
+    for patient_id in ("P1", "P2"):
+        patient = client.get(f"/api/patients/{patient_id}").json()
+        studies = client.get(f"/api/patients/{patient_id}/studies").json()
+        assert patient["study_count"] == len(studies) == 1
+        assert studies[0]["study_instance_uid"] == shared
+
+
+def _series_uid(directory):
+    return DicomScanner.read_record(str(directory / "IM0.dcm")).series_instance_uid
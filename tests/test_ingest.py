@@ -0,0 +1,36 @@
+import shutil
+
+import pytest
+
+from app.db.models import Patient, Series, SeriesPath, Study
+from app.services.scan_service import ScanService
+from tests.helpers import write_series
+
+
+def _summary(db):
+    series = db.query(Series).one()
+    study = db.get(Study, series.study_instance_uid)
+    return (series.file_count, series.file_size_total, series.slice_count, series.duplicate_slices,
+            series.geometry_ok, study.file_count)
+
+
+@pytest.mark.parametrize("out_of_core", [False, True])
+def test_copies_in_one_root_match_copies_across_roots(db, tmp_path, make_config, out_of_core):
+    _, paths = write_series(tmp_path / "r1" / "a", count=5)
+    shutil.copytree(tmp_path / "r1" / "a", tmp_path / "r1" / "backup")
+    shutil.copytree(tmp_path / "r1" / "a", tmp_path / "r2" / "a")
+    size = sum((tmp_path / "r1" / "a" / name).stat().st_size for name in map(str, paths))
+
+    # 同一根目录下的两份
+    ScanService(db).run_scan(make_config(tmp_path / "r1").id, out_of_core=out_of_core)
+    assert _summary(db) == (5, size, 5, 0, True, 5)
+    assert db.query(SeriesPath).count() == 9  # 副本只记录路径
+
+    # 分两个根目录扫描得到相同结果
+    for model in (SeriesPath, Series, Study, Patient):
+        db.query(model).delete()
+    db.commit()
+    ScanService(db).run_scan(make_config(tmp_path / "r1" / "a").id, out_of_core=out_of_core)
+    ScanService(db).run_scan(make_config(tmp_path / "r2").id, out_of_core=out_of_core)
+    assert _summary(db) == (5, size, 5, 0, True, 5)
+    assert db.query(SeriesPath).count() == 9
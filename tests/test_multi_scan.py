@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from app.db.database import SessionLocal
+from app.db.models import Scan, Series
+from app.services import mounts, multi_scan
+from app.services.multi_scan import MultiRootScanner, mount_key
+from tests.helpers import write_series
+
+MOUNTS = [
+    ("/dev/sda1", "/", "ext4"),
+    ("/dev/sdb1", "/data", "xfs"),
+    ("nas1:/export/ct", "/mnt/ct", "nfs4"),
+    ("nas1:/export/mr", "/mnt/mr", "nfs"),
+    ("nas2:/export", "/mnt/nas2", "nfs"),
+    ("//pacs/images", "/mnt/pacs", "cifs"),
+    ("//PACS/archive", "/mnt/pacs-archive", "cifs"),
+    ("tmpfs", "/mnt/tmp", "tmpfs"),
+]
+
+
+def test_mount_key_groups_network_mounts_by_host(monkeypatch):
+    monkeypatch.setattr(mounts, "_read_mounts", lambda: MOUNTS)
+
+    # 同一NAS的多个导出/共享归为一组
+    assert mount_key("/mnt/ct/2024") == mount_key("/mnt/mr") == "nas1"
+    assert mount_key("/mnt/nas2/a") == "nas2"
+    assert mount_key("/mnt/pacs/a") == "pacs"
+    assert mount_key("/mnt/pacs-archive") == "PACS"  # 主机名按原样比较
+    # 本地文件系统按设备，最长挂载点优先
+    assert mount_key("/data/a") == "/dev/sdb1"
+    assert mount_key("/home") == "/dev/sda1"
+    assert mount_key("/mnt/tmp/x") == "tmpfs"
+
+
+def test_mount_key_without_mount_table(monkeypatch):
+    monkeypatch.setattr(mounts, "_read_mounts", lambda: [])
+    assert mount_key("/data/a") == "/"
+
+
+@pytest.fixture
+def tracked_scans(monkeypatch):
+    """替换单个扫描：记录每个设备及全局的最大并发数"""
+    lock = threading.Lock()
+    active, peak = Counter(), Counter()
+    order = []
+
+    def fake_scan_one(scan_id, out_of_core):
+        db = SessionLocal()
+        try:
+            key = multi_scan.mount_key(db.get(Scan, scan_id).scan_path)
+        finally:
+            db.close()
+        with lock:
+            active[key] += 1
+            active["*"] += 1
+            order.append(key)
+            for name in (key, "*"):
+                peak[name] = max(peak[name], active[name])
+        time.sleep(0.05)
+        with lock:
+            active[key] -= 1
+            active["*"] -= 1
+
+    # 路径的上一级目录名作为设备标识
+    monkeypatch.setattr(multi_scan, "mount_key", lambda path: path.rstrip("/").split("/")[-2])
+    monkeypatch.setattr(MultiRootScanner, "_scan_one", staticmethod(fake_scan_one))
+    return peak, order
+
+
+def test_concurrency_limited_per_mount_and_globally(db, tmp_path, make_config, tracked_scans):
+    peak, order = tracked_scans
+    for device, roots in (("nas1", 4), ("nas2", 4), ("local", 2)):
+        for i in range(roots):
+            make_config(tmp_path / device / f"r{i}")
+
+    scan_ids = MultiRootScanner(mount_concurrency=2, max_concurrency=3).scan_all()
+
+    assert len(scan_ids) == len(order) == 10
+    assert Counter(order) == {"nas1": 4, "nas2": 4, "local": 2}
+    assert peak["*"] == 3
+    assert max(peak[key] for key in ("nas1", "nas2", "local")) == 2
+
+
+def test_single_mount_does_not_exceed_its_limit(db, tmp_path, make_config, tracked_scans):
+    peak, _ = tracked_scans
+    for i in range(5):
+        make_config(tmp_path / "nas1" / f"r{i}")
+
+    MultiRootScanner(mount_concurrency=1, max_concurrency=8).scan_all()
+
+    assert peak["nas1"] == peak["*"] == 1
+
+
+def test_scan_all_runs_active_configs(db, tmp_path, make_config):
+    configs = []
+    for name in ("a", "b", "c", "d"):
+        write_series(tmp_path / name, count=2)
+        configs.append(make_config(tmp_path / name))
+    configs[-1].is_active = False
+    db.commit()
+
+    scan_ids = MultiRootScanner(mount_concurrency=2, max_concurrency=2).scan_all()
+
+    db.expire_all()
+    scans = db.query(Scan).filter(Scan.id.in_(scan_ids)).all()
+    assert len(scans) == 3 and {scan.status for scan in scans} == {"completed"}
+    assert db.query(Series).count() == 3
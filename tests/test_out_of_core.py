@@ -0,0 +1,202 @@
+import os
+
+import pydicom
+import pytest
+from fastapi.testclient import TestClient
+
+from app.db.models import Scan, Series, SeriesPath
+from app.main import app
+from app.services.scan_service import ScanService
+from app.services.scanner import DicomScanner
+from app.services.series_staging import SeriesStaging, staging_path_for
+from tests.helpers import write_dicom, write_series
+
+
+@pytest.fixture
+def root(tmp_path):
+    """三个目录、三个序列，其中一个序列跨两个目录"""
+    root = tmp_path / "root"
+    uids = set()
+    for name in ("A", "B"):
+        uid, _ = write_series(root / name, count=3, patient_id=f"P{name}")
+        uids.add(uid)
+    split, paths = write_series(root / "C1", count=2, patient_id="PC")
+    study_uid = pydicom.dcmread(paths[0]).StudyInstanceUID
+    write_dicom(root / "C2" / "IM2.dcm", patient_id="PC", study_uid=study_uid, series_uid=split,
+                instance_number=3, z=4.0)
+    uids.add(split)
+    return root, uids, split
+
+
+def _catalog(db):
+    return {series.series_instance_uid: (series.file_count, series.file_size_total)
+            for series in db.query(Series)}
+
+
+def _assert_all_instances_once(db):
+    """9个实例：主路径在Series上，其余在SeriesPath中，不应有重复"""
+    paths = [path for (path,) in db.query(Series.file_path)]
+    paths += [path for (path,) in db.query(SeriesPath.file_path)]
+    assert len(paths) == len(set(paths)) == 9
+    assert sum(count for count, _ in _catalog(db).values()) == 9
+
+
+def _raise_interrupt(*args, **kwargs):
+    raise KeyboardInterrupt
+
+
+def test_staging_groups_series_across_directories(tmp_path):
+    staging = SeriesStaging(str(tmp_path / "staging.db"))
+    staging.add("2.2", "/d2/b", 20)
+    staging.add("1.1", "/d1/a", 10)
+    staging.mark_dir_done("/d1")
+    staging.add("1.1", "/d2/a", 30)
+    staging.mark_dir_done("/d2")
+
+    assert (staging.total_files(), staging.series_count()) == (3, 2)
+    assert staging.is_dir_done("/d1") and not staging.is_dir_done("/d3")
+    assert [(uid, files, sizes) for uid, files, sizes, _ in staging.iter_series()] == [
+        ("1.1", ["/d1/a", "/d2/a"], [10, 30]),
+        ("2.2", ["/d2/b"], [20]),
+    ]
+    assert [uid for uid, *_ in staging.iter_series(after_uid="1.1")] == ["2.2"]
+    staging.close()
+    assert not os.path.exists(tmp_path / "staging.db")
+
+
+def test_out_of_core_matches_in_memory_scan(db, root, make_config):
+    path, uids, split = root
+    config = make_config(path)
+
+    ScanService(db).run_scan(config.id)
+    in_memory = _catalog(db)
+    db.query(SeriesPath).delete()
+    db.query(Series).delete()
+    db.commit()
+
+    scan = ScanService(db).run_scan(config.id, out_of_core=True)
+
+    assert scan.status == "completed" and scan.checkpoint is None
+    assert (scan.series_found, scan.series_new) == (3, 3)
+    assert _catalog(db) == in_memory and set(in_memory) == uids
+    assert in_memory[split][0] == 3
+    assert not os.path.exists(staging_path_for(scan.id))
+
+
+def test_resume_after_interrupted_persist(db, root, make_config, monkeypatch):
+    path, uids, _ = root
+    persist_series = ScanService._persist_series
+    calls = []
+
+    def crash_on_second(self, *args, **kwargs):
+        calls.append(args[0])
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return persist_series(self, *args, **kwargs)
+
+    monkeypatch.setattr(ScanService, "COMMIT_BATCH_SIZE", 1)
+    monkeypatch.setattr(ScanService, "_persist_series", crash_on_second)
+    with pytest.raises(KeyboardInterrupt):
+        ScanService(db).run_scan(make_config(path).id, out_of_core=True)
+    db.rollback()
+    monkeypatch.undo()
+
+    assert ScanService.mark_orphaned_scans(db) == 1
+    scan = db.query(Scan).one()
+    assert scan.status == "interrupted"
+    checkpoint = scan.get_checkpoint()
+    assert checkpoint["walk_done"] and checkpoint["last_series_uid"] == calls[0]
+    assert checkpoint["series_new"] == 1 and db.query(Series).count() == 1
+    assert os.path.exists(checkpoint["staging_path"])
+
+    resumed = ScanService(db).resume_scan(scan.id)
+
+    assert resumed.status == "completed" and resumed.checkpoint is None
+    assert (resumed.series_found, resumed.series_new, resumed.series_duplicated) == (3, 3, 0)
+    assert set(_catalog(db)) == uids
+    _assert_all_instances_once(db)
+    assert not os.path.exists(checkpoint["staging_path"])
+
+
+def test_resume_skips_directories_already_staged(db, root, make_config, monkeypatch):
+    path, uids, _ = root
+    iter_dir_entries = DicomScanner.iter_dir_entries
+    walked = []
+    crashed = []
+
+    def crash_on_b(dirpath, *args, **kwargs):
+        walked.append(os.path.basename(dirpath))
+        if walked[-1] == "B" and not crashed:
+            crashed.append(dirpath)
+            raise KeyboardInterrupt
+        return iter_dir_entries(dirpath, *args, **kwargs)
+
+    monkeypatch.setattr(SeriesStaging, "BATCH_SIZE", 1)
+    monkeypatch.setattr(DicomScanner, "iter_dir_entries", staticmethod(crash_on_b))
+    with pytest.raises(KeyboardInterrupt):
+        ScanService(db).run_scan(make_config(path).id, out_of_core=True)
+    db.rollback()
+    ScanService.mark_orphaned_scans(db)
+
+    scan = db.query(Scan).one()
+    assert not scan.get_checkpoint().get("walk_done")
+    walked.clear()
+    resumed = ScanService(db).resume_scan(scan.id)
+
+    assert resumed.status == "completed"
+    assert "A" not in walked and "B" in walked
+    assert set(_catalog(db)) == uids
+    _assert_all_instances_once(db)
+
+
+def test_resume_rejects_finished_scan(db, root, make_config):
+    path, _, _ = root
+    scan = ScanService(db).run_scan(make_config(path).id)
+    with pytest.raises(ValueError):
+        ScanService(db).resume_scan(scan.id)
+
+
+def test_api_scans_are_resumable_by_default(db, root, make_config):
+    path, _, _ = root
+    config = make_config(path)
+    client = TestClient(app)
+
+    staged = client.post(f"/api/scan/{config.id}").json()
+    in_memory = client.post(f"/api/scan/{config.id}?out_of_core=false").json()
+
+    assert "stage" in client.get(f"/api/scans/{staged['id']}").json()["profile"]["stage_seconds"]
+    assert "stage" not in client.get(f"/api/scans/{in_memory['id']}").json()["profile"]["stage_seconds"]
+
+
+def test_resume_in_memory_scan_starts_over(db, root, make_config, monkeypatch):
+    path, uids, _ = root
+    monkeypatch.setattr(ScanService, "_persist_series_stream", _raise_interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        ScanService(db).run_scan(make_config(path).id)
+    db.rollback()
+    monkeypatch.undo()
+    ScanService.mark_orphaned_scans(db)
+
+    scan = db.query(Scan).one()
+    assert scan.checkpoint is None  # 内存模式不记录进度
+    resumed = ScanService(db).resume_scan(scan.id)
+
+    assert resumed.status == "completed" and set(_catalog(db)) == uids
+    _assert_all_instances_once(db)
+
+def test_orphaned_scans_by_type(db):
+    for scan_id, scan_type in (("legacy", None), ("manual", "manual"), ("watch", "watch"),
+                               ("dist", "distributed")):
+        db.add(Scan(id=scan_id, scan_path="/data", scan_type=scan_type, status="running"))
+    db.add(Scan(id="old-watch", scan_path="/data", scan_type="watch", status="failed"))
+    db.commit()
+
+    assert ScanService.mark_orphaned_scans(db) == 2
+
+    db.expire_all()
+    statuses = {scan.id: scan.status for scan in db.query(Scan)}
+    assert statuses == {"legacy": "interrupted", "manual": "interrupted", "watch": "completed",
+                        "dist": "running", "old-watch": "failed"}
+    # 续扫监听记录会从头扫描整个监听目录，直接拒绝
+    with pytest.raises(ValueError):
+        ScanService(db).resume_scan("old-watch")
@@ -0,0 +1,46 @@
+import zipfile
+
+from app.db.models import Series
+from app.services import archives
+from app.services.scan_profile import ScanProfile
+from app.services.scan_service import ScanService
+from app.services.scanner import DicomScanner
+from tests.helpers import write_dicom, write_series
+
+
+def _without_series_uid(path):
+    ds = write_dicom(path)
+    del ds.SeriesInstanceUID
+    ds.save_as(str(path), enforce_file_format=True)
+
+
+def test_file_without_series_uid_is_reported(db, tmp_path, make_config):
+    root = tmp_path / "root"
+    write_series(root / "ok", count=2)
+    _without_series_uid(root / "bad" / "IM0.dcm")
+    _without_series_uid(tmp_path / "member.dcm")
+    with zipfile.ZipFile(root / "bad" / "a.zip", "w") as archive:
+        archive.write(tmp_path / "member.dcm", "IM1.dcm")
+
+    scan = ScanService(db).run_scan(make_config(root).id)
+
+    profile = scan.get_profile()
+    assert profile["files_parsed"] == 2
+    failures = profile["parse_failures"]["MissingSeriesUIDError"]
+    assert failures["count"] == 2
+    assert {sample["path"] for sample in failures["samples"]} == {
+        str(root / "bad" / "IM0.dcm"), archives.member_path(str(root / "bad" / "a.zip"), "IM1.dcm"),
+    }
+    assert db.query(Series).count() == 1
+
+
+def test_walk_and_parse_timed_separately(tmp_path):
+    write_series(tmp_path / "a", count=2)
+    profile = ScanProfile()
+
+    entries = [entry for _, dir_entries in DicomScanner.iter_series_dirs(str(tmp_path), profile)
+               for entry in dir_entries]
+
+    assert len(entries) == 2
+    assert set(profile.stage_seconds) == {"walk", "parse"}
+    assert profile.files_parsed == 2 and profile.files_walked == 2
@@ -0,0 +1,119 @@
+import shutil
+
+import pytest
+from fastapi.testclient import TestClient
+from pydicom.uid import generate_uid
+
+from app.db.models import Series
+from app.main import app
+from app.services.scan_service import ScanService
+from app.services.scanner import DicomScanner
+from app.services.series_geometry import InstanceGeometry, analyze_geometry
+from tests.helpers import write_dicom, write_series
+
+AXIAL = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0)
+
+
+def _axial(z_values, numbers=None, orientation=AXIAL):
+    numbers = numbers or range(1, len(z_values) + 1)
+    return [InstanceGeometry(n, (0.0, 0.0, float(z)), orientation) for n, z in zip(numbers, z_values)]
+
+
+def test_complete_series():
+    # 顺序打乱不影响结果
+    result = analyze_geometry(_axial([4, 0, 2, 6]))
+    assert result == {
+        "slice_count": 4,
+        "slice_spacing": 2.0,
+        "missing_slices": 0,
+        "duplicate_slices": 0,
+        "orientation_consistent": True,
+        "missing_instance_numbers": 0,
+        "geometry_ok": True,
+    }
+
+
+def test_gap_duplicate_and_numbering():
+    gap = analyze_geometry(_axial([0, 2, 4, 10, 12]))
+    assert (gap["slice_spacing"], gap["missing_slices"], gap["geometry_ok"]) == (2.0, 2, False)
+
+    duplicate = analyze_geometry(_axial([0, 2, 2, 4], numbers=[1, 2, 3, 6]))
+    assert (duplicate["slice_count"], duplicate["duplicate_slices"]) == (3, 1)
+    assert duplicate["missing_instance_numbers"] == 2 and duplicate["geometry_ok"] is False
+
+
+def test_oblique_series_projects_on_normal():
+    # 沿斜向法向排列的层，层距按法向投影计算
+    orientation = (1.0, 0.0, 0.0, 0.0, 0.6, -0.8)
+    normal = (0.0, 0.8, 0.6)
+    geometries = [InstanceGeometry(i + 1, tuple(v * 3 * i for v in normal), orientation) for i in range(4)]
+    result = analyze_geometry(geometries)
+    assert result["slice_spacing"] == pytest.approx(3.0)
+    assert result["geometry_ok"] is True
+
+
+def test_inconsistent_orientation_and_missing_geometry():
+    mixed = _axial([0, 2]) + _axial([4], orientation=(0.0, 1.0, 0.0, 0.0, 0.0, -1.0))
+    assert analyze_geometry(mixed)["orientation_consistent"] is False
+    assert analyze_geometry(mixed)["geometry_ok"] is False
+
+    # 只有实例编号（例如DICOMDIR索引）时只能判断编号连续性
+    numbers_only = analyze_geometry([InstanceGeometry(1, None, None), InstanceGeometry(3, None, None), None])
+    assert numbers_only["missing_instance_numbers"] == 1
+    assert numbers_only["slice_count"] is None and numbers_only["geometry_ok"] is None
+
+
+@pytest.mark.parametrize("out_of_core", [False, True])
+def test_scan_flags_incomplete_series(db, tmp_path, make_config, out_of_core):
+    root = tmp_path / "root"
+    complete, _ = write_series(root / "OK", count=4, spacing=2.5)
+    gap, duplicate = generate_uid(), generate_uid()
+    for i, z in enumerate([0, 2, 4, 8, 10]):
+        write_dicom(root / "G" / f"IM{i}.dcm", series_uid=gap, instance_number=i + 1, z=z)
+    for i, (number, z) in enumerate([(1, 0), (2, 2), (3, 2), (6, 4)]):
+        write_dicom(root / "D" / f"IM{i}.dcm", series_uid=duplicate, instance_number=number, z=z)
+
+    ScanService(db).run_scan(make_config(root).id, out_of_core=out_of_core)
+
+    series = {s.series_instance_uid: s for s in db.query(Series)}
+    assert series[complete].geometry_ok is True and series[complete].slice_spacing == 2.5
+    assert (series[gap].missing_slices, series[gap].geometry_ok) == (1, False)
+    assert (series[duplicate].duplicate_slices, series[duplicate].missing_instance_numbers) == (1, 2)
+
+    client = TestClient(app)
+    assert client.get("/api/series/count?geometry_ok=false").json()["total"] == 2
+    listed = client.get("/api/series?geometry_ok=true&max_slice_spacing=3").json()
+    assert [s["series_instance_uid"] for s in listed] == [complete]
+
+
+def test_appended_instances_update_geometry(db, tmp_path, make_config):
+    series_uid, _ = write_series(tmp_path / "root", count=3)
+    ScanService(db).run_scan(make_config(tmp_path / "root").id)
+    series = db.query(Series).one()
+
+    # 跳过一层后追加：出现缺层；补齐后恢复
+    late = str(tmp_path / "late" / "IM4.dcm")
+    write_dicom(late, study_uid=series.study_instance_uid, series_uid=series_uid, instance_number=5, z=8.0)
+    record = DicomScanner.read_record(late)
+    ScanService(db).ingest_files(series_uid, [late], "scan", [record.file_size], [record.geometry])
+    db.refresh(series)
+    assert (series.missing_slices, series.geometry_ok, series.file_count) == (1, False, 4)
+
+    fill = str(tmp_path / "late" / "IM3.dcm")
+    write_dicom(fill, study_uid=series.study_instance_uid, series_uid=series_uid, instance_number=4, z=6.0)
+    record = DicomScanner.read_record(fill)
+    ScanService(db).ingest_files(series_uid, [fill], "scan", [record.file_size], [record.geometry])
+    db.refresh(series)
+    assert (series.slice_count, series.geometry_ok, series.file_count) == (5, True, 5)
+
+
+def test_copied_files_are_not_duplicate_slices(db, tmp_path, make_config):
+    # 同一根目录下的备份副本不是重复层，与之后追加副本的结果一致
+    series_uid, _ = write_series(tmp_path / "root" / "a", count=4)
+    shutil.copytree(tmp_path / "root" / "a", tmp_path / "root" / "backup")
+
+    ScanService(db).run_scan(make_config(tmp_path / "root").id)
+
+    series = db.query(Series).one()
+    assert (series.slice_count, series.duplicate_slices, series.missing_slices) == (4, 0, 0)
+    assert series.geometry_ok is True
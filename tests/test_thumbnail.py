@@ -0,0 +1,71 @@
+import os
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app.db.database import engine
+from app.db.models import Series
+from app.main import app
+from app.services import thumbnail_service
+from app.services.scan_service import ScanService
+from app.services.scanner import DicomScanner
+from tests.helpers import write_dicom, write_series
+
+
+def test_middle_instance_uses_stored_numbers():
+    # 路径不存在：有编号时不读文件；副本（无编号）不参与排序
+    instances = [("/missing/c", 3), ("/missing/a", 1), ("/missing/copy", None),
+                 ("/missing/b", 2), ("/missing/d", 4), ("/missing/e", 5)]
+    assert thumbnail_service.middle_instance(instances) == "/missing/c"
+
+
+def test_middle_instance_samples_headers_without_numbers(tmp_path):
+    series_uid, paths = write_series(tmp_path, count=5)
+    # 文件名顺序与编号相反
+    for path, number in zip(paths, range(5, 0, -1)):
+        write_dicom(path, series_uid=series_uid, instance_number=number, z=number)
+    assert thumbnail_service.middle_instance([(p, None) for p in paths]) == paths[2]
+
+
+def test_thumbnail_endpoint_regenerates_after_append(db, tmp_path, make_config, monkeypatch):
+    cache = thumbnail_service.ThumbnailCache(str(tmp_path / "thumbs"))
+    monkeypatch.setattr(thumbnail_service, "thumbnail_cache", cache)
+    series_uid, _ = write_series(tmp_path / "root", count=3)
+    ScanService(db).run_scan(make_config(tmp_path / "root").id)
+    series = db.query(Series).one()
+    client = TestClient(app)
+
+    response = client.get(f"/api/series/{series.id}/thumbnail?size=64")
+    assert response.status_code == 200
+    assert response.content.startswith(b"\x89PNG\r\n\x1a\n")
+
+    extra = str(tmp_path / "more" / "IM3.dcm")
+    write_dicom(extra, study_uid=series.study_instance_uid, series_uid=series_uid, instance_number=4, z=6.0)
+    record = DicomScanner.read_record(extra)
+    ScanService(db).ingest_files(series_uid, [extra], "scan", [record.file_size], [record.geometry])
+
+    assert client.get(f"/api/series/{series.id}/thumbnail?size=64").status_code == 200
+    assert sorted(os.listdir(cache.directory)) == [f"{series.id}_3_64.png", f"{series.id}_4_64.png"]
+
+
+def test_cache_hit_does_not_load_instances(db, tmp_path, make_config, monkeypatch):
+    cache = thumbnail_service.ThumbnailCache(str(tmp_path / "thumbs"))
+    monkeypatch.setattr(thumbnail_service, "thumbnail_cache", cache)
+    write_series(tmp_path / "root", count=5)
+    ScanService(db).run_scan(make_config(tmp_path / "root").id)
+    series = db.query(Series).one()
+    client = TestClient(app)
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        assert client.get(f"/api/series/{series.id}/thumbnail?size=64").status_code == 200
+        assert any("series_paths" in s for s in statements)
+        statements.clear()
+        assert client.get(f"/api/series/{series.id}/thumbnail?size=64").status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert statements and not any("series_paths" in s for s in statements)
@@ -0,0 +1,112 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from pydicom.uid import generate_uid
+
+from app.db.models import Scan, Series
+from app.main import app
+from app.services import watch_service
+from app.services.scan_service import ScanService
+from app.services.watch_service import SeriesWatcher, watch_manager
+from tests.helpers import write_dicom
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(watch_service, "POLLING_INTERVAL", 0.1)
+
+
+@pytest.fixture
+def ingests(monkeypatch):
+    """记录每次入库的文件数"""
+    calls = []
+    ingest_files = ScanService.ingest_files
+
+    def counting(self, series_uid, file_list, *args, **kwargs):
+        calls.append(len(file_list))
+        return ingest_files(self, series_uid, file_list, *args, **kwargs)
+
+    monkeypatch.setattr(ScanService, "ingest_files", counting)
+    return calls
+
+
+def _wait_until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _write_burst(directory, series_uid, numbers):
+    for number in numbers:
+        write_dicom(directory / f"IM{number}.dcm", series_uid=series_uid, study_uid="1.2.3",
+                    instance_number=number, z=number * 2.0)
+
+
+def test_quiet_series_ingested_once_per_burst(db, tmp_path, ingests):
+    root = tmp_path / "watched"
+    root.mkdir()
+    watcher = SeriesWatcher(1, str(root), quiet_seconds=1, force_polling=True)
+    watcher.start()
+    series_uid = generate_uid()
+    try:
+        # 静默期内连续写入的文件合并为一次入库
+        _write_burst(root / "S", series_uid, range(1, 4))
+        assert _wait_until(lambda: watcher.files_ingested == 3)
+        _write_burst(root / "S", series_uid, range(4, 6))
+        assert _wait_until(lambda: watcher.files_ingested == 5)
+    finally:
+        watcher.stop()
+
+    assert ingests == [3, 2]
+    assert (watcher.series_new, watcher.series_updated) == (1, 0)
+    scan = db.get(Scan, watcher.scan_id)
+    assert (scan.series_found, scan.series_new, scan.status) == (1, 1, "completed")
+    assert db.query(Series).one().file_count == 5
+
+
+def test_existing_series_counted_once(db, tmp_path, make_config, ingests):
+    root = tmp_path / "watched"
+    series_uid = generate_uid()
+    _write_burst(root / "S", series_uid, [1])
+    ScanService(db).run_scan(make_config(root).id)
+
+    watcher = SeriesWatcher(1, str(root), quiet_seconds=1, force_polling=True)
+    watcher.start()
+    try:
+        _write_burst(root / "S", series_uid, [2])
+        assert _wait_until(lambda: watcher.files_ingested == 1)
+        _write_burst(root / "S", series_uid, [3])
+        assert _wait_until(lambda: watcher.files_ingested == 2)
+    finally:
+        watcher.stop()
+
+    assert ingests == [1, 1]
+    assert (watcher.series_new, watcher.series_updated) == (0, 1)
+    assert db.get(Scan, watcher.scan_id).series_found == 1
+
+
+def test_config_update_restarts_watcher(db, tmp_path, make_config):
+    old, new = tmp_path / "old", tmp_path / "new"
+    old.mkdir()
+    new.mkdir()
+    config = make_config(old)
+    client = TestClient(app)
+    watch_manager.start(config, force_polling=True)
+    try:
+        body = {"scan_path": str(tmp_path / "missing"), "watch_quiet_seconds": 1}
+        assert client.put(f"/api/configs/{config.id}", json=body).status_code == 400
+        assert watch_manager.get(config.id).scan_path == str(old)
+
+        body["scan_path"] = str(new)
+        assert client.put(f"/api/configs/{config.id}", json=body).status_code == 200
+        watcher = watch_manager.get(config.id)
+        assert (watcher.scan_path, watcher.quiet_seconds, watcher.polling) == (str(new), 1, True)
+
+        _write_burst(new / "S", generate_uid(), [1, 2])
+        assert _wait_until(lambda: watcher.files_ingested == 2)
+    finally:
+        watch_manager.stop(config.id)